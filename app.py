@@ -3,10 +3,25 @@ import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
-import joblib
 import json  # Import for loading metrics
+import threading
+import time
 from datetime import datetime, timedelta
 
+from src.clinic_aggregates import CRITICAL_RISK_THRESHOLD, HIGH_RISK_THRESHOLD, RISK_BIN_WIDTH, ClinicAggregates
+from src.feature_cache import feature_cache_key, load_feature_tables
+from src.downsampling import DEFAULT_MAX_POINTS, TREND_THRESHOLDS, trend_points
+from src.explanations import FEATURE_LABELS, as_compiled, explain, top_drivers
+from src.features import MODEL_FEATURES
+from src.ingestion import LIVE_DIR, LiveScores, raw_data_key
+from src.instrumentation import is_enabled, recent_spans, span
+from src.patient_index import PatientIndex
+from src.risk_table import load_risk_table, risk_table_key, serving_model_path
+from src.scoring import MODEL_PATH, load_model
+
+# Start of this rerun, for the timings debug panel
+rerun_started = time.time()
+
 # Page config
 st.set_page_config(
     page_title="AVF Failure Risk Monitor",
@@ -79,111 +94,87 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 
-# --- ADD THIS HELPER FUNCTION ---
-def calculate_slope(series):
-    """Calculate linear regression slope"""
-    if len(series) < 2:
-        return 0
-    x = np.arange(len(series))
-    slope = np.polyfit(x, series, 1)[0]
-    return slope
-
-
-# --- END ADD ---
-
-# Load data
-@st.cache_data
-def load_data():
-    patients = pd.read_csv('data/raw/patients_baseline.csv')
-    treatments = pd.read_csv('data/raw/treatments_baseline.csv')
-    outcomes = pd.read_csv('data/raw/outcomes_baseline.csv')
-
-    # Merge for full dataset
-    full_data = treatments.merge(patients, on='patient_id')
-    full_data = full_data.merge(outcomes[['patient_id', 'failed']], on='patient_id')
-
-    # Combine alarm features - common for models
-    full_data['total_alarms'] = full_data['high_vp_alarms'] + full_data['low_ap_alarms']
-
-    # --- ADD ALL FEATURE ENGINEERING FROM NOTEBOOK ---
-    # Sort treatments by patient and treatment number
-    full_data = full_data.sort_values(['patient_id', 'treatment_number'])
-
-    # Calculate rolling averages and trends for key variables
-    rolling_windows = [4, 12]  # Last 4 treatments (~1 week) and last 12 treatments (~1 month)
-
-    for window in rolling_windows:
-        # Rolling mean
-        full_data[f'qa_rolling_mean_{window}'] = full_data.groupby('patient_id')['access_blood_flow_qa'].transform(
-            lambda x: x.rolling(window, min_periods=1).mean()
-        )
-        full_data[f'svpr_rolling_mean_{window}'] = full_data.groupby('patient_id')['svpr'].transform(
-            lambda x: x.rolling(window, min_periods=1).mean()
-        )
-        full_data[f'recirculation_rolling_mean_{window}'] = full_data.groupby('patient_id')[
-            'access_recirculation_pct'].transform(
-            lambda x: x.rolling(window, min_periods=1).mean()
-        )
-        # Rolling std
-        full_data[f'qa_rolling_std_{window}'] = full_data.groupby('patient_id')['access_blood_flow_qa'].transform(
-            lambda x: x.rolling(window, min_periods=1).std().fillna(0)
-        )
-
-    # Calculate change from baseline (first 4 treatments)
-    full_data['qa_baseline'] = full_data.groupby('patient_id')['access_blood_flow_qa'].transform(
-        lambda x: x.head(4).mean()
-    )
-    full_data['qa_change_from_baseline'] = full_data['access_blood_flow_qa'] - full_data['qa_baseline']
-    full_data['qa_pct_change_from_baseline'] = (full_data['qa_change_from_baseline'] / full_data['qa_baseline']) * 100
-
-    # Calculate trend (slope over last 12 treatments)
-    full_data['qa_trend_12'] = full_data.groupby('patient_id')['access_blood_flow_qa'].transform(
-        lambda x: x.rolling(12, min_periods=2).apply(calculate_slope, raw=False).fillna(0)
-    )
-
-    # Encode categorical variables
-    full_data['sex_encoded'] = (full_data['sex'] == 'F').astype(int)
-
-    # Fill any NaNs created by baseline % change (for first few rows)
-    full_data = full_data.fillna(0)
-    # --- END ADD ---
-
-    return patients, treatments, outcomes, full_data
-
-
-@st.cache_resource
-def load_model():
-    # Load your trained model
-    return joblib.load('models/rf_avf_failure_model.pkl')
+# Raw treatment columns needed for feature engineering and the Patient Detail page
+TREATMENT_COLUMNS = [
+    'patient_id', 'treatment_number', 'access_blood_flow_qa', 'venous_pressure_mean',
+    'svpr', 'access_recirculation_pct', 'ktv', 'high_vp_alarms', 'low_ap_alarms'
+]
+DATA_COLUMNS = {
+    'treatments': TREATMENT_COLUMNS,
+    'outcomes': ['patient_id', 'failed', 'failure_treatment_number'],
+}
+
+
+# Load data (data_key ties the cached frames to the current raw tables and feature code)
+@st.cache_resource(max_entries=1)
+def load_data(data_key):
+    # Prefers Parquet/Feather copies of the raw tables and only reads the columns used here.
+    # The engineered features come from data/cache/ unless the raw tables or feature code changed.
+    # Shared across reruns rather than copied into each one: the app never modifies these frames.
+    # Patient attributes are kept once per patient, not repeated on every treatment row.
+    return load_feature_tables(columns=DATA_COLUMNS)
+
+
+@st.cache_resource(max_entries=1)
+def load_patient_index(data_key, _patients, _outcomes, _full_data):
+    # Row offsets per patient, so Patient Detail slices one history instead of scanning every table
+    return PatientIndex(_patients, _outcomes, _full_data)
+
+
+@st.cache_resource(max_entries=1)
+def load_risk_scores(data_key, risk_key, model_path, _full_data, _patient_features):
+    # Scores every treatment once per data and model version; reruns only look them up
+    return load_risk_table(_full_data, risk_key, model_path, patient_features=_patient_features)
+
+
+@st.cache_resource(max_entries=1)
+def load_explainer(model_path):
+    # Only needed to explain sessions that arrived live; everything else is cached with the risk scores
+    return as_compiled(load_model(model_path))
+
+
+@st.cache_resource(max_entries=1)
+def load_live_scores(data_key):
+    # Sessions scored by the ingestion worker (python -m src.ingestion); each rerun reads only new batches
+    return LiveScores(LIVE_DIR, raw_data_key())
+
+
+@st.cache_resource(max_entries=1)
+def load_clinic_aggregates(risk_key, _latest):
+    # Per-clinic counts, histogram bins and age-group sums; live sessions update them incrementally
+    return ClinicAggregates(_latest)
+
+
+@st.cache_data(max_entries=256)
+def chart_points(data_key, patient_id, n_sessions, column, window, _history):
+    # Rows of a patient's history drawn in one trend chart at one zoom window; n_sessions changes with live data
+    return trend_points(_history['treatment_number'].to_numpy(), _history[column].to_numpy(), DEFAULT_MAX_POINTS,
+                        [TREND_THRESHOLDS[column]], window)
 
 
 # Load everything
 try:
-    patients, treatments, outcomes, full_data = load_data()
-    model = load_model()
+    with span('app.load'):
+        # Cheap on every rerun: file stats plus remembered content hashes
+        data_key = feature_cache_key(DATA_COLUMNS)
+        # The pickle scores the whole history on every core; the compiled export explains live rows
+        model_path = MODEL_PATH
+        explainer_path = serving_model_path()
+        risk_key = risk_table_key(data_key, model_path)
+        # full_data holds the treatment-level features; patient-level ones are joined only to score
+        patients, outcomes, full_data, patient_features = load_data(data_key)
+        patient_index = load_patient_index(data_key, patients, outcomes, full_data)
+        risk_table = load_risk_scores(data_key, risk_key, str(model_path), full_data, patient_features)
+        live_scores = load_live_scores(data_key)
+        live_scores.refresh()
+        clinic_aggregates = load_clinic_aggregates(risk_key, risk_table.latest)
+        clinic_aggregates.sync(live_scores)
     model_loaded = True
 except Exception as e:
     model_loaded = False
     st.error(f"⚠️ Error loading data or model: {e}")
-    st.info("Please ensure data/raw/*.csv files and models/rf_avf_failure_model.pkl exist.")
-
-# ---  ACTION REQUIRED ---
-# This list MUST match the features your model was trained on,
-# in the exact same order.
-MODEL_FEATURES = [
-    'age', 'diabetes', 'hypertension', 'cad', 'pvd',
-    'prior_interventions', 'history_cvc', 'baseline_risk_score',
-    'access_blood_flow_qa', 'venous_pressure_mean', 'svpr',
-    'access_recirculation_pct', 'ktv',
-    'high_vp_alarms', 'low_ap_alarms',
-    'qa_rolling_mean_4', 'qa_rolling_mean_12',
-    'svpr_rolling_mean_4', 'svpr_rolling_mean_12',
-    'recirculation_rolling_mean_4', 'recirculation_rolling_mean_12',
-    'qa_rolling_std_4', 'qa_rolling_std_12',
-    'qa_trend_12', 'qa_pct_change_from_baseline',
-    'sex_encoded'
-]
-# -------------------------
+    st.info("Please ensure data/raw/ tables (.parquet, .feather or .csv) and models/rf_avf_failure_model.pkl exist.")
+
 
 
 # Header with better styling
@@ -200,7 +191,7 @@ st.markdown("---")
 if model_loaded:
     # Check if all required features are present
     # This check will now pass
-    missing_features = [f for f in MODEL_FEATURES if f not in full_data.columns]
+    missing_features = [f for f in MODEL_FEATURES if f not in full_data.columns and f not in patient_features.columns]
     if missing_features:
         st.error(f"Error: The data is missing the following required features for the model: {missing_features}")
         st.stop()  # Don't run the app if features are missing
@@ -209,341 +200,364 @@ if model_loaded:
     st.sidebar.header("Navigation")
     page = st.sidebar.radio("Select View",
                             ["Clinic Overview", "Patient Detail", "Model Performance"])
+    if live_scores.batches:
+        st.sidebar.caption(f"Live: {len(live_scores.rows):,} new sessions, "
+                           f"last scored {live_scores.updated_at:%H:%M:%S}")
+        st.sidebar.button("Refresh live data")
+
+    # Server-side time spent building the selected page
+    with span('app.page', page=page):
+        # Latest treatment of every patient with its precomputed risk score, updated by live sessions
+        latest_treatments = live_scores.apply_latest(risk_table.latest)
+
+        def latest_contributions(rows):
+            # Per-feature contributions to the risk of these latest_treatments rows:
+            # cached, or computed now for live rows
+            contributions = risk_table.contributions.iloc[rows]
+            is_live = latest_treatments['patient_id'].iloc[rows].astype(str).isin(live_scores.latest.index).to_numpy()
+            if is_live.any():
+                contributions = contributions.copy()
+                contributions.iloc[is_live] = explain(load_explainer(str(explainer_path)),
+                                                      latest_treatments.iloc[rows[is_live]]).to_numpy()
+            return contributions
+
+        # PAGE 1: CLINIC OVERVIEW
+        if page == "Clinic Overview":
+            st.header("📊 Clinic Overview")
+
+            # Every number on this page comes from the pre-aggregated clinic shards
+            selected_clinics = None
+            if len(clinic_aggregates.clinic_ids) > 1:
+                clinic = st.selectbox("Clinic", ["All clinics"] + clinic_aggregates.clinic_ids)
+                if clinic != "All clinics":
+                    selected_clinics = [clinic]
+            overview = clinic_aggregates.summary(selected_clinics)
+
+            # Key metrics
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Total Patients", overview['n_patients'])
+            with col2:
+                st.metric(f"High Risk Patients (>{HIGH_RISK_THRESHOLD}%)",
+                          overview['high_risk'],
+                          delta=f"{overview['high_risk'] / overview['n_patients'] * 100:.1f}%")
+            with col3:
+                st.metric(f"Critical Alerts (>{CRITICAL_RISK_THRESHOLD}%)", overview['critical'])
+            with col4:
+                st.metric("Average Risk Score", f"{overview['mean_risk']:.1f}%")
+
+            if selected_clinics is None and len(clinic_aggregates.clinic_ids) > 1:
+                st.markdown("---")
+                st.subheader("🏥 Clinics")
+                clinic_table = clinic_aggregates.per_clinic().rename(columns={
+                    'clinic_id': 'Clinic',
+                    'patients': 'Patients',
+                    'high_risk': f'High Risk (>{HIGH_RISK_THRESHOLD}%)',
+                    'critical': f'Critical (>{CRITICAL_RISK_THRESHOLD}%)',
+                    'mean_risk': 'Average Risk (%)'
+                }).round(1)
+                st.dataframe(clinic_table, use_container_width=True, height=300)
+
+            st.markdown("---")
+
+            # High risk patient table
+            st.subheader(f"⚠️ High Risk Patients (Risk > {HIGH_RISK_THRESHOLD}%)")
+
+            if overview['high_risk'] > 0:
+                # The 15 highest-risk patients, looked up in latest_treatments by row
+                rows = clinic_aggregates.top_rows(15, HIGH_RISK_THRESHOLD, selected_clinics)
+                display_table = latest_treatments.iloc[rows].copy()
+                # The model's own top drivers, from the contributions cached with the risk scores
+                display_table['top_risk_factor'] = top_drivers(latest_contributions(rows), n=2).to_numpy()
+                display_table['risk_score'] = display_table['risk_score'].round(1)
+
+                # Rename columns for display
+                display_table = display_table.rename(columns={
+                    'patient_id': 'Patient ID',
+                    'risk_score': 'Risk Score (%)',
+                    'age': 'Age',
+                    'access_blood_flow_qa': 'Current Qa (mL/min)',
+                    'svpr': 'Current SVPR',
+                    'top_risk_factor': 'Top Risk Drivers'
+                })
+
+                # Reorder for clarity
+                display_table = display_table[
+                    ['Patient ID', 'Risk Score (%)', 'Top Risk Drivers', 'Current Qa (mL/min)', 'Current SVPR', 'Age']]
+
+                st.dataframe(display_table, use_container_width=True, height=400)
+            else:
+                st.success("✅ No high-risk patients detected")
 
-    # --- NEW RISK CALCULATION (for Clinic Overview) ---
-    # We do this once for the whole app
-    latest_treatments = full_data.groupby('patient_id').tail(1).copy()
-
-    # Get predictions for all patients
-    # 'sex_encoded' is now in full_data, so this line is no longer needed
-    # latest_treatments['sex_encoded'] = (latest_treatments['sex'] == 'F').astype(int)
-    X_predict = latest_treatments[MODEL_FEATURES]
-    pred_probabilities = model.predict_proba(X_predict)[:, 1]  # Get prob of 'failure' (class 1)
-
-    # Add new risk score to the dataframe
-    latest_treatments['risk_score'] = pred_probabilities * 100
-
-    # Filter for high-risk patients
-    high_risk_patients = latest_treatments[latest_treatments['risk_score'] > 70].sort_values(
-        'risk_score', ascending=False
-    )
-
-    # PAGE 1: CLINIC OVERVIEW
-    if page == "Clinic Overview":
-        st.header("📊 Clinic Overview")
-
-        # Key metrics
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.metric("Total Patients", len(patients))
-        with col2:
-            st.metric("High Risk Patients (>70%)",
-                      len(high_risk_patients),
-                      delta=f"{len(high_risk_patients) / len(patients) * 100:.1f}%")
-        with col3:
-            st.metric("Critical Alerts (>85%)",
-                      len(high_risk_patients[high_risk_patients['risk_score'] > 85]))
-        with col4:
-            avg_risk = latest_treatments['risk_score'].mean()
-            st.metric("Average Risk Score", f"{avg_risk:.1f}%")
-
-        st.markdown("---")
-
-        # High risk patient table
-        st.subheader("⚠️ High Risk Patients (Risk > 70%)")
-
-        if len(high_risk_patients) > 0:
-            def get_top_risk_factor(row):
-                # This heuristic is fine to keep, as it explains the *why*
-                if row['access_blood_flow_qa'] < 600:
-                    return "Low Qa (< 600 mL/min)"
-                elif row['svpr'] > 0.8:
-                    return "Elevated SVPR"
-                elif row['access_recirculation_pct'] > 10:
-                    return "High Recirculation"
-                elif row['diabetes'] == 1:
-                    return "Diabetes + Risk Factors"
-                else:
-                    return "Multiple Factors"
+            st.markdown("---")
 
+            # Risk distribution
+            col1, col2 = st.columns(2)
+            with col1:
+                st.subheader("Risk Score Distribution")
+                # Pre-binned counts, drawn as a histogram
+                risk_histogram = overview['risk_histogram']
+                fig = px.bar(
+                    x=risk_histogram['bin_start'] + RISK_BIN_WIDTH / 2,
+                    y=risk_histogram['patients'],
+                    labels={'x': 'Risk Score (%)', 'y': 'count'},
+                    title='Patient Risk Distribution'
+                )
+                fig.update_layout(showlegend=False, bargap=0)
+                st.plotly_chart(fig, use_container_width=True)
 
-            # Create the display table from the already-calculated latest_treatments
-            display_table = latest_treatments[latest_treatments['risk_score'] > 70].copy()
-            display_table['top_risk_factor'] = display_table.apply(get_top_risk_factor, axis=1)
-            display_table['risk_score'] = display_table['risk_score'].round(1)
+            with col2:
+                st.subheader("Risk by Age Group")
+                age_risk = overview['age_group_risk']
 
-            # Rename columns for display
-            display_table = display_table.rename(columns={
-                'patient_id': 'Patient ID',
-                'risk_score': 'Risk Score (%)',
-                'age': 'Age',
-                'access_blood_flow_qa': 'Current Qa (mL/min)',
-                'svpr': 'Current SVPR',
-                'top_risk_factor': 'Top Risk Factor'
-            })
+                fig = px.bar(
+                    age_risk,
+                    x='age_group',
+                    y='risk_score',
+                    labels={'age_group': 'Age Group', 'risk_score': 'Average Risk Score (%)'},
+                    title='Average Risk Score by Age Group'
+                )
+                st.plotly_chart(fig, use_container_width=True)
 
-            # Reorder for clarity
-            display_table = display_table[
-                ['Patient ID', 'Risk Score (%)', 'Top Risk Factor', 'Current Qa (mL/min)', 'Current SVPR', 'Age']]
+        # PAGE 2: PATIENT DETAIL
+        elif page == "Patient Detail":
+            st.header("👤 Individual Patient Analysis")
 
-            st.dataframe(display_table.head(15), use_container_width=True, height=400)
-        else:
-            st.success("✅ No high-risk patients detected")
-
-        st.markdown("---")
-
-        # Risk distribution
-        col1, col2 = st.columns(2)
-        with col1:
-            st.subheader("Risk Score Distribution")
-            # This graph is now fixed and will show the model's predictions
-            fig = px.histogram(
-                latest_treatments,
-                x='risk_score',
-                nbins=20,
-                labels={'risk_score': 'Risk Score (%)'},
-                title='Patient Risk Distribution'
-            )
-            fig.update_layout(showlegend=False)
-            st.plotly_chart(fig, use_container_width=True)
+            # Patient selector
+            selected_patient = st.selectbox("Select Patient ID", patient_index.patient_ids)
 
-        with col2:
-            st.subheader("Risk by Age Group")
-            latest_treatments['age_group'] = pd.cut(
-                latest_treatments['age'],
-                bins=[0, 40, 50, 60, 70, 100],
-                labels=['<40', '40-50', '50-60', '60-70', '70+']
-            )
-            age_risk = latest_treatments.groupby('age_group')['risk_score'].mean().reset_index()
-
-            fig = px.bar(
-                age_risk,
-                x='age_group',
-                y='risk_score',
-                labels={'age_group': 'Age Group', 'risk_score': 'Average Risk Score (%)'},
-                title='Average Risk Score by Age Group'
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            # Get patient data from the index: row slices, no table scans
+            patient_info = patient_index.patient(selected_patient)
+            # Use full_data (all engineered features), already in treatment order, plus any live sessions
+            patient_treatments = live_scores.extend_history(selected_patient, patient_index.history(selected_patient))
+            patient_outcome = patient_index.outcome(selected_patient)
 
-    # PAGE 2: PATIENT DETAIL
-    elif page == "Patient Detail":
-        st.header("👤 Individual Patient Analysis")
-
-        # Patient selector
-        patient_list = sorted(patients['patient_id'].unique())
-        selected_patient = st.selectbox("Select Patient ID", patient_list)
-
-        # Get patient data
-        # --- FIX: Use the full_data df which has all engineered features ---
-        patient_info = patients[patients['patient_id'] == selected_patient].iloc[0]
-        # Use full_data, not the raw 'treatments' df
-        patient_treatments = full_data[full_data['patient_id'] == selected_patient].sort_values('treatment_number')
-        patient_outcome = outcomes[outcomes['patient_id'] == selected_patient].iloc[0]
-
-        # Get the latest treatment row *from the engineered dataframe*
-        latest = patient_treatments.iloc[-1]
-
-        # --- 5. NEW RISK CALCULATION (for Patient Detail) ---
-
-        # --- FIX: This is much simpler now. We just create the DataFrame from the 'latest' row. ---
-        # Create a single-row DataFrame for prediction
-        X_patient = pd.DataFrame([latest], index=[0])
-
-        # Re-order columns to match model's expected input
-        X_patient = X_patient[MODEL_FEATURES]
-
-        # Get the prediction
-        patient_prob = model.predict_proba(X_patient)[:, 1]
-        current_risk = patient_prob[0] * 100  # Get the first (and only) prediction
-
-        # Risk score display
-        st.markdown("### Current Risk Assessment")
-        col1, col2, col3 = st.columns([1, 2, 1])
-
-        with col2:
-            if current_risk > 85:
-                st.markdown(f'<p class="risk-critical">🔴 CRITICAL: {current_risk:.1f}%</p>',
-                            unsafe_allow_html=True)
-                st.error("**Immediate Action Required:** Schedule vascular ultrasound and physician evaluation")
-            elif current_risk > 70:
-                st.markdown(f'<p class="risk-high">🟠 HIGH: {current_risk:.1f}%</p>',
-                            unsafe_allow_html=True)
-                st.warning("**Enhanced Monitoring:** Weekly physical exam and pressure trending")
-            elif current_risk > 50:
-                st.markdown(f'<p class="risk-moderate">🟡 MODERATE: {current_risk:.1f}%</p>',
-                            unsafe_allow_html=True)
-                st.info("**Standard Monitoring:** Continue routine surveillance")
-            else:
-                st.markdown(f'<p class="risk-low">🟢 LOW: {current_risk:.1f}%</p>',
-                            unsafe_allow_html=True)
-                st.success("**Stable Access:** No immediate concerns")
-
-        st.markdown("---")
-
-        # Patient demographics
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.metric("Age", f"{patient_info['age']} years")
-        with col2:
-            st.metric("Sex", patient_info['sex'])
-        with col3:
-            diabetes_status = "Yes" if patient_info['diabetes'] == 1 else "No"
-            st.metric("Diabetes", diabetes_status)
-        with col4:
-            st.metric("Prior Interventions", patient_info['prior_interventions'])
-
-        st.markdown("---")
-
-        # Hemodynamic trends
-        st.subheader("📈 Hemodynamic Trends")
-
-        col1, col2 = st.columns(2)
-
-        with col1:
-            # Qa trend
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(
-                x=patient_treatments['treatment_number'],
-                y=patient_treatments['access_blood_flow_qa'],
-                mode='lines+markers',
-                name='Access Blood Flow',
-                line=dict(color='#1f77b4', width=2)
-            ))
-            fig.add_hline(y=600, line_dash="dash", line_color="red",
-                          annotation_text="Critical Threshold (600 mL/min)")
-            fig.update_layout(
-                title="Access Blood Flow (Qa) Over Time",
-                xaxis_title="Treatment Number",
-                yaxis_title="Qa (mL/min)",
-                height=400
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            # Get the latest treatment row *from the engineered dataframe*
+            latest = patient_treatments.iloc[-1]
 
-            current_qa = latest['access_blood_flow_qa']
-            if current_qa < 600:
-                st.error(f"⚠️ Current Qa: {current_qa:.1f} mL/min (Below threshold)")
-            else:
-                st.success(f"✅ Current Qa: {current_qa:.1f} mL/min (Normal)")
-
-        with col2:
-            # SVPR trend
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(
-                x=patient_treatments['treatment_number'],
-                y=patient_treatments['svpr'],
-                mode='lines+markers',
-                name='SVPR',
-                line=dict(color='#ff7f0e', width=2)
+            # Risk at the latest treatment: live score if newer sessions arrived, else the precomputed table
+            current_risk = live_scores.latest_risk(selected_patient, default=risk_table.latest_risk(selected_patient))
+
+            # Risk score display
+            st.markdown("### Current Risk Assessment")
+            col1, col2, col3 = st.columns([1, 2, 1])
+
+            with col2:
+                if current_risk > 85:
+                    st.markdown(f'<p class="risk-critical">🔴 CRITICAL: {current_risk:.1f}%</p>',
+                                unsafe_allow_html=True)
+                    st.error("**Immediate Action Required:** Schedule vascular ultrasound and physician evaluation")
+                elif current_risk > 70:
+                    st.markdown(f'<p class="risk-high">🟠 HIGH: {current_risk:.1f}%</p>',
+                                unsafe_allow_html=True)
+                    st.warning("**Enhanced Monitoring:** Weekly physical exam and pressure trending")
+                elif current_risk > 50:
+                    st.markdown(f'<p class="risk-moderate">🟡 MODERATE: {current_risk:.1f}%</p>',
+                                unsafe_allow_html=True)
+                    st.info("**Standard Monitoring:** Continue routine surveillance")
+                else:
+                    st.markdown(f'<p class="risk-low">🟢 LOW: {current_risk:.1f}%</p>',
+                                unsafe_allow_html=True)
+                    st.success("**Stable Access:** No immediate concerns")
+
+            # What moved this patient's score away from the cohort base rate, largest first
+            contributions = latest_contributions(np.array([risk_table.latest_row(selected_patient)])).iloc[0]
+            drivers = contributions[contributions.abs().sort_values(ascending=False).index[:8]][::-1]
+            fig = go.Figure(go.Bar(
+                x=drivers.to_numpy(),
+                y=[FEATURE_LABELS[feature] for feature in drivers.index],
+                orientation='h',
+                marker_color=np.where(drivers.to_numpy() > 0, '#dc2626', '#16a34a')
             ))
-            fig.add_hline(y=0.5, line_dash="dash", line_color="red",
-                          annotation_text="Clinical Threshold (0.5)")
             fig.update_layout(
-                title="Static Venous Pressure Ratio (SVPR) Over Time",
-                xaxis_title="Treatment Number",
-                yaxis_title="SVPR",
-                height=400
+                title="Top Risk Drivers (contribution to risk score, percentage points)",
+                xaxis_title="Risk Score Points",
+                height=350
             )
             st.plotly_chart(fig, use_container_width=True)
 
-            current_svpr = latest['svpr']
-            if current_svpr > 0.5:
-                st.error(f"⚠️ Current SVPR: {current_svpr:.2f} (Above threshold)")
-            else:
-                st.success(f"✅ Current SVPR: {current_svpr:.2f} (Normal)")
-
-        # Additional metrics
-        st.markdown("---")
-        st.subheader("📋 Current Treatment Metrics")
-
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.metric("Venous Pressure", f"{latest['venous_pressure_mean']:.1f} mmHg")
-        with col2:
-            st.metric("Access Recirculation", f"{latest['access_recirculation_pct']:.1f}%")
-        with col3:
-            st.metric("Kt/V", f"{latest['ktv']:.2f}")
-        with col4:
-            # 'total_alarms' is now available in the 'latest' row
-            st.metric("Alarms (Last Treatment)", int(latest['total_alarms']))
-
-        # Outcome status
-        if patient_outcome['failed'] == 1:
-            st.warning(f"⚠️ **Patient outcome:** Failed at treatment #{patient_outcome['failure_treatment_number']}")
-        else:
-            st.success("✅ **Patient outcome:** No failure recorded during observation period")
-
-    # PAGE 3: MODEL PERFORMANCE
-    elif page == "Model Performance":
-        st.header("🎯 Model Performance Metrics")
-
-        # --- NEW: Load metrics from JSON file ---
-        try:
-            with open('results/metrics.json') as f:
-                metrics = json.load(f)
+            st.markdown("---")
 
-            col1, col2, col3 = st.columns(3)
+            # Patient demographics
+            col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("AUC-ROC", f"{metrics.get('auc_roc', 0):.4f}")
+                st.metric("Age", f"{patient_info['age']} years")
             with col2:
-                st.metric("Recall (Sensitivity)", f"{metrics.get('recall', 0):.1%}")
+                st.metric("Sex", patient_info['sex'])
             with col3:
-                st.metric("Precision", f"{metrics.get('precision', 0):.1%}")
-
-        except FileNotFoundError:
-            st.error("⚠️ results/metrics.json file not found.")
-            st.info("Please run your model training script to generate this file.")
-        except Exception as e:
-            st.error(f"Error loading metrics file: {e}")
-
-        st.markdown("---")
-
-        # Feature importance
-        st.subheader("📊 Top 15 Most Important Features")
-        try:
-            feature_importance = pd.read_csv('results/feature_importance.csv')
-            top_features = feature_importance.head(15)
-            fig = px.bar(
-                top_features,
-                x='importance',
-                y='feature',
-                orientation='h',
-                labels={'importance': 'Feature Importance (Gini)', 'feature': 'Feature'},
-                title='Feature Importance Rankings'
-            )
-            fig.update_layout(height=600, yaxis={'categoryorder': 'total ascending'})
-            st.plotly_chart(fig, use_container_width=True)
-        except FileNotFoundError:
-            st.error("⚠️ results/feature_importance.csv file not found.")
-        except Exception as e:
-            st.error(f"Error loading feature importance: {e}")
-
-        st.markdown("---")
+                diabetes_status = "Yes" if patient_info['diabetes'] == 1 else "No"
+                st.metric("Diabetes", diabetes_status)
+            with col4:
+                st.metric("Prior Interventions", patient_info['prior_interventions'])
+
+            st.markdown("---")
+
+            # Hemodynamic trends
+            st.subheader("📈 Hemodynamic Trends")
+
+            # Long histories are downsampled server-side; the slider zooms in to the real sessions
+            window = None
+            if len(patient_treatments) > DEFAULT_MAX_POINTS:
+                first = int(patient_treatments['treatment_number'].iloc[0])
+                last = int(patient_treatments['treatment_number'].iloc[-1])
+                window = st.slider("Treatments shown", first, last, (first, last))
+            qa_points = patient_treatments.iloc[chart_points(
+                data_key, selected_patient, len(patient_treatments), 'access_blood_flow_qa', window,
+                patient_treatments)]
+            svpr_points = patient_treatments.iloc[chart_points(
+                data_key, selected_patient, len(patient_treatments), 'svpr', window, patient_treatments)]
+            if window is not None:
+                st.caption(f"Showing {len(qa_points):,} (Qa) and {len(svpr_points):,} (SVPR) of "
+                           f"{len(patient_treatments):,} treatments; threshold crossings are kept")
 
-        # Clinical interpretation
-        st.subheader("🔬 Clinical Validation")
-        st.markdown("""
-        **The model's top predictors align with established medical literature:**
+            col1, col2 = st.columns(2)
 
-        1. **SVPR (Venous Pressure) Trends** - Primary indicator of stenosis development
-        2. **Access Blood Flow Decline** - Direct measure of access dysfunction
-        3. **Baseline Patient Risk** - Comorbidities (diabetes, age, prior interventions)
-        4. **Recirculation Patterns** - Marker of poor flow dynamics
+            with col1:
+                # Qa trend
+                fig = go.Figure()
+                fig.add_trace(go.Scatter(
+                    x=qa_points['treatment_number'],
+                    y=qa_points['access_blood_flow_qa'],
+                    mode='lines+markers',
+                    name='Access Blood Flow',
+                    line=dict(color='#1f77b4', width=2)
+                ))
+                fig.add_hline(y=600, line_dash="dash", line_color="red",
+                              annotation_text="Critical Threshold (600 mL/min)")
+                fig.update_layout(
+                    title="Access Blood Flow (Qa) Over Time",
+                    xaxis_title="Treatment Number",
+                    yaxis_title="Qa (mL/min)",
+                    height=400
+                )
+                st.plotly_chart(fig, use_container_width=True)
+
+                current_qa = latest['access_blood_flow_qa']
+                if current_qa < 600:
+                    st.error(f"⚠️ Current Qa: {current_qa:.1f} mL/min (Below threshold)")
+                else:
+                    st.success(f"✅ Current Qa: {current_qa:.1f} mL/min (Normal)")
 
-        ✅ **Key Finding:** The model learned actual pathophysiology, not spurious correlations.
-        """)
+            with col2:
+                # SVPR trend
+                fig = go.Figure()
+                fig.add_trace(go.Scatter(
+                    x=svpr_points['treatment_number'],
+                    y=svpr_points['svpr'],
+                    mode='lines+markers',
+                    name='SVPR',
+                    line=dict(color='#ff7f0e', width=2)
+                ))
+                fig.add_hline(y=0.5, line_dash="dash", line_color="red",
+                              annotation_text="Clinical Threshold (0.5)")
+                fig.update_layout(
+                    title="Static Venous Pressure Ratio (SVPR) Over Time",
+                    xaxis_title="Treatment Number",
+                    yaxis_title="SVPR",
+                    height=400
+                )
+                st.plotly_chart(fig, use_container_width=True)
+
+                current_svpr = latest['svpr']
+                if current_svpr > 0.5:
+                    st.error(f"⚠️ Current SVPR: {current_svpr:.2f} (Above threshold)")
+                else:
+                    st.success(f"✅ Current SVPR: {current_svpr:.2f} (Normal)")
 
-        # Display images if available
-        try:
-            from PIL import Image
+            # Additional metrics
+            st.markdown("---")
+            st.subheader("📋 Current Treatment Metrics")
 
-            col1, col2 = st.columns(2)
+            col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.image('results/figures/roc_curve.png', caption='ROC Curve')
+                st.metric("Venous Pressure", f"{latest['venous_pressure_mean']:.1f} mmHg")
             with col2:
-                st.image('results/figures/feature_importance.png',
-                         caption='Feature Importance Distribution')
-        except:
-            st.info("📊 Generate plots in the Jupyter notebook to display them here")
+                st.metric("Access Recirculation", f"{latest['access_recirculation_pct']:.1f}%")
+            with col3:
+                st.metric("Kt/V", f"{latest['ktv']:.2f}")
+            with col4:
+                # 'total_alarms' is now available in the 'latest' row
+                st.metric("Alarms (Last Treatment)", int(latest['total_alarms']))
+
+            # Outcome status
+            if patient_outcome['failed'] == 1:
+                st.warning(f"⚠️ **Patient outcome:** Failed at treatment "
+                           f"#{patient_outcome['failure_treatment_number']}")
+            else:
+                st.success("✅ **Patient outcome:** No failure recorded during observation period")
+
+        # PAGE 3: MODEL PERFORMANCE
+        elif page == "Model Performance":
+            st.header("🎯 Model Performance Metrics")
+
+            # --- NEW: Load metrics from JSON file ---
+            try:
+                with open('results/metrics.json') as f:
+                    metrics = json.load(f)
+
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("AUC-ROC", f"{metrics.get('auc_roc', 0):.4f}")
+                with col2:
+                    st.metric("Recall (Sensitivity)", f"{metrics.get('recall', 0):.1%}")
+                with col3:
+                    st.metric("Precision", f"{metrics.get('precision', 0):.1%}")
+
+            except FileNotFoundError:
+                st.error("⚠️ results/metrics.json file not found.")
+                st.info("Please run your model training script to generate this file.")
+            except Exception as e:
+                st.error(f"Error loading metrics file: {e}")
+
+            st.markdown("---")
+
+            # Feature importance
+            st.subheader("📊 Top 15 Most Important Features")
+            try:
+                feature_importance = pd.read_csv('results/feature_importance.csv')
+                top_features = feature_importance.head(15)
+                fig = px.bar(
+                    top_features,
+                    x='importance',
+                    y='feature',
+                    orientation='h',
+                    labels={'importance': 'Feature Importance (Gini)', 'feature': 'Feature'},
+                    title='Feature Importance Rankings'
+                )
+                fig.update_layout(height=600, yaxis={'categoryorder': 'total ascending'})
+                st.plotly_chart(fig, use_container_width=True)
+            except FileNotFoundError:
+                st.error("⚠️ results/feature_importance.csv file not found.")
+            except Exception as e:
+                st.error(f"Error loading feature importance: {e}")
+
+            st.markdown("---")
+
+            # Clinical interpretation
+            st.subheader("🔬 Clinical Validation")
+            st.markdown("""
+            **The model's top predictors align with established medical literature:**
+
+            1. **SVPR (Venous Pressure) Trends** - Primary indicator of stenosis development
+            2. **Access Blood Flow Decline** - Direct measure of access dysfunction
+            3. **Baseline Patient Risk** - Comorbidities (diabetes, age, prior interventions)
+            4. **Recirculation Patterns** - Marker of poor flow dynamics
+
+            ✅ **Key Finding:** The model learned actual pathophysiology, not spurious correlations.
+            """)
+
+            # Display images if available
+            try:
+                from PIL import Image
+
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.image('results/figures/roc_curve.png', caption='ROC Curve')
+                with col2:
+                    st.image('results/figures/feature_importance.png',
+                             caption='Feature Importance Distribution')
+            except:
+                st.info("📊 Generate plots in the Jupyter notebook to display them here")
 
 # Footer
 st.markdown("---")
@@ -554,3 +568,13 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# Debug panel: where this rerun's time went (only while profiling is enabled, see src/instrumentation.py)
+if is_enabled():
+    with st.sidebar.expander("⏱️ Timings (this rerun)"):
+        timings = pd.DataFrame(recent_spans(since=rerun_started, thread=threading.get_ident()))
+        if timings.empty:
+            st.caption("No spans recorded")
+        else:
+            timings['ms'] = (timings['seconds'] * 1e3).round(1)
+            st.dataframe(timings[['span', 'ms', 'rows', 'rss_delta_mb']], hide_index=True)
+            st.caption(f"Rerun: {(time.time() - rerun_started) * 1e3:,.0f} ms")
@@ -0,0 +1,112 @@
+"""Benchmark the Clinic Overview numbers: per-rerun recomputation vs ClinicAggregates.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_clinic_overview
+    python -m benchmarks.bench_clinic_overview --sizes 10000 100000 1000000 --clinics 1 24 200
+
+"recompute" is the page's original code on the latest-treatment frame: the
+high-risk filter and sort, the critical count, the mean, a 20-bin risk
+histogram, the pd.cut age-group means and the high-risk table (top risk factor
+of every patient above 70%). "summary" serves the same numbers (checked
+equal) from the clinic shards, fanned out over a thread pool; "table" builds
+the 15 rows the page shows. "update" applies a batch of --update-size changed
+scores, as a live micro-batch would. The frame holds one synthetic row per
+patient with a clinic, age, risk score and the vitals the table shows.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.clinic_aggregates import ClinicAggregates
+
+RISK_FACTOR_COLUMNS = ['access_blood_flow_qa', 'svpr', 'access_recirculation_pct', 'diabetes']
+
+
+def get_top_risk_factor(row):
+    if row['access_blood_flow_qa'] < 600:
+        return "Low Qa (< 600 mL/min)"
+    elif row['svpr'] > 0.8:
+        return "Elevated SVPR"
+    elif row['access_recirculation_pct'] > 10:
+        return "High Recirculation"
+    elif row['diabetes'] == 1:
+        return "Diabetes + Risk Factors"
+    else:
+        return "Multiple Factors"
+
+
+def recompute(latest):
+    """Reference copy of the Clinic Overview computations from app.py."""
+    high_risk_patients = latest[latest['risk_score'] > 70].sort_values('risk_score', ascending=False)
+    critical = len(high_risk_patients[high_risk_patients['risk_score'] > 85])
+    avg_risk = latest['risk_score'].mean()
+    display_table = latest[latest['risk_score'] > 70].copy()
+    display_table['top_risk_factor'] = display_table.apply(get_top_risk_factor, axis=1)
+    histogram = np.histogram(latest['risk_score'], bins=np.arange(0, 101, 5))[0]
+    age_group = pd.cut(latest['age'], bins=[0, 40, 50, 60, 70, 100],
+                       labels=['<40', '40-50', '50-60', '60-70', '70+']).rename('age_group')
+    age_risk = latest.groupby(age_group, observed=False)['risk_score'].mean()
+    return len(high_risk_patients), critical, avg_risk, histogram, age_risk.to_numpy()
+
+
+def table(aggregates, latest):
+    display_table = latest.iloc[aggregates.top_rows(15)].copy()
+    display_table['top_risk_factor'] = display_table[RISK_FACTOR_COLUMNS].apply(get_top_risk_factor, axis=1)
+    return display_table
+
+
+def _timed(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return result, (time.perf_counter() - start) / repeats
+
+
+def run(sizes, clinic_counts, update_size, n_workers, repeats):
+    rng = np.random.default_rng(0)
+    print(f"{'patients':>10} {'clinics':>8} {'build ms':>9} {'recompute ms':>13} {'summary ms':>11} "
+          f"{'table ms':>9} {'update ms':>10} {'speedup':>8}")
+    for n_patients in sizes:
+        for n_clinics in clinic_counts:
+            latest = pd.DataFrame({
+                'patient_id': pd.Categorical([f'PT_{i:07d}' for i in range(n_patients)]),
+                'clinic_id': pd.Categorical(rng.choice([f'CL_{k:03d}' for k in range(n_clinics)], n_patients)),
+                'age': rng.integers(25, 91, n_patients).astype('int16'),
+                'risk_score': (rng.beta(2, 3, n_patients) * 100).astype('float32'),
+                'access_blood_flow_qa': rng.normal(800, 200, n_patients).astype('float32'),
+                'svpr': rng.normal(0.6, 0.15, n_patients).astype('float32'),
+                'access_recirculation_pct': rng.normal(8, 3, n_patients).astype('float32'),
+                'diabetes': rng.integers(0, 2, n_patients).astype('int8'),
+            })
+
+            aggregates, build_seconds = _timed(lambda: ClinicAggregates(latest, n_workers), 1)
+            expected, recompute_seconds = _timed(lambda: recompute(latest), repeats)
+            summary, summary_seconds = _timed(aggregates.summary, repeats)
+            actual = (summary['high_risk'], summary['critical'], summary['mean_risk'],
+                      summary['risk_histogram']['patients'].to_numpy(), summary['age_group_risk']['risk_score'])
+            if expected[:2] != actual[:2] or (expected[3] != actual[3]).any() or \
+                    not np.allclose([expected[2], *expected[4]], [actual[2], *actual[4]], atol=1e-3):
+                raise AssertionError("ClinicAggregates disagrees with the recomputed overview")
+            _, table_seconds = _timed(lambda: table(aggregates, latest), repeats)
+
+            changed = latest['patient_id'].to_numpy()[rng.integers(0, n_patients, update_size)]
+            _, update_seconds = _timed(
+                lambda: aggregates.update(changed, (rng.random(update_size) * 100).astype('float32')), repeats)
+
+            print(f"{n_patients:>10,} {n_clinics:>8,} {build_seconds * 1e3:>9.0f} {recompute_seconds * 1e3:>13.1f} "
+                  f"{summary_seconds * 1e3:>11.2f} {table_seconds * 1e3:>9.2f} {update_seconds * 1e3:>10.2f} "
+                  f"{recompute_seconds / (summary_seconds + table_seconds):>7.0f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--clinics', type=int, nargs='+', default=[1, 24, 200])
+    parser.add_argument('--update-size', type=int, default=1_000, help='changed scores per update')
+    parser.add_argument('--workers', type=int, default=8, help='threads for the fan-out over clinics')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    run(args.sizes, args.clinics, args.update_size, args.workers, args.repeats)
@@ -0,0 +1,95 @@
+"""Check CompiledForest against sklearn and benchmark single-row and batch scoring.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_compiled_forest
+    python -m benchmarks.bench_compiled_forest --model models/rf_avf_failure_model.pkl --n-patients 5000
+
+Without --model a forest with the notebook's hyperparameters is fitted on a
+generated cohort. Probabilities must match sklearn's exactly (up to float
+summation order) before timings are reported. "sklearn (app)" is the original
+Patient Detail path: a one-row DataFrame built from the latest row.
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from src.compiled_forest import CompiledForest
+from src.data_generation import AVFPatientGenerator
+from src.features import MODEL_FEATURES, build_full_data
+
+
+def _cohort_features(n_patients, n_treatments):
+    generator = AVFPatientGenerator(n_patients=n_patients)
+    with contextlib.redirect_stdout(io.StringIO()):
+        patients, treatments, outcomes = generator.generate_cohort(n_treatments=n_treatments, n_workers=1)
+    return build_full_data(patients, treatments, outcomes)
+
+
+def _best_of(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(model_path, n_patients, n_treatments, single_rows, batch_sizes):
+    full_data = _cohort_features(n_patients, n_treatments)
+    if model_path:
+        model = joblib.load(model_path)
+    else:
+        model = RandomForestClassifier(n_estimators=100, max_depth=15, min_samples_split=20, min_samples_leaf=10,
+                                       random_state=42, n_jobs=1, class_weight='balanced')
+        model.fit(full_data[MODEL_FEATURES], full_data['failed'])
+    model.n_jobs = 1
+
+    start = time.perf_counter()
+    compiled = CompiledForest.from_sklearn(model)
+    print(f"Compiled {compiled.n_estimators} trees, {len(compiled.feature):,} nodes, depth {compiled.max_depth} "
+          f"in {time.perf_counter() - start:.3f}s")
+
+    X = full_data[MODEL_FEATURES]
+    expected = model.predict_proba(X)
+    np.testing.assert_allclose(compiled.predict_proba(X), expected, rtol=0, atol=1e-12)
+    print(f"Parity: {len(X):,} rows match sklearn.predict_proba "
+          f"(max abs diff {np.abs(compiled.predict_proba(X) - expected).max():.1e})\n")
+
+    # Single patient: per-call latency
+    latest = full_data.iloc[len(full_data) // 2]
+    row = latest[MODEL_FEATURES].to_numpy(dtype=float)[None, :]
+    single = {
+        'sklearn (app)': lambda: model.predict_proba(pd.DataFrame([latest], index=[0])[MODEL_FEATURES]),
+        'sklearn (ndarray)': lambda: model.predict_proba(pd.DataFrame(row, columns=MODEL_FEATURES)),
+        'compiled': lambda: compiled.predict_proba(row),
+    }
+    print(f"{'single row':<18} {'us/call':>10}")
+    for name, fn in single.items():
+        fn()
+        print(f"{name:<18} {_best_of(lambda: [fn() for _ in range(single_rows)], 3) / single_rows * 1e6:>10.1f}")
+
+    # Batches: throughput
+    print(f"\n{'batch rows':>10} {'sklearn rows/s':>15} {'compiled rows/s':>16}")
+    for batch_size in batch_sizes:
+        batch = X.iloc[:batch_size]
+        sklearn_seconds = _best_of(lambda: model.predict_proba(batch), 3)
+        compiled_seconds = _best_of(lambda: compiled.predict_proba(batch), 3)
+        print(f"{len(batch):>10,} {len(batch) / sklearn_seconds:>15,.0f} {len(batch) / compiled_seconds:>16,.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', help='pickled forest to compile (default: fit one on the generated cohort)')
+    parser.add_argument('--n-patients', type=int, default=1_000)
+    parser.add_argument('--n-treatments', type=int, default=156)
+    parser.add_argument('--single-rows', type=int, default=200, help='calls per single-row timing')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16, 256, 4_096, 65_536])
+    args = parser.parse_args()
+    run(args.model, args.n_patients, args.n_treatments, args.single_rows, args.batch_sizes)
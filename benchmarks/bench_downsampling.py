@@ -0,0 +1,98 @@
+"""Benchmark the Patient Detail trend charts with and without downsampling.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_downsampling
+    python -m benchmarks.bench_downsampling --lengths 156 1560 15600 --max-points 300
+
+For each history length a few synthetic patients are generated and both trend
+charts (Qa and SVPR, lines+markers, as on the page) are built from every
+treatment ("full") and from the trend_points() selection ("downsampled").
+Payload is the size of the figure JSON Streamlit sends to the browser; build
+time covers the figures and their serialization. The browser's own rendering
+is not measured here, but Plotly's scatter rendering grows with the number of
+points the same way. Each result is checked to cross both threshold lines in
+every stretch of the chart where the full series does.
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+import plotly.graph_objects as go
+
+from src.data_generation import AVFPatientGenerator
+from src.downsampling import TREND_THRESHOLDS, threshold_crossings, trend_points
+from src.features import build_full_data
+
+
+def trend_figures(qa_points, svpr_points):
+    """The page's Qa and SVPR charts, each drawn from its own (possibly downsampled) rows."""
+    figures = []
+    for points, column, title in ((qa_points, 'access_blood_flow_qa', 'Access Blood Flow (Qa) Over Time'),
+                                  (svpr_points, 'svpr', 'Static Venous Pressure Ratio (SVPR) Over Time')):
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=points['treatment_number'], y=points[column], mode='lines+markers',
+                                 line=dict(width=2)))
+        fig.add_hline(y=TREND_THRESHOLDS[column], line_dash="dash", line_color="red")
+        fig.update_layout(title=title, xaxis_title="Treatment Number", height=400)
+        figures.append(fig)
+    return figures
+
+
+def _payload(charts):
+    """(bytes of figure JSON, seconds to build and serialize) over all (qa_points, svpr_points) pairs."""
+    start = time.perf_counter()
+    size = sum(len(fig.to_json()) for qa_points, svpr_points in charts for fig in trend_figures(qa_points, svpr_points))
+    return size, time.perf_counter() - start
+
+
+def _crossings_kept(x, y, selected, threshold, n_stretches):
+    def stretches(values, crossings):
+        return set(((values[crossings] - x[0]) * n_stretches // max(x[-1] - x[0], 1)).tolist())
+    return stretches(x, threshold_crossings(y, threshold)) <= stretches(x[selected],
+                                                                        threshold_crossings(y[selected], threshold))
+
+
+def run(lengths, n_patients, max_points):
+    print(f"{'sessions':>9} {'points':>7} {'full KB':>8} {'down KB':>8} {'full ms':>8} {'down ms':>8} "
+          f"{'select ms':>10} {'crossings':>10}")
+    for n_treatments in lengths:
+        generator = AVFPatientGenerator(n_patients=n_patients)
+        with contextlib.redirect_stdout(io.StringIO()):
+            patients, treatments, outcomes = generator.generate_cohort(n_treatments=n_treatments, n_workers=1)
+        full_data = build_full_data(patients, treatments, outcomes)
+        histories = [history for _, history in full_data.groupby('patient_id', observed=True)]
+
+        start = time.perf_counter()
+        selections = {column: [trend_points(history['treatment_number'].to_numpy(), history[column].to_numpy(),
+                                            max_points, [threshold]) for history in histories]
+                      for column, threshold in TREND_THRESHOLDS.items()}
+        select_seconds = (time.perf_counter() - start) / len(histories)
+
+        crossings_kept = all(
+            _crossings_kept(history['treatment_number'].to_numpy(), history[column].to_numpy(), selected,
+                            TREND_THRESHOLDS[column], max(1, max_points // 8))
+            for column in TREND_THRESHOLDS for history, selected in zip(histories, selections[column]))
+        downsampled = [(history.iloc[qa], history.iloc[svpr]) for history, qa, svpr
+                       in zip(histories, selections['access_blood_flow_qa'], selections['svpr'])]
+        points = np.mean([len(selected) for selected in selections['access_blood_flow_qa']])
+
+        _payload(downsampled[:1])  # Plotly builds its validators on first use
+        full_size, full_seconds = _payload([(history, history) for history in histories])
+        down_size, down_seconds = _payload(downsampled)
+        print(f"{n_treatments:>9,} {points:>7.0f} {full_size / n_patients / 1e3:>8.1f} "
+              f"{down_size / n_patients / 1e3:>8.1f} {full_seconds / n_patients * 1e3:>8.1f} "
+              f"{down_seconds / n_patients * 1e3:>8.1f} {select_seconds * 1e3:>10.2f} "
+              f"{'kept' if crossings_kept else 'LOST':>10}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lengths', type=int, nargs='+', default=[156, 468, 1_560, 4_680, 15_600],
+                        help='treatments per patient (156 a year at three sessions a week)')
+    parser.add_argument('--n-patients', type=int, default=10)
+    parser.add_argument('--max-points', type=int, default=300)
+    args = parser.parse_args()
+    run(args.lengths, args.n_patients, args.max_points)
@@ -0,0 +1,118 @@
+"""Benchmark risk explanations: fixed-threshold heuristic vs forest contributions.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_explanations
+    python -m benchmarks.bench_explanations --n-patients 20000 --model models/rf_avf_failure_model.pkl
+
+Every patient's latest treatment is explained three ways. "heuristic" is the
+High Risk table's original get_top_risk_factor applied row by row. "per-row"
+walks each row's path through every tree in Python (the straightforward
+decision-path decomposition, timed on a sample). "batch" is
+CompiledForest.contributions() over all rows at once, as load_risk_table()
+runs it on a cache miss; "cached" is what a dashboard rerun does afterwards:
+look up the 15 table rows and name their top drivers. The batch result is
+checked to equal the per-row one and to add up to predict_proba.
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from src.compiled_forest import CompiledForest
+from src.data_generation import AVFPatientGenerator
+from src.explanations import explain, top_drivers
+from src.features import MODEL_FEATURES, build_full_data
+
+
+def get_top_risk_factor(row):
+    """Reference copy of the High Risk table's original heuristic."""
+    if row['access_blood_flow_qa'] < 600:
+        return "Low Qa (< 600 mL/min)"
+    elif row['svpr'] > 0.8:
+        return "Elevated SVPR"
+    elif row['access_recirculation_pct'] > 10:
+        return "High Recirculation"
+    elif row['diabetes'] == 1:
+        return "Diabetes + Risk Factors"
+    else:
+        return "Multiple Factors"
+
+
+def per_row_contributions(forest, x):
+    """Decision-path decomposition of one row, one tree and one node at a time."""
+    contributions = np.zeros(len(x))
+    value = forest.value[:, -1]
+    for root in forest.roots:
+        node = root
+        while not forest.is_leaf[node]:
+            child = forest.children[2 * node + int(np.float32(x[forest.feature[node]]) > forest.threshold[node])]
+            contributions[forest.feature[node]] += value[child] - value[node]
+            node = child
+    return contributions / forest.n_estimators
+
+
+def run(n_patients, model_path, n_sample):
+    generator = AVFPatientGenerator(n_patients=n_patients)
+    with contextlib.redirect_stdout(io.StringIO()):
+        patients, treatments, outcomes = generator.generate_cohort(n_workers=1)
+    full_data = build_full_data(patients, treatments, outcomes)
+    if model_path:
+        model = joblib.load(model_path)
+    else:
+        model = RandomForestClassifier(n_estimators=100, max_depth=15, min_samples_split=20, min_samples_leaf=10,
+                                       random_state=42, n_jobs=-1, class_weight='balanced')
+        model.fit(full_data[MODEL_FEATURES], full_data['failed'])
+    forest = CompiledForest.from_sklearn(model)
+    latest = full_data.groupby('patient_id', observed=True).tail(1)
+
+    start = time.perf_counter()
+    latest.apply(get_top_risk_factor, axis=1)
+    heuristic_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    contributions = explain(forest, latest)
+    batch_seconds = time.perf_counter() - start
+
+    X = latest[MODEL_FEATURES].to_numpy()
+    start = time.perf_counter()
+    sample = np.array([per_row_contributions(forest, x) for x in X[:n_sample]]) * 100
+    per_row_seconds = (time.perf_counter() - start) / n_sample * len(latest)
+
+    if not np.allclose(sample, contributions.to_numpy()[:n_sample], atol=1e-4):
+        raise AssertionError("Batch contributions differ from the per-row decomposition")
+    bias, _ = forest.contributions(X[:1])
+    if not np.allclose(bias * 100 + contributions.to_numpy(np.float64).sum(axis=1),
+                       model.predict_proba(latest[MODEL_FEATURES])[:, 1] * 100, atol=1e-3):
+        raise AssertionError("Contributions do not add up to the predicted risk")
+
+    rows = np.random.default_rng(0).choice(len(latest), 15, replace=False)
+    start = time.perf_counter()
+    top_drivers(contributions.iloc[rows], n=2)
+    cached_seconds = time.perf_counter() - start
+
+    print(f"{len(latest):,} patients, {forest.n_estimators} trees (max depth {forest.max_depth})\n")
+    print(f"{'method':<28} {'total (s)':>10} {'per patient (us)':>17}")
+    for name, seconds in (('heuristic (row apply)', heuristic_seconds),
+                          (f'per-row paths (est., {n_sample} rows)', per_row_seconds),
+                          ('batch contributions', batch_seconds)):
+        print(f"{name:<28} {seconds:>10.2f} {seconds / len(latest) * 1e6:>17.1f}")
+    print(f"{'cached, 15 table rows':<28} {cached_seconds:>10.4f}")
+
+    low_qa = latest.apply(get_top_risk_factor, axis=1).str.startswith('Low Qa').to_numpy()
+    qa_driven = top_drivers(contributions).str.startswith('Qa').to_numpy()
+    print(f"\nHeuristic 'Low Qa' patients whose top model driver is a Qa feature: "
+          f"{qa_driven[low_qa].mean():.0%} of {low_qa.sum():,}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n-patients', type=int, default=5_000)
+    parser.add_argument('--model', help='pickled forest to explain (default: fit one on the generated cohort)')
+    parser.add_argument('--sample', type=int, default=50, help='rows timed for the per-row decomposition')
+    args = parser.parse_args()
+    run(args.n_patients, args.model, args.sample)
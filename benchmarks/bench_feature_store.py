@@ -0,0 +1,46 @@
+"""Verify the incremental feature store against the batch pipeline and time appends.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_feature_store
+    python -m benchmarks.bench_feature_store --n-patients 500 --n-treatments 400
+
+Every session of a synthetic cohort is appended one at a time and timed.
+Each returned row must equal build_full_data() on that patient's history up to
+and including the session, to float32 precision (feature_store.check_parity(),
+which benchmarks/suite.py also runs as a gated stage).
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from src.data_generation import AVFPatientGenerator
+from src.feature_store import PARITY_COLUMNS, IncrementalFeatureStore, check_parity
+
+
+def run(n_patients, n_treatments):
+    generator = AVFPatientGenerator(n_patients=n_patients)
+    with contextlib.redirect_stdout(io.StringIO()):
+        patients, treatments, outcomes = generator.generate_cohort(n_treatments=n_treatments, n_workers=1)
+
+    store = IncrementalFeatureStore(patients)
+    # Replay in arrival order: every patient's session k before anyone's session k + 1
+    arrivals = treatments.sort_values(['treatment_number', 'patient_id'])
+    start = time.perf_counter()
+    rows = store.extend(arrivals)
+    elapsed = time.perf_counter() - start
+
+    print(f"Appended {len(rows):,} sessions for {n_patients:,} patients in {elapsed:.2f}s "
+          f"({elapsed / len(rows) * 1e6:.1f} µs/session)")
+
+    check_parity(patients, treatments, outcomes)
+    print(f"✓ All {len(PARITY_COLUMNS)} engineered columns match the batch pipeline for every prefix")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n-patients', type=int, default=1_000)
+    parser.add_argument('--n-treatments', type=int, default=156)
+    args = parser.parse_args()
+    run(args.n_patients, args.n_treatments)
@@ -0,0 +1,147 @@
+"""Load-test the ingestion service by replaying a synthetic cohort over HTTP.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_ingestion
+    python -m benchmarks.bench_ingestion --n-patients 2000 --rates 500 2000 8000 --duration 20
+
+A cohort is generated and its first --history treatments per patient are
+written as the raw tables; a forest is fitted on them and exported to the
+compiled format. `python -m src.ingestion` is then started on that data and
+the remaining sessions are POSTed in arrival order (every patient's session k
+before anyone's session k + 1) at each offered rate, --post-size sessions per
+request. Latency is from the server receiving a session to its scored batch
+being written, taken from the received_at/scored_at columns of the score parts.
+"""
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from src.compiled_forest import export
+from src.data_generation import AVFPatientGenerator
+from src.features import MODEL_FEATURES, build_full_data
+from src.ingestion import SESSION_SCHEMA
+from src.storage import table_path, write_table
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _prepare(tmp, n_patients, n_treatments, history):
+    generator = AVFPatientGenerator(n_patients=n_patients)
+    with contextlib.redirect_stdout(io.StringIO()):
+        patients, treatments, outcomes = generator.generate_cohort(n_treatments=n_treatments, n_workers=1)
+    past = treatments[treatments['treatment_number'] <= history]
+    (Path(tmp) / 'raw').mkdir()
+    for table, frame in (('patients', patients), ('treatments', past), ('outcomes', outcomes)):
+        write_table(table, frame, table_path(table, 'parquet', Path(tmp) / 'raw'), 'parquet')
+
+    full_data = build_full_data(patients, past, outcomes)
+    model = RandomForestClassifier(n_estimators=100, max_depth=15, min_samples_split=20, min_samples_leaf=10,
+                                   random_state=42, n_jobs=1, class_weight='balanced')
+    joblib.dump(model.fit(full_data[MODEL_FEATURES], full_data['failed']), Path(tmp) / 'model.pkl')
+    export(Path(tmp) / 'model.pkl')
+
+    arrivals = treatments[treatments['treatment_number'] > history].sort_values(['treatment_number', 'patient_id'])
+    arrivals = arrivals[list(SESSION_SCHEMA)].astype({'patient_id': str, 'treatment_date': str})
+    # Missing measurements are sent as null, not NaN
+    return arrivals.astype(object).where(arrivals.notna(), None).to_dict('records')
+
+
+def _replay(connection, sessions, rate, post_size):
+    """POST sessions at `rate` per second; returns the seconds it took."""
+    start = time.perf_counter()
+    for sent in range(0, len(sessions), post_size):
+        delay = start + sent / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        connection.request('POST', '/sessions', json.dumps(sessions[sent:sent + post_size]),
+                           {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        body = json.loads(response.read())
+        if response.status != 202 or body['errors']:
+            raise RuntimeError(f"Ingestion rejected a request: {body}")
+    return time.perf_counter() - start
+
+
+def _health(connection):
+    connection.request('GET', '/health')
+    return json.loads(connection.getresponse().read())
+
+
+def run(n_patients, n_treatments, history, rates, duration, post_size, max_batch, max_delay):
+    with tempfile.TemporaryDirectory() as tmp:
+        sessions = _prepare(tmp, n_patients, n_treatments, history)
+        port = _free_port()
+        server = subprocess.Popen([sys.executable, '-m', 'src.ingestion', '--data-dir', str(Path(tmp) / 'raw'),
+                                   '--live-dir', str(Path(tmp) / 'live'), '--model', str(Path(tmp) / 'model.forest'),
+                                   '--port', str(port), '--max-batch', str(max_batch),
+                                   '--max-delay', str(max_delay)], stdout=subprocess.PIPE, text=True)
+        try:
+            while 'Listening' not in server.stdout.readline():
+                if server.poll() is not None:
+                    raise RuntimeError("Ingestion service failed to start")
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            print(f"{len(sessions):,} sessions to replay for {n_patients:,} patients "
+                  f"(max batch {max_batch}, max delay {max_delay}s, {post_size} sessions per POST)\n")
+            print(f"{'offered/s':>10} {'sent/s':>8} {'scored/s':>9} {'batches':>8} {'mean batch':>11} "
+                  f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+
+            offset = 0
+            for rate in rates:
+                chunk = sessions[offset:offset + int(rate * duration)]
+                if not chunk:
+                    print(f"{rate:>10,} (no sessions left; raise --n-treatments)")
+                    continue
+                before = _health(connection)
+                send_seconds = _replay(connection, chunk, rate, post_size)
+                while _health(connection)['scored'] < before['scored'] + len(chunk):
+                    time.sleep(0.05)
+                after = _health(connection)
+                offset += len(chunk)
+
+                parts = [pd.read_parquet(Path(tmp) / 'live' / 'scores' / f'part-{batch:06d}.parquet',
+                                         columns=['received_at', 'scored_at'])
+                         for batch in range(before['batches'], after['batches'])]
+                scores = pd.concat(parts, ignore_index=True)
+                latency_ms = (scores['scored_at'] - scores['received_at']).to_numpy() * 1e3
+                elapsed = scores['scored_at'].max() - scores['received_at'].min()
+                n_batches = after['batches'] - before['batches']
+                print(f"{rate:>10,} {len(chunk) / send_seconds:>8,.0f} {len(chunk) / elapsed:>9,.0f} "
+                      f"{n_batches:>8,} {len(chunk) / n_batches:>11,.0f} "
+                      + ' '.join(f'{value:>8.0f}' for value in np.percentile(latency_ms, [50, 95, 99])))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n-patients', type=int, default=1_000)
+    parser.add_argument('--n-treatments', type=int, default=156)
+    parser.add_argument('--history', type=int, default=60, help='treatments per patient in the raw tables')
+    parser.add_argument('--rates', type=int, nargs='+', default=[250, 1_000, 4_000],
+                        help='offered sessions/sec, one run each')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per rate')
+    parser.add_argument('--post-size', type=int, default=50, help='sessions per HTTP request')
+    parser.add_argument('--max-batch', type=int, default=1_000)
+    parser.add_argument('--max-delay', type=float, default=0.5)
+    args = parser.parse_args()
+    run(args.n_patients, args.n_treatments, args.history, args.rates, args.duration, args.post_size,
+        args.max_batch, args.max_delay)
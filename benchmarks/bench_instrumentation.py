@@ -0,0 +1,87 @@
+"""Benchmark the cost of timing spans, with profiling disabled and enabled.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_instrumentation
+    python -m benchmarks.bench_instrumentation --calls 1000000 --n-patients 5000
+
+"per call" times a @timed no-op function, a `with span()` block and the bare
+function they wrap, so the difference is the instrumentation itself.
+"pipeline" runs build_full_data (four spans per call) on a generated cohort
+with profiling off and on; enabled spans are written to a temporary file.
+"""
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+from pathlib import Path
+
+from src import instrumentation
+from src.data_generation import AVFPatientGenerator
+from src.features import build_full_data
+from src.instrumentation import span, timed
+
+
+def noop():
+    pass
+
+
+timed_noop = timed()(noop)
+
+
+def with_span():
+    with span('bench.noop'):
+        pass
+
+
+def _per_call(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls
+
+
+def _best_of(function, repeats):
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+def run(calls, n_patients, repeats):
+    generator = AVFPatientGenerator(n_patients=n_patients)
+    with contextlib.redirect_stdout(io.StringIO()):
+        cohort = generator.generate_cohort(n_workers=1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for state in ('disabled', 'enabled'):
+            if state == 'enabled':
+                instrumentation.enable(Path(tmp) / 'profile.jsonl')
+            enabled_calls = calls if state == 'disabled' else max(1, calls // 100)
+            results[state] = {
+                'bare': _per_call(noop, enabled_calls),
+                'timed': _per_call(timed_noop, enabled_calls),
+                'span': _per_call(with_span, enabled_calls),
+                'pipeline': _best_of(lambda: build_full_data(*cohort), repeats),
+            }
+        instrumentation.disable()
+
+    print(f"{'profiling':<10} {'bare ns':>8} {'@timed ns':>10} {'span() ns':>10} {'build_full_data s':>18}")
+    for state, result in results.items():
+        print(f"{state:<10} {result['bare'] * 1e9:>8.0f} {result['timed'] * 1e9:>10.0f} "
+              f"{result['span'] * 1e9:>10.0f} {result['pipeline']:>18.3f}")
+    overhead = results['enabled']['pipeline'] / results['disabled']['pipeline'] - 1
+    print(f"\nbuild_full_data on {len(cohort[1]):,} treatments: {overhead:+.1%} with profiling enabled")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=1_000_000, help='calls per micro-benchmark (1%% when enabled)')
+    parser.add_argument('--n-patients', type=int, default=2_000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+    run(args.calls, args.n_patients, args.repeats)
@@ -0,0 +1,185 @@
+"""Benchmark the dashboard's memory plan: bytes per treatment row and per-worker memory.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_memory
+    python -m benchmarks.bench_memory --n-patients 20000
+
+Three layouts of the same generated cohort, all restricted to the columns the
+dashboard loads (app.py's DATA_COLUMNS):
+
+    original    the tables as pd.read_csv() returns them (patient_id as Python
+                strings, int64 and float64 columns) merged into one frame with
+                float64 features, as load_data() used to build it
+    merged      build_full_data(): categorical patient_id, float32 vitals and
+                features, int8 flags, but patient attributes still repeated on
+                every treatment row
+    split       what the dashboard holds now: build_treatment_features() plus
+                build_patient_features() (one row per patient), joined only to score
+
+"bytes/row" is memory_usage(deep=True) per treatment row, the patient table
+included. "worker" loads each layout in a fresh process like a Streamlit
+worker does ("merged" and "split" memory-map a cached Arrow file, as
+load_feature_tables() does on a cache hit) and reports the growth of its
+private memory, paid by every worker, and of its shared file-backed pages,
+held once in the OS page cache for all workers on the machine. The risk
+scores of a forest fitted on the cohort are checked to be identical for all
+three layouts.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from src.data_generation import AVFPatientGenerator
+from src.feature_cache import load_feature_tables, read_cached_frame, write_cached_frame
+from src.features import FEATURE_DTYPE, MODEL_FEATURES, build_full_data
+from src.scoring import score_frame
+from src.storage import CohortWriter, load_raw_tables, read_table, table_path, unify_patient_ids
+
+# The columns app.py loads (its DATA_COLUMNS)
+DASHBOARD_COLUMNS = {
+    'treatments': ['patient_id', 'treatment_number', 'access_blood_flow_qa', 'venous_pressure_mean',
+                   'svpr', 'access_recirculation_pct', 'ktv', 'high_vp_alarms', 'low_ap_alarms'],
+    'outcomes': ['patient_id', 'failed', 'failure_treatment_number'],
+}
+
+LAYOUTS = ('original', 'merged', 'split')
+
+_SMAPS = Path('/proc/self/smaps_rollup')
+
+
+def _memory_mb():
+    """(private, shared file-backed) resident memory of this process in MB."""
+    fields = {}
+    for line in _SMAPS.read_text().splitlines():
+        name, value = line.split(':', 1)
+        if value.strip().endswith('kB'):
+            fields[name] = int(value.split()[0]) / 1024
+    private = fields['Private_Clean'] + fields['Private_Dirty']
+    return private, fields['Rss'] - private
+
+
+def _csv_dtypes(frame):
+    """frame with the dtypes pd.read_csv() gives it: Python strings, int64 and float64."""
+    dtypes = {}
+    for column, dtype in frame.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            dtypes[column] = object
+        elif dtype.kind in 'iub':
+            dtypes[column] = 'int64'
+        elif dtype.kind == 'f':
+            dtypes[column] = 'float64'
+    return frame.astype(dtypes)
+
+
+def original_full_data(patients, treatments, outcomes):
+    """full_data the way load_data() used to build it: CSV dtypes and float64 features."""
+    full_data = build_full_data(_csv_dtypes(patients), _csv_dtypes(treatments), _csv_dtypes(outcomes))
+    widened = {column: 'float64' for column, dtype in full_data.dtypes.items() if dtype == FEATURE_DTYPE}
+    return full_data.astype({**widened, 'sex_encoded': 'int64'})
+
+
+def _load(layout, data_dir):
+    """The frames a dashboard worker keeps for `layout`."""
+    data_dir = Path(data_dir)
+    if layout == 'original':
+        tables = [pd.read_csv(table_path(table, 'csv', data_dir / 'csv'), usecols=DASHBOARD_COLUMNS.get(table))
+                  for table in ('patients', 'treatments', 'outcomes')]
+        return [tables[0], tables[2], original_full_data(*tables)]
+    if layout == 'merged':
+        patients = read_table('patients', data_dir=data_dir / 'parquet')
+        outcomes = read_table('outcomes', DASHBOARD_COLUMNS['outcomes'], data_dir / 'parquet')
+        full_data = read_cached_frame(data_dir / 'merged.arrow')
+        unify_patient_ids(full_data, patients, outcomes)
+        return [patients, outcomes, full_data]
+    return list(load_feature_tables(DASHBOARD_COLUMNS, data_dir / 'parquet', data_dir / 'cache'))
+
+
+def worker(layout, data_dir):
+    """Print the memory growth of loading `layout` in this (fresh) process as JSON."""
+    gc.collect()
+    private, shared = _memory_mb()
+    frames = _load(layout, data_dir)  # noqa: F841 (kept alive until measured)
+    gc.collect()
+    loaded_private, loaded_shared = _memory_mb()
+    print(json.dumps({'private_mb': loaded_private - private, 'shared_mb': loaded_shared - shared}))
+
+
+def _worker_memory(layout, data_dir):
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_memory', '--worker', layout, str(data_dir)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def _bytes(*frames):
+    return sum(int(frame.memory_usage(deep=True).sum()) for frame in frames)
+
+
+def run(n_patients, n_treatments):
+    generator = AVFPatientGenerator(n_patients=n_patients)
+    with contextlib.redirect_stdout(io.StringIO()):
+        cohort = generator.generate_cohort(n_treatments=n_treatments, n_workers=1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for fmt in ('csv', 'parquet'):
+            (tmp / fmt).mkdir()
+            with CohortWriter(tmp / fmt, fmt=fmt) as writer:
+                writer.write(*cohort)
+
+        tables = load_raw_tables(DASHBOARD_COLUMNS, tmp / 'parquet')
+        original = original_full_data(*tables)
+        merged = build_full_data(*tables)
+        write_cached_frame(merged, tmp / 'merged.arrow')
+        _, _, treatment_features, patient_features = load_feature_tables(DASHBOARD_COLUMNS, tmp / 'parquet',
+                                                                         tmp / 'cache')
+        rows = len(treatment_features)
+        sizes = {'original': _bytes(original), 'merged': _bytes(merged),
+                 'split': _bytes(treatment_features, patient_features)}
+
+        model = RandomForestClassifier(n_estimators=50, max_depth=12, min_samples_leaf=10, random_state=42, n_jobs=-1)
+        model.fit(merged[MODEL_FEATURES], merged['failed'])
+        scores = {'original': score_frame(model, original)['risk_score'].to_numpy(),
+                  'merged': score_frame(model, merged)['risk_score'].to_numpy(),
+                  'split': score_frame(model, treatment_features, patient_features=patient_features)['risk_score']
+                  .to_numpy()}
+        if not all(np.array_equal(scores['original'], layout_scores) for layout_scores in scores.values()):
+            raise AssertionError("Risk scores differ between layouts")
+
+        workers = {layout: _worker_memory(layout, tmp) for layout in LAYOUTS} if _SMAPS.exists() else {}
+
+    print(f"{rows:,} treatments of {len(patient_features):,} patients; risk scores identical in every layout\n")
+    print(f"{'layout':<10} {'bytes/row':>10} {'frames MB':>10} {'worker private MB':>18} {'worker shared MB':>17}")
+    for layout in LAYOUTS:
+        memory = workers.get(layout)
+        worker_columns = (f"{memory['private_mb']:>18.1f} {memory['shared_mb']:>17.1f}" if memory
+                          else f"{'-':>18} {'-':>17}")
+        print(f"{layout:<10} {sizes[layout] / rows:>10.1f} {sizes[layout] / 2 ** 20:>10.1f} {worker_columns}")
+    print(f"\nsplit vs original: {sizes['original'] / sizes['split']:.1f}x fewer bytes per row")
+    if workers:
+        original_total = workers['original']['private_mb'] + workers['original']['shared_mb']
+        split_total = workers['split']['private_mb'] + workers['split']['shared_mb']
+        print(f"split vs original: {original_total / split_total:.1f}x less worker memory, "
+              f"{workers['original']['private_mb'] / workers['split']['private_mb']:.1f}x less private memory")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n-patients', type=int, default=2_000)
+    parser.add_argument('--n-treatments', type=int, default=156)
+    parser.add_argument('--worker', nargs=2, metavar=('LAYOUT', 'DATA_DIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(*args.worker)
+    else:
+        run(args.n_patients, args.n_treatments)
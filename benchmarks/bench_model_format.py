@@ -0,0 +1,117 @@
+"""Compare loading the pickled forest with the memory-mapped compiled format.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_model_format
+    python -m benchmarks.bench_model_format --model models/rf_avf_failure_model.pkl --processes 4
+
+Without --model a forest with the notebook's hyperparameters is fitted on a
+generated cohort. Both formats must give identical probabilities. Each load
+then runs in a fresh process (libraries already imported), which scores one
+batch so every node page is touched. "private MB" is anonymous memory the
+process owns (RssAnon); "shared MB" is file pages it maps from the OS page
+cache (RssFile), which every process loading the same file shares. With
+--processes N, N loaders run at the same time and their totals are reported.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from benchmarks.bench_compiled_forest import _cohort_features
+from src.compiled_forest import export
+from src.features import MODEL_FEATURES
+
+_CHILD_FLAG = '--child'
+
+
+def _memory_kb():
+    with open('/proc/self/status') as status:
+        fields = dict(line.split(':', 1) for line in status)
+    return {name: int(fields[name].split()[0]) for name in ('RssAnon', 'RssFile')}
+
+
+def _child(model_path, batch_rows, hold_seconds):
+    import pandas as pd
+    import sklearn.ensemble  # noqa: F401  (imported before timing, as in the dashboard)
+
+    from src.scoring import load_model
+
+    X = pd.DataFrame(np.random.default_rng(0).normal(size=(batch_rows, len(MODEL_FEATURES))),
+                     columns=MODEL_FEATURES)
+    before = _memory_kb()
+    start = time.perf_counter()
+    model = load_model(model_path)
+    load_seconds = time.perf_counter() - start
+    model.predict_proba(X)
+    after = _memory_kb()
+    print(json.dumps({'load_seconds': load_seconds,
+                      'private_mb': (after['RssAnon'] - before['RssAnon']) / 2**10,
+                      'shared_mb': (after['RssFile'] - before['RssFile']) / 2**10}), flush=True)
+    time.sleep(hold_seconds)
+
+
+def _load_in_processes(model_path, n_processes, batch_rows):
+    # Loaders stay alive until all have reported, so the shared pages are mapped concurrently
+    children = [subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_model_format', _CHILD_FLAG,
+                                  str(model_path), '--batch-rows', str(batch_rows), '--hold', '5'],
+                                 stdout=subprocess.PIPE, text=True)
+                for _ in range(n_processes)]
+    reports = [json.loads(child.stdout.readline()) for child in children]
+    for child in children:
+        child.wait()
+    return reports
+
+
+def run(model_path, n_patients, n_treatments, n_processes, batch_rows):
+    full_data = _cohort_features(n_patients, n_treatments)
+    with tempfile.TemporaryDirectory() as tmp:
+        if not model_path:
+            model_path = Path(tmp) / 'model.pkl'
+            model = RandomForestClassifier(n_estimators=100, max_depth=15, min_samples_split=20,
+                                           min_samples_leaf=10, random_state=42, n_jobs=1,
+                                           class_weight='balanced')
+            joblib.dump(model.fit(full_data[MODEL_FEATURES], full_data['failed']), model_path)
+        compiled_path = export(model_path, Path(tmp) / 'model.forest')
+
+        from src.scoring import load_model
+        X = full_data[MODEL_FEATURES]
+        expected = load_model(model_path, n_jobs=1).predict_proba(X)
+        np.testing.assert_array_equal(load_model(compiled_path).predict_proba(X), expected)
+        print(f"Parity: {len(X):,} rows give identical probabilities\n")
+
+        print(f"{'format':<10} {'file MB':>8} {'load ms':>9} {'private MB':>11} {'shared MB':>10} "
+              f"{f'{n_processes}x private MB':>15} {f'{n_processes}x shared MB':>14}")
+        for name, path in [('joblib', Path(model_path)), ('compiled', compiled_path)]:
+            single = _load_in_processes(path, 1, batch_rows)[0]
+            many = _load_in_processes(path, n_processes, batch_rows)
+            print(f"{name:<10} {path.stat().st_size / 2**20:>8.1f} {single['load_seconds'] * 1e3:>9.1f} "
+                  f"{single['private_mb']:>11.1f} {single['shared_mb']:>10.1f} "
+                  f"{sum(r['private_mb'] for r in many):>15.1f} {max(r['shared_mb'] for r in many):>14.1f}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == _CHILD_FLAG:
+        child_parser = argparse.ArgumentParser()
+        child_parser.add_argument('model')
+        child_parser.add_argument('--batch-rows', type=int)
+        child_parser.add_argument('--hold', type=float)
+        child_args = child_parser.parse_args(sys.argv[2:])
+        _child(child_args.model, child_args.batch_rows, child_args.hold)
+        sys.exit()
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', help='pickled forest (default: fit one on the generated cohort)')
+    parser.add_argument('--n-patients', type=int, default=1_000)
+    parser.add_argument('--n-treatments', type=int, default=156)
+    parser.add_argument('--processes', type=int, default=4, help='concurrent loaders')
+    parser.add_argument('--batch-rows', type=int, default=4_096, help='rows scored after loading')
+    args = parser.parse_args()
+    run(args.model, args.n_patients, args.n_treatments, args.processes, args.batch_rows)
@@ -0,0 +1,80 @@
+"""Benchmark Patient Detail lookups: boolean-mask scans vs PatientIndex.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_patient_index
+    python -m benchmarks.bench_patient_index --sizes 1000 10000 20000
+
+"scan" is the page's original code: one boolean mask over each of patients,
+full_data and outcomes plus a sort of the history. "index" slices the same
+rows through PatientIndex; both must return identical frames. Lookup times
+are per selected patient, averaged over --lookups random patients.
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.data_generation import AVFPatientGenerator
+from src.features import build_full_data
+from src.patient_index import PatientIndex
+
+
+def scan_lookup(patients, outcomes, full_data, patient_id):
+    """Reference copy of the Patient Detail lookups from app.py."""
+    patient_info = patients[patients['patient_id'] == patient_id].iloc[0]
+    patient_treatments = full_data[full_data['patient_id'] == patient_id].sort_values('treatment_number')
+    patient_outcome = outcomes[outcomes['patient_id'] == patient_id].iloc[0]
+    return patient_info, patient_treatments, patient_outcome
+
+
+def index_lookup(patient_index, patient_id):
+    return (patient_index.patient(patient_id), patient_index.history(patient_id),
+            patient_index.outcome(patient_id))
+
+
+def run(sizes, n_treatments, n_lookups):
+    print(f"{'patients':>9} {'rows':>11} {'build (ms)':>11} {'scan (ms)':>10} {'index (ms)':>11} {'speedup':>8}")
+    for n_patients in sizes:
+        generator = AVFPatientGenerator(n_patients=n_patients)
+        with contextlib.redirect_stdout(io.StringIO()):
+            patients, treatments, outcomes = generator.generate_cohort(n_treatments=n_treatments, n_workers=1)
+        full_data = build_full_data(patients, treatments, outcomes)
+
+        start = time.perf_counter()
+        patient_index = PatientIndex(patients, outcomes, full_data)
+        build_seconds = time.perf_counter() - start
+
+        selected = np.random.default_rng(0).choice(patient_index.patient_ids, n_lookups)
+        for patient_id in selected[:3]:
+            for expected, actual in zip(scan_lookup(patients, outcomes, full_data, patient_id),
+                                        index_lookup(patient_index, patient_id)):
+                if isinstance(expected, pd.DataFrame):
+                    pd.testing.assert_frame_equal(actual, expected)
+                else:
+                    pd.testing.assert_series_equal(actual, expected)
+
+        start = time.perf_counter()
+        for patient_id in selected:
+            scan_lookup(patients, outcomes, full_data, patient_id)
+        scan_seconds = (time.perf_counter() - start) / n_lookups
+
+        start = time.perf_counter()
+        for patient_id in selected:
+            index_lookup(patient_index, patient_id)
+        index_seconds = (time.perf_counter() - start) / n_lookups
+
+        print(f"{n_patients:>9,} {len(full_data):>11,} {build_seconds * 1e3:>11.1f} {scan_seconds * 1e3:>10.2f} "
+              f"{index_seconds * 1e3:>11.3f} {scan_seconds / index_seconds:>7.0f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000])
+    parser.add_argument('--n-treatments', type=int, default=156)
+    parser.add_argument('--lookups', type=int, default=20, help='random patients looked up per size')
+    args = parser.parse_args()
+    run(args.sizes, args.n_treatments, args.lookups)
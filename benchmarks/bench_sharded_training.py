@@ -0,0 +1,61 @@
+"""Benchmark peak memory of in-memory vs out-of-core (sharded) training.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_sharded_training
+    python -m benchmarks.bench_sharded_training --n-patients 20000 --max-shard-rows 250000 --n-workers 1 4
+
+A cohort is generated once; every configuration then trains in a fresh
+`python -m src.train` subprocess so each peak RSS is its own. "parent" is the
+process that streams the features and merges the forest, "worker" the largest
+shard-fitting process (out-of-core only, its own VmHWM). Both include ~150 MB
+of interpreter and library imports. "workers" shard processes run at once, so
+the fit phase peaks at about workers x worker MB on top of the parent.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+
+def _train(data_dir, results_dir, extra_args):
+    subprocess.run([sys.executable, '-m', 'src.train', '--data-dir', str(data_dir),
+                    '--model-path', str(Path(results_dir) / 'model.pkl'), '--results-dir', str(results_dir),
+                    *extra_args], capture_output=True, check=True)
+    return json.loads((Path(results_dir) / 'training_manifest.json').read_text())
+
+
+def run(n_patients, n_treatments, chunk_sizes, shard_rows, worker_counts):
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp) / 'raw'
+        subprocess.run([sys.executable, '-m', 'src.data_generation', '--n-patients', str(n_patients),
+                        '--n-treatments', str(n_treatments), '--format', 'parquet',
+                        '--output-dir', str(data_dir)], capture_output=True, check=True)
+
+        print(f"{'mode':>12} {'shard rows':>11} {'shards':>7} {'workers':>8} {'chunk rows':>11} {'train rows':>11} "
+              f"{'parent MB':>10} {'worker MB':>10} {'fit s':>7} {'AUC':>7}")
+        configurations = [('in-memory', [])]
+        configurations += [('out-of-core', ['--out-of-core', '--max-shard-rows', str(max_rows),
+                                            '--n-workers', str(workers), '--chunk-rows', str(chunk_rows),
+                                            '--shard-dir', str(Path(tmp) / 'shards')])
+                           for max_rows in shard_rows for workers in worker_counts for chunk_rows in chunk_sizes]
+        for mode, extra_args in configurations:
+            manifest = _train(data_dir, Path(tmp) / 'results', extra_args)
+            split = manifest['split']
+            print(f"{mode:>12} {split.get('max_shard_rows', '-'):>11} {split.get('shards', '-'):>7} "
+                  f"{split.get('fit_workers', '-'):>8} {split.get('chunk_rows', '-'):>11} {split['train_rows']:>11,} "
+                  f"{manifest['peak_rss_mb']:>10,.0f} {manifest.get('peak_rss_mb_workers', 0):>10,.0f} "
+                  f"{manifest['training_seconds']:>7.1f} {manifest['metrics']['auc_roc']:>7.4f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n-patients', type=int, default=10_000)
+    parser.add_argument('--n-treatments', type=int, default=156)
+    parser.add_argument('--chunk-rows', type=int, nargs='+', default=[400_000])
+    parser.add_argument('--max-shard-rows', type=int, nargs='+', default=[150_000, 600_000])
+    parser.add_argument('--n-workers', type=int, nargs='+', default=[1, 2])
+    args = parser.parse_args()
+    run(args.n_patients, args.n_treatments, args.chunk_rows, args.max_shard_rows, args.n_workers)
@@ -0,0 +1,93 @@
+"""Benchmark raw-table load time and resident memory for CSV vs Parquet vs Feather.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_storage
+    python -m benchmarks.bench_storage --sizes 1000 10000 50000
+
+For every cohort size the same cohort is written in each format, then each
+format is loaded in a fresh subprocess (so peak RSS is not polluted by earlier
+loads) with the same column projection the dashboard uses. "csv-old" is the
+original pd.read_csv() of every column with default dtypes. "+RSS" is the
+resident-memory growth caused by the load (Linux /proc), "peak" the process
+high-water mark including interpreter and library imports.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from src.storage import FORMATS, TABLE_FILES
+
+# Mirrors app.load_data(): full patients table, projected treatments/outcomes
+_LOAD_SCRIPT = '''
+import json, os, resource, sys, time
+from src.storage import load_raw_tables
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+before = rss_mb()
+start = time.perf_counter()
+if sys.argv[2] == 'legacy':
+    import pandas as pd
+    patients, treatments, outcomes = (pd.read_csv(f'{sys.argv[1]}/{name}_baseline.csv')
+                                      for name in ('patients', 'treatments', 'outcomes'))
+else:
+    patients, treatments, outcomes = load_raw_tables(data_dir=sys.argv[1], columns={
+        'treatments': ['patient_id', 'treatment_number', 'access_blood_flow_qa', 'venous_pressure_mean',
+                       'svpr', 'access_recirculation_pct', 'ktv', 'high_vp_alarms', 'low_ap_alarms'],
+        'outcomes': ['patient_id', 'failed', 'failure_treatment_number'],
+    })
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'seconds': elapsed,
+    'rss_mb': rss_mb() - before,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'frame_mb': sum(f.memory_usage(deep=True).sum() for f in (patients, treatments, outcomes)) / 2**20,
+}))
+'''
+
+
+def _disk_mb(data_dir, fmt):
+    return sum(path.stat().st_size for table in TABLE_FILES.values()
+               for path in Path(data_dir).glob(f'{table}.{fmt}')) / 2**20
+
+
+def _load_in_subprocess(data_dir, mode):
+    result = subprocess.run([sys.executable, '-c', _LOAD_SCRIPT, str(data_dir), mode],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def run(sizes, n_treatments, repeats):
+    print(f"{'patients':>9} {'format':>8} {'disk MB':>9} {'load s':>8} {'+RSS MB':>8} {'peak MB':>8} {'frame MB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_patients in sizes:
+            for fmt in FORMATS:
+                data_dir = Path(tmp) / f'{n_patients}_{fmt}'
+                # Generate out of process too: a child inherits its parent's RSS high-water mark
+                subprocess.run([sys.executable, '-m', 'src.data_generation', '--n-patients', str(n_patients),
+                                '--n-treatments', str(n_treatments), '--format', fmt,
+                                '--output-dir', str(data_dir)], capture_output=True, check=True)
+
+                # CSV is also measured the old way: pd.read_csv of every column, default dtypes
+                modes = ['legacy', 'compact'] if fmt == 'csv' else ['compact']
+                for mode in modes:
+                    runs = [_load_in_subprocess(data_dir, mode) for _ in range(repeats)]
+                    best = min(runs, key=lambda r: r['seconds'])
+                    label = 'csv-old' if mode == 'legacy' else fmt
+                    print(f"{n_patients:>9,} {label:>8} {_disk_mb(data_dir, fmt):>9.1f} {best['seconds']:>8.3f} "
+                          f"{best['rss_mb']:>8.1f} {best['peak_rss_mb']:>8.1f} {best['frame_mb']:>9.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 50_000])
+    parser.add_argument('--n-treatments', type=int, default=156)
+    parser.add_argument('--repeats', type=int, default=3, help='best of N loads per format')
+    args = parser.parse_args()
+    run(args.sizes, args.n_treatments, args.repeats)
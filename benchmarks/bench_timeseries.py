@@ -0,0 +1,101 @@
+"""Benchmark the batched treatment time-series engine against the per-session loop.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_timeseries
+    python -m benchmarks.bench_timeseries --sizes 1000 10000 100000 --loop-cap 2000
+
+The legacy loop is far too slow to run at 100k patients, so it is timed on at
+most ``--loop-cap`` patients and extrapolated linearly (it is O(rows)).
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from src.data_generation import AVFPatientGenerator
+
+
+def legacy_treatment_timeseries(patients_df, n_treatments=156, treatment_interval_days=2):
+    """Reference copy of the original iterrows()/dict-per-session implementation."""
+    all_treatments = []
+    for idx, patient in patients_df.iterrows():
+        patient_id = patient['patient_id']
+        baseline_risk = patient['baseline_risk_score']
+        start_date = datetime(2024, 1, 1)
+        treatment_dates = [start_date + timedelta(days=i * treatment_interval_days)
+                           for i in range(n_treatments)]
+        for treatment_num, treatment_date in enumerate(treatment_dates):
+            progression = treatment_num / n_treatments
+            qa_baseline = np.random.normal(900, 150)
+            qa_baseline -= baseline_risk * 300
+            qa_decline = baseline_risk * progression * 400
+            qa = qa_baseline - qa_decline + np.random.normal(0, 50)
+            qa = np.clip(qa, 200, 1500)
+            arterial_pressure = np.random.normal(-175, 25)
+            arterial_pressure -= (baseline_risk * 50 + (800 - qa) / 20)
+            arterial_pressure = np.clip(arterial_pressure, -350, -100)
+            venous_pressure = np.random.normal(140, 20)
+            venous_pressure += baseline_risk * progression * 100
+            venous_pressure = np.clip(venous_pressure, 80, 400)
+            map_value = np.random.normal(90, 5)
+            svpr = (venous_pressure * 0.75) / map_value
+            svpr = np.clip(svpr, 0.1, 1.2)
+            if baseline_risk < 0.4:
+                svpr = np.clip(svpr, 0.1, 0.5)
+            high_vp_alarms = np.random.poisson(baseline_risk * progression * 5)
+            low_ap_alarms = np.random.poisson(baseline_risk * progression * 3)
+            ar_base = np.random.uniform(0, 5)
+            if qa < 500 or svpr > 0.5:
+                ar_base += np.random.uniform(5, 20)
+            access_recirculation = np.clip(ar_base, 0, 40)
+            ktv_baseline = np.random.normal(1.4, 0.2)
+            ktv_decline = (baseline_risk * progression * 0.4) + ((800 - qa) / 2000)
+            ktv = np.clip(ktv_baseline - ktv_decline, 0.6, 2.0)
+            all_treatments.append({
+                'patient_id': patient_id,
+                'treatment_number': treatment_num + 1,
+                'treatment_date': treatment_date,
+                'access_blood_flow_qa': round(qa, 1),
+                'arterial_pressure_mean': round(arterial_pressure, 1),
+                'venous_pressure_mean': round(venous_pressure, 1),
+                'map': round(map_value, 1),
+                'svpr': round(svpr, 3),
+                'high_vp_alarms': high_vp_alarms,
+                'low_ap_alarms': low_ap_alarms,
+                'access_recirculation_pct': round(access_recirculation, 1),
+                'ktv': round(ktv, 2)
+            })
+    return pd.DataFrame(all_treatments)
+
+
+def run(sizes, n_treatments, loop_cap):
+    print(f"{'patients':>10} {'rows':>12} {'loop (s)':>12} {'batched (s)':>12} {'speedup':>9}")
+    for n_patients in sizes:
+        generator = AVFPatientGenerator(n_patients=n_patients)
+        patients = generator.generate_baseline_characteristics()
+
+        start = time.perf_counter()
+        treatments = generator.generate_treatment_timeseries(n_treatments=n_treatments)
+        batched = time.perf_counter() - start
+
+        loop_patients = min(n_patients, loop_cap)
+        start = time.perf_counter()
+        legacy_treatment_timeseries(patients.head(loop_patients), n_treatments=n_treatments)
+        loop = (time.perf_counter() - start) * n_patients / loop_patients
+        marker = '*' if loop_patients < n_patients else ' '
+
+        print(f"{n_patients:>10,} {len(treatments):>12,} {loop:>11.2f}{marker} {batched:>12.3f} {loop / batched:>8.0f}x")
+    print("* extrapolated from the loop timed on --loop-cap patients")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--n-treatments', type=int, default=156)
+    parser.add_argument('--loop-cap', type=int, default=1_000,
+                        help='maximum number of patients to run through the legacy loop')
+    args = parser.parse_args()
+    run(args.sizes, args.n_treatments, args.loop_cap)
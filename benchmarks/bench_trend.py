@@ -0,0 +1,59 @@
+"""Micro-benchmark the closed-form rolling slope against rolling().apply(np.polyfit).
+
+Run from the repository root:
+
+    python -m benchmarks.bench_trend
+    python -m benchmarks.bench_trend --sizes 100 1000 --polyfit-cap 200
+
+The polyfit version is timed on at most --polyfit-cap patients and
+extrapolated linearly; parity is checked on those patients.
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from src.data_generation import AVFPatientGenerator
+from src.features import TREND_WINDOW, calculate_slope, rolling_slope, segment_positions
+
+
+def polyfit_trend(treatments, column='access_blood_flow_qa'):
+    """The original qa_trend_12 expression."""
+    return treatments.groupby('patient_id')[column].transform(
+        lambda x: x.rolling(TREND_WINDOW, min_periods=2).apply(calculate_slope, raw=False).fillna(0)
+    )
+
+
+def run(sizes, n_treatments, polyfit_cap):
+    print(f"{'patients':>9} {'rows':>11} {'polyfit (s)':>12} {'closed form (s)':>16} {'speedup':>9}")
+    for n_patients in sizes:
+        generator = AVFPatientGenerator(n_patients=n_patients)
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, treatments, _ = generator.generate_cohort(n_treatments=n_treatments, n_workers=1)
+
+        start = time.perf_counter()
+        _, position = segment_positions(treatments['patient_id'])
+        slopes = rolling_slope(treatments[['access_blood_flow_qa']].to_numpy(dtype=float), position, TREND_WINDOW)
+        closed_form = time.perf_counter() - start
+
+        capped = treatments.iloc[:min(n_patients, polyfit_cap) * n_treatments]
+        start = time.perf_counter()
+        reference = polyfit_trend(capped)
+        polyfit = (time.perf_counter() - start) * len(treatments) / len(capped)
+        marker = '*' if len(capped) < len(treatments) else ' '
+
+        np.testing.assert_allclose(slopes[:len(capped), 0], reference.to_numpy(), rtol=1e-7, atol=1e-9)
+        print(f"{n_patients:>9,} {len(treatments):>11,} {polyfit:>11.2f}{marker} {closed_form:>16.4f} "
+              f"{polyfit / closed_form:>8.0f}x")
+    print("* extrapolated from the polyfit version timed on --polyfit-cap patients")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1_000, 10_000])
+    parser.add_argument('--n-treatments', type=int, default=156)
+    parser.add_argument('--polyfit-cap', type=int, default=200)
+    args = parser.parse_args()
+    run(args.sizes, args.n_treatments, args.polyfit_cap)
@@ -0,0 +1,310 @@
+"""End-to-end benchmark suite: every pipeline stage across cohort sizes, gated against a baseline.
+
+Run from the repository root:
+
+    python -m benchmarks.suite                                          # 1k and 10k patients x 156 treatments
+    python -m benchmarks.suite --sizes 1000 10000 100000 1000000 --treatments 52 156
+    python -m benchmarks.suite --save-baseline                          # also store as the baseline
+    python -m benchmarks.suite --baseline --threshold 0.25              # exit 1 if a stage regressed
+    python -m benchmarks.suite --save-baseline /tmp/ci-baseline.json    # baseline kept elsewhere
+
+For every cohort size (patients x treatments per patient) the suite times, in
+one process and in pipeline order:
+
+    generate_baseline_characteristics / generate_treatment_timeseries /
+    generate_failure_outcomes   the AVFPatientGenerator stages
+    write_csv, write_parquet    the cohort written with CohortWriter
+    load_csv, load_parquet      load_raw_tables() with the dashboard's columns
+    feature_store_parity        the first --parity-patients patients' sessions appended one at a
+                                time to the IncrementalFeatureStore and checked against
+                                build_full_data() (feature_store.check_parity()); a mismatch
+                                stops the suite with an error
+    features                    build_full_data(), the dashboard's load_data() on a cache miss
+    train                       RandomForestClassifier(**RF_PARAMS) on at most --train-rows
+                                labelled rows (sampled), on all cores
+    predict_batch               predict_proba on every patient's latest treatment
+    predict_single              one predict_proba call on one row (median of --single-calls)
+    predict_single_compiled     the same through the CompiledForest export
+
+Each stage records rows processed, time and peak memory: the largest growth
+of resident memory over the stage, sampled from /proc every 5 ms, so
+allocations inside numpy, Arrow and sklearn count. Freed memory is returned
+to the OS before each stage (glibc malloc_trim, Arrow's pool), so a stage
+cannot hide its allocations in memory an earlier one freed. Every stage but
+train runs --repeats times and keeps its best time and memory. Results go to
+results/benchmarks/ as suite-<time>.json plus scaling.html (time and memory
+against cohort size, log-log, one line per stage).
+
+With --baseline (default benchmarks/baseline.json, tracked in git) every
+stage and size present in both runs is compared. A stage regresses when its
+time or peak memory grows by more than --threshold and by more than a noise
+floor (50 ms, 16 MB); the suite then exits with status 1. Baselines are
+machine-specific: store one with --save-baseline (same default path) on the
+machine that gates. Reports and baselines are written atomically, so an
+interrupted run never leaves a truncated baseline behind.
+"""
+import argparse
+import contextlib
+import ctypes
+import ctypes.util
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import pyarrow as pa
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+
+from src.compiled_forest import CompiledForest
+from src.data_generation import AVFPatientGenerator
+from src.feature_store import check_parity
+from src.features import MODEL_FEATURES, build_full_data
+from src.instrumentation import rss_mb
+from src.labels import label_rows
+from src.storage import CohortWriter, load_raw_tables
+from src.train import RF_PARAMS, TRAINING_COLUMNS
+from src.utils import RESULTS_DIR, atomic_write
+
+BENCHMARK_DIR = RESULTS_DIR / 'benchmarks'
+# Reference baseline, tracked in git next to this file (results/ is not)
+BASELINE_PATH = Path(__file__).resolve().parent / 'baseline.json'
+
+# Patients whose sessions feature_store_parity replays one at a time
+PARITY_PATIENTS = 200
+
+# A change smaller than this is noise, whatever its ratio
+MIN_SECONDS_CHANGE = 0.05
+MIN_MEMORY_CHANGE_MB = 16
+
+_SAMPLE_INTERVAL = 0.005
+
+_LIBC = ctypes.CDLL(ctypes.util.find_library('c')) if ctypes.util.find_library('c') else None
+
+
+def _release_memory():
+    """Hand freed memory back to the OS, so a stage's RSS growth is not absorbed by its predecessors' leftovers."""
+    gc.collect()
+    pa.default_memory_pool().release_unused()
+    if _LIBC is not None and hasattr(_LIBC, 'malloc_trim'):
+        _LIBC.malloc_trim(0)
+
+
+def _measure(function):
+    """(result, seconds, peak resident-memory growth in MB) of function()."""
+    _release_memory()
+    before = rss_mb()
+    peak = [before]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(_SAMPLE_INTERVAL):
+            peak[0] = max(peak[0], rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+    finally:
+        seconds = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    return result, seconds, max(peak[0], rss_mb()) - before
+
+
+def _median_call(function, calls):
+    seconds = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return float(np.median(seconds))
+
+
+def run_size(n_patients, n_treatments, train_rows, single_calls, seed, repeats, parity_patients=PARITY_PATIENTS):
+    """Records of every stage for one cohort size, printed as they finish."""
+    records = []
+
+    def record(name, seconds, memory, n_rows):
+        records.append({'stage': name, 'n_patients': n_patients, 'n_treatments': n_treatments, 'rows': n_rows,
+                        'seconds': seconds, 'peak_rss_mb': round(memory, 1)})
+        print(f"{n_patients:>10,} {n_treatments:>6} {name:<34} {seconds:>10.4f} {memory:>9.0f} "
+              f"{n_rows / max(seconds, 1e-9):>14,.0f}")
+
+    def stage(name, function, rows, repeats=repeats):
+        # Best of `repeats` runs, for time and memory alike
+        runs = []
+        for _ in range(repeats):
+            result, seconds, memory = _measure(function)
+            runs.append((seconds, memory))
+        record(name, min(seconds for seconds, _ in runs), min(memory for _, memory in runs),
+               rows(result) if callable(rows) else rows)
+        return result
+
+    def quietly(function):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function()
+
+    generator = AVFPatientGenerator(n_patients=n_patients, seed=seed)
+    patients = stage('generate_baseline_characteristics', generator.generate_baseline_characteristics, len)
+    treatments = stage('generate_treatment_timeseries',
+                       lambda: generator.generate_treatment_timeseries(n_treatments), len)
+    outcomes = stage('generate_failure_outcomes', lambda: quietly(generator.generate_failure_outcomes), len)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in ('csv', 'parquet'):
+            def write(fmt=fmt):
+                (Path(tmp) / fmt).mkdir(exist_ok=True)
+                with CohortWriter(Path(tmp) / fmt, fmt=fmt) as writer:
+                    writer.write(patients, treatments, outcomes)
+            stage(f'write_{fmt}', write, len(treatments))
+        del generator, patients, treatments, outcomes
+        for fmt in ('csv', 'parquet'):
+            tables = stage(f'load_{fmt}', lambda: load_raw_tables(TRAINING_COLUMNS, Path(tmp) / fmt),
+                           lambda loaded: len(loaded[1]))
+        patients, treatments, outcomes = tables
+        del tables
+
+    parity_sample = treatments[treatments['patient_id'].isin(patients['patient_id'].iloc[:parity_patients])]
+    stage('feature_store_parity', lambda: check_parity(patients, parity_sample, outcomes), len(parity_sample),
+          repeats=1)
+    del parity_sample
+    full_data = stage('features', lambda: build_full_data(patients, treatments, outcomes), len)
+    del treatments
+
+    keep, label = label_rows(full_data, outcomes)
+    rows = np.flatnonzero(keep)
+    if len(rows) > train_rows:
+        rows = np.sort(np.random.default_rng(seed).choice(rows, train_rows, replace=False))
+    X_train, y_train = full_data[MODEL_FEATURES].iloc[rows], label[rows]
+    model = RandomForestClassifier(**RF_PARAMS, random_state=seed, n_jobs=-1)
+    stage('train', lambda: model.fit(X_train, y_train), len(rows), repeats=1)
+    del X_train
+
+    latest = full_data.groupby('patient_id', observed=True).tail(1)[MODEL_FEATURES]
+    stage('predict_batch', lambda: model.predict_proba(latest), len(latest))
+    # Single-row latency, as when one live session is scored; no memory figure
+    one_row = latest.iloc[:1]
+    model.n_jobs = 1
+    record('predict_single', _median_call(lambda: model.predict_proba(one_row), single_calls), 0.0, 1)
+    forest = CompiledForest.from_sklearn(model)
+    record('predict_single_compiled', _median_call(lambda: forest.predict_proba(one_row), single_calls), 0.0, 1)
+    return records
+
+
+def compare(results, baseline, threshold):
+    """Per stage and size in both runs: the baseline and current figures, and whether it regressed."""
+    key = ['stage', 'n_patients', 'n_treatments']
+    merged = pd.DataFrame(results).merge(pd.DataFrame(baseline), on=key, suffixes=('', '_baseline'))
+    merged['time_change'] = merged['seconds'] / merged['seconds_baseline'] - 1
+    merged['memory_change'] = merged['peak_rss_mb'] - merged['peak_rss_mb_baseline']
+    slower = ((merged['time_change'] > threshold)
+              & (merged['seconds'] - merged['seconds_baseline'] > MIN_SECONDS_CHANGE))
+    bigger = ((merged['peak_rss_mb'] > merged['peak_rss_mb_baseline'] * (1 + threshold))
+              & (merged['memory_change'] > MIN_MEMORY_CHANGE_MB))
+    merged['regressed'] = slower | bigger
+    return merged
+
+
+def scaling_figure(results):
+    """Log-log time and peak memory against cohort size: one line per stage, one column per treatments count."""
+    frame = pd.DataFrame(results).melt(id_vars=['stage', 'n_patients', 'n_treatments'],
+                                       value_vars=['seconds', 'peak_rss_mb'], var_name='metric')
+    frame = frame[frame['value'] > 0]
+    fig = px.line(frame, x='n_patients', y='value', color='stage', facet_row='metric', facet_col='n_treatments',
+                  markers=True, log_x=True, log_y=True, height=900,
+                  title='Pipeline stages: time (s) and peak memory growth (MB) by cohort size')
+    fig.update_yaxes(matches=None)
+    return fig
+
+
+def _write_json(path, data):
+    with atomic_write(path) as tmp:
+        tmp.write_text(json.dumps(data, indent=2))
+
+
+def run(sizes, treatment_counts, train_rows, single_calls, seed, repeats, output_dir, baseline_path, save_baseline,
+        threshold, parity_patients=PARITY_PATIENTS):
+    """Run the suite; baseline_path compares against a saved run, save_baseline is where to store this one."""
+    if baseline_path and not Path(baseline_path).exists():
+        raise SystemExit(f"No baseline at {baseline_path}; store one first with --save-baseline {baseline_path}")
+
+    print(f"{'patients':>10} {'treat.':>6} {'stage':<34} {'seconds':>10} {'peak MB':>9} {'rows/s':>14}")
+    results = []
+    for n_treatments in treatment_counts:
+        for n_patients in sizes:
+            results.extend(run_size(n_patients, n_treatments, train_rows, single_calls, seed, repeats,
+                                    parity_patients))
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    created = datetime.now(timezone.utc)
+    report = {
+        'created': created.isoformat(timespec='seconds'),
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(),
+                    'cpu_count': os.cpu_count(), 'python': platform.python_version(),
+                    'numpy': np.__version__, 'pandas': pd.__version__, 'sklearn': sklearn.__version__},
+        'parameters': {'sizes': sizes, 'treatments': treatment_counts, 'train_rows': train_rows,
+                       'single_calls': single_calls, 'seed': seed, 'repeats': repeats,
+                       'parity_patients': parity_patients},
+        'results': results,
+    }
+    result_path = output_dir / f"suite-{created:%Y%m%d-%H%M%S}.json"
+    _write_json(result_path, report)
+    scaling_figure(results).write_html(output_dir / 'scaling.html', include_plotlyjs='cdn')
+    print(f"\n✓ Results saved to {result_path}, scaling plots to {output_dir / 'scaling.html'}")
+
+    exit_code = 0
+    if baseline_path:
+        baseline = json.loads(Path(baseline_path).read_text())
+        comparison = compare(results, baseline['results'], threshold)
+        print(f"\nAgainst {baseline_path} ({baseline['created']}), threshold {threshold:.0%}:")
+        print(f"{'patients':>10} {'treat.':>6} {'stage':<34} {'baseline s':>11} {'now s':>10} {'time':>8} "
+              f"{'memory':>9}")
+        for row in comparison.itertuples():
+            print(f"{row.n_patients:>10,} {row.n_treatments:>6} {row.stage:<34} {row.seconds_baseline:>11.4f} "
+                  f"{row.seconds:>10.4f} {row.time_change:>+8.0%} {row.memory_change:>+7.0f}MB"
+                  f"{'  REGRESSED' if row.regressed else ''}")
+        if comparison['regressed'].any():
+            print(f"\n✗ {int(comparison['regressed'].sum())} stage(s) regressed by more than {threshold:.0%}")
+            exit_code = 1
+        else:
+            print(f"\n✓ No stage regressed by more than {threshold:.0%} ({len(comparison)} compared)")
+    if save_baseline:
+        _write_json(save_baseline, report)
+        print(f"✓ Saved as the baseline: {save_baseline}")
+    return exit_code
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000], help='patients per cohort')
+    parser.add_argument('--treatments', type=int, nargs='+', default=[156], help='treatments per patient')
+    parser.add_argument('--train-rows', type=int, default=200_000, help='labelled rows sampled for the train stage')
+    parser.add_argument('--single-calls', type=int, default=200, help='single-row predict_proba calls timed')
+    parser.add_argument('--parity-patients', type=int, default=PARITY_PATIENTS,
+                        help='patients replayed through the incremental feature store and checked')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeats', type=int, default=3, help='runs per stage, best kept (train runs once)')
+    parser.add_argument('--output-dir', default=str(BENCHMARK_DIR))
+    baseline_name = BASELINE_PATH.relative_to(RESULTS_DIR.parent)
+    parser.add_argument('--baseline', nargs='?', const=str(BASELINE_PATH), default=None,
+                        help=f'compare against this run (default {baseline_name})')
+    parser.add_argument('--save-baseline', nargs='?', const=str(BASELINE_PATH), default=None,
+                        help=f'store this run as the baseline (default {baseline_name})')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative growth in time or peak memory that counts as a regression')
+    args = parser.parse_args()
+    sys.exit(run(args.sizes, args.treatments, args.train_rows, args.single_calls, args.seed, args.repeats,
+                 args.output_dir, args.baseline, args.save_baseline, args.threshold, args.parity_patients))
@@ -0,0 +1,233 @@
+"""Pre-aggregated, per-clinic risk statistics for the Clinic Overview page.
+
+The overview used to filter, sort, histogram and pd.cut the latest treatment
+of every patient on each rerun. ClinicAggregates instead splits the patients
+into one ClinicShard per clinic_id. Each shard holds its patients' latest risk
+scores and keeps running aggregates over them: patient count, risk sum,
+high-risk and critical counts, risk histogram bins and per-age-group risk sums.
+A changed score (a live session, see src/ingestion.py) adjusts those
+aggregates by the difference between the old and new score, so an update costs
+O(changed patients), never O(cohort).
+
+Views over several clinics fan out to the shards on a thread pool. Each shard
+returns a snapshot of a few dozen numbers under its own lock, and the snapshots
+are summed. Rendering the overview therefore costs O(clinics) whatever the
+number of patients, and updates to one clinic never block reads of another.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.instrumentation import timed
+
+# Risk score (%) above which a patient is high risk, and above which the alert is critical
+HIGH_RISK_THRESHOLD = 70
+CRITICAL_RISK_THRESHOLD = 85
+
+# Risk histogram: 20 bins of 5 percentage points; 100% falls in the last bin
+RISK_BIN_WIDTH = 5
+N_RISK_BINS = 100 // RISK_BIN_WIDTH
+
+# Age groups of the overview, right-closed like pd.cut
+AGE_BINS = [0, 40, 50, 60, 70, 100]
+AGE_LABELS = ['<40', '40-50', '50-60', '60-70', '70+']
+
+# Clinic of every patient when the patients table has no clinic_id (cohorts generated before it existed)
+UNASSIGNED_CLINIC = 'unassigned'
+
+# Threads for the fan-out over clinic shards
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def _risk_bins(risk):
+    return np.clip((risk // RISK_BIN_WIDTH).astype(np.intp), 0, N_RISK_BINS - 1)
+
+
+def _age_groups(age):
+    """Index into AGE_LABELS of every age, or -1 outside AGE_BINS."""
+    age = np.asarray(age, dtype=np.float64)
+    group = np.searchsorted(AGE_BINS, age, side='left') - 1
+    return np.where((age > AGE_BINS[0]) & (age <= AGE_BINS[-1]), group, -1)
+
+
+class ClinicShard:
+    """One clinic's patients, their latest risk scores and running aggregates over them.
+
+    rows are the patients' positions in the frame the aggregates were built
+    from (ClinicAggregates' `latest`).
+    """
+
+    def __init__(self, clinic_id, rows, age, risk):
+        self.clinic_id = clinic_id
+        self.rows = rows
+        self.risk = np.array(risk, dtype=np.float64)
+        self._age_group = _age_groups(age)
+        self._lock = threading.Lock()
+
+        self.n_patients = len(self.risk)
+        self.risk_sum = 0.0
+        self.high_risk = 0
+        self.critical = 0
+        self.histogram = np.zeros(N_RISK_BINS, dtype=np.int64)
+        self.age_risk_sum = np.zeros(len(AGE_LABELS))
+        self.age_count = np.bincount(self._age_group[self._age_group >= 0], minlength=len(AGE_LABELS))
+        self._add(np.arange(self.n_patients), self.risk, 1)
+
+    def _add(self, positions, risk, sign):
+        self.risk_sum += sign * risk.sum()
+        self.high_risk += sign * int((risk > HIGH_RISK_THRESHOLD).sum())
+        self.critical += sign * int((risk > CRITICAL_RISK_THRESHOLD).sum())
+        self.histogram += sign * np.bincount(_risk_bins(risk), minlength=N_RISK_BINS)
+        group = self._age_group[positions]
+        grouped = group >= 0
+        self.age_risk_sum += sign * np.bincount(group[grouped], weights=risk[grouped], minlength=len(AGE_LABELS))
+
+    def update(self, positions, risk):
+        """Set the risk of the patients at `positions` (unique, within the shard) to `risk`."""
+        with self._lock:
+            self._add(positions, self.risk[positions], -1)
+            self.risk[positions] = risk
+            self._add(positions, self.risk[positions], 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {'clinic_id': self.clinic_id, 'n_patients': self.n_patients, 'risk_sum': self.risk_sum,
+                    'high_risk': self.high_risk, 'critical': self.critical, 'histogram': self.histogram.copy(),
+                    'age_risk_sum': self.age_risk_sum.copy(), 'age_count': self.age_count}
+
+    def top(self, n, threshold):
+        """(rows, risk) of up to n patients above `threshold`, unordered."""
+        with self._lock:
+            above = np.flatnonzero(self.risk > threshold)
+            if len(above) > n:
+                above = above[np.argpartition(self.risk[above], -n)[-n:]]
+            return self.rows[above], self.risk[above]
+
+
+class ClinicAggregates:
+    """ClinicShards for every clinic in a one-row-per-patient frame of latest risk scores.
+
+    `latest` needs patient_id, age and risk_score, plus clinic_id if the
+    cohort has clinics. The frame is kept to restore the original scores if
+    the live store is reset; it must not be modified.
+    """
+
+    def __init__(self, latest, n_workers=DEFAULT_WORKERS):
+        self.latest = latest
+        self._n_workers = n_workers
+        self._pool = ThreadPoolExecutor(n_workers, thread_name_prefix='clinic')
+        self._lock = threading.Lock()
+        self._live = (None, 0)
+
+        clinics = (latest['clinic_id'].astype(str) if 'clinic_id' in latest
+                   else pd.Series(UNASSIGNED_CLINIC, index=latest.index))
+        codes, clinic_ids = pd.factorize(clinics, sort=True)
+        self.clinic_ids = list(clinic_ids)
+
+        # Every patient's shard and position within it
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(clinic_ids) + 1))
+        self._patients = pd.Index(latest['patient_id'].astype(str))
+        if not self._patients.is_unique:
+            raise ValueError("latest must have one row per patient")
+        # Build the id lookup table now rather than on the first live update
+        self._patients.get_indexer(self._patients[:1])
+        self._shard = codes
+        self._position = np.empty(len(codes), dtype=np.intp)
+        self._position[order] = np.arange(len(codes)) - np.repeat(bounds[:-1], np.diff(bounds))
+
+        members = [order[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        age = latest['age'].to_numpy()
+        risk = latest['risk_score'].to_numpy()
+        self.shards = self._fan_out(lambda clinic_id, rows: ClinicShard(clinic_id, rows, age[rows], risk[rows]),
+                                    zip(self.clinic_ids, members))
+
+    def _fan_out(self, function, items):
+        """[function(*item) for item in items], run as one pool task per worker rather than per item."""
+        items = list(items)
+        size = max(1, -(-len(items) // self._n_workers))
+        batches = self._pool.map(lambda batch: [function(*item) for item in batch],
+                                 [items[start:start + size] for start in range(0, len(items), size)])
+        return [result for batch in batches for result in batch]
+
+    def update(self, patient_ids, risk):
+        """Set the latest risk score of each patient; later entries win. Returns the number of patients updated."""
+        rows = self._patients.get_indexer(pd.Index(patient_ids).astype(str))
+        risk = np.asarray(risk, dtype=np.float64)
+        known = rows >= 0
+        rows, risk = rows[known], risk[known]
+        # Last occurrence of every patient
+        _, last = np.unique(rows[::-1], return_index=True)
+        keep = len(rows) - 1 - last
+        rows, risk = rows[keep], risk[keep]
+
+        shard = self._shard[rows]
+        order = np.argsort(shard, kind='stable')
+        clinics, starts = np.unique(shard[order], return_index=True)
+        groups = np.split(order, starts[1:])
+        self._fan_out(lambda k, group: self.shards[k].update(self._position[rows[group]], risk[group]),
+                      zip(clinics, groups))
+        return len(rows)
+
+    @timed()
+    def sync(self, live_scores):
+        """Apply the sessions a LiveScores object has read since the last sync."""
+        with self._lock:
+            generation, applied = self._live
+            if generation != live_scores.generation:
+                # The live store was reset: back to the original scores, then replay it from the start
+                if generation is not None:
+                    self.update(self._patients, self.latest['risk_score'].to_numpy())
+                applied = 0
+            new = live_scores.rows.iloc[applied:]
+            if len(new):
+                self.update(new['patient_id'], new['risk_score'].to_numpy())
+            self._live = (live_scores.generation, len(live_scores.rows))
+
+    def _select(self, clinics):
+        if clinics is None:
+            return self.shards
+        return [self.shards[self.clinic_ids.index(clinic)] for clinic in clinics]
+
+    def summary(self, clinics=None):
+        """Overview statistics over `clinics` (default: all of them).
+
+        Returns a dict with n_patients, high_risk, critical, mean_risk, a
+        risk_histogram frame (bin start, bin end, patients) and an
+        age_group_risk frame (age_group, mean risk_score; NaN for empty groups).
+        """
+        snapshots = self._fan_out(ClinicShard.snapshot, zip(self._select(clinics)))
+        n_patients = sum(snapshot['n_patients'] for snapshot in snapshots)
+        age_risk_sum = sum(snapshot['age_risk_sum'] for snapshot in snapshots)
+        age_count = sum(snapshot['age_count'] for snapshot in snapshots)
+        bin_start = np.arange(N_RISK_BINS) * RISK_BIN_WIDTH
+        with np.errstate(invalid='ignore', divide='ignore'):
+            age_mean = age_risk_sum / age_count
+        return {
+            'n_patients': n_patients,
+            'high_risk': sum(snapshot['high_risk'] for snapshot in snapshots),
+            'critical': sum(snapshot['critical'] for snapshot in snapshots),
+            'mean_risk': sum(snapshot['risk_sum'] for snapshot in snapshots) / n_patients if n_patients else np.nan,
+            'risk_histogram': pd.DataFrame({'bin_start': bin_start, 'bin_end': bin_start + RISK_BIN_WIDTH,
+                                            'patients': sum(snapshot['histogram'] for snapshot in snapshots)}),
+            'age_group_risk': pd.DataFrame({'age_group': AGE_LABELS, 'risk_score': age_mean}),
+        }
+
+    def per_clinic(self, clinics=None):
+        """One row per clinic: patients, high_risk, critical and mean_risk."""
+        snapshots = self._fan_out(ClinicShard.snapshot, zip(self._select(clinics)))
+        table = pd.DataFrame([{'clinic_id': snapshot['clinic_id'], 'patients': snapshot['n_patients'],
+                               'high_risk': snapshot['high_risk'], 'critical': snapshot['critical'],
+                               'mean_risk': snapshot['risk_sum'] / snapshot['n_patients']}
+                              for snapshot in snapshots])
+        return table.sort_values(['high_risk', 'mean_risk'], ascending=False, ignore_index=True)
+
+    def top_rows(self, n, threshold=HIGH_RISK_THRESHOLD, clinics=None):
+        """Positions in `latest` of the n highest-risk patients above `threshold`, highest first."""
+        tops = self._fan_out(lambda shard: shard.top(n, threshold), zip(self._select(clinics)))
+        rows = np.concatenate([rows for rows, _ in tops] + [np.empty(0, dtype=np.intp)])
+        risk = np.concatenate([risk for _, risk in tops] + [np.empty(0)])
+        return rows[np.argsort(-risk, kind='stable')[:n]]
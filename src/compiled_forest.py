@@ -0,0 +1,245 @@
+"""Flat-array tree ensemble for low-latency scoring.
+
+RandomForestClassifier.predict_proba has a large fixed cost per call
+(DataFrame validation, feature-name checks, joblib dispatch over trees), which
+dominates when scoring one patient. CompiledForest copies every tree of a
+fitted forest into a single set of node arrays (feature, threshold, left and
+right child, class probabilities) and evaluates all trees for all rows at
+once: each step advances every unfinished (row, tree) pair one level down,
+so the only Python loop is over tree depth.
+
+Inputs are cast to float32 exactly as sklearn does before comparing with the
+split thresholds, so probabilities match sklearn's (verified by
+benchmarks/bench_compiled_forest.py).
+
+save() writes the node arrays to one file: an 8-byte magic, the length of a
+JSON header (format version, feature names, class order, array dtypes, shapes
+and offsets) and the raw arrays, each 64-byte aligned. load() memory-maps the
+file and views the arrays in place, so loading costs a header parse instead
+of unpickling 100 trees, and every process that loads the same file shares
+its pages through the OS page cache. Export an existing pickle with
+
+    python -m src.compiled_forest models/rf_avf_failure_model.pkl
+"""
+import argparse
+import json
+import struct
+from pathlib import Path
+
+import joblib
+import numpy as np
+
+from src.features import MODEL_FEATURES
+from src.utils import atomic_write, file_digest
+
+# Rows evaluated together; bounds the (rows x trees) node-index working set
+DEFAULT_BLOCK_ROWS = 4_096
+
+# Bump whenever the file layout or the meaning of the arrays changes
+FORMAT_VERSION = 1
+COMPILED_SUFFIX = '.forest'
+
+_MAGIC = b'AVFTREES'
+_ALIGNMENT = 64
+_ARRAYS = ('feature', 'threshold', 'children', 'value', 'roots')
+
+
+class CompiledForest:
+    """Array form of a fitted sklearn forest classifier.
+
+    Node i of the ensemble splits on feature[i] at threshold[i]: rows with
+    x <= threshold go to children[2 * i], the others to children[2 * i + 1].
+    Leaves are their own children. value[i] holds the class probabilities of
+    node i and roots[t] is the root node of tree t.
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth, classes, feature_names):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.classes_ = classes
+        self.feature_names = list(feature_names)
+        self.is_leaf = children[::2] == np.arange(len(feature))
+
+    @classmethod
+    def from_sklearn(cls, model, feature_names=MODEL_FEATURES):
+        """Compile a fitted RandomForestClassifier (or any forest of DecisionTreeClassifiers)."""
+        features, thresholds, children, values, roots = [], [], [], [], []
+        offset = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            is_leaf = tree.children_left == -1
+            own = np.arange(offset, offset + tree.node_count)
+            left = np.where(is_leaf, own, tree.children_left + offset)
+            right = np.where(is_leaf, own, tree.children_right + offset)
+            children.append(np.stack([left, right], axis=1).ravel().astype(np.int32))
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+
+            # Same normalisation as DecisionTreeClassifier.predict_proba
+            value = tree.value[:, 0, :].astype(np.float64)
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0] = 1
+            values.append(value / normalizer)
+
+            roots.append(offset)
+            offset += tree.node_count
+
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            children=np.concatenate(children),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max(estimator.tree_.max_depth for estimator in model.estimators_),
+            classes=model.classes_,
+            feature_names=feature_names,
+        )
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    def _as_array(self, X):
+        if hasattr(X, 'columns'):
+            X = X[self.feature_names].to_numpy()
+        # sklearn evaluates trees on float32 inputs
+        return np.ascontiguousarray(X, dtype=np.float32).reshape(-1, len(self.feature_names))
+
+    def apply(self, X, visit=None):
+        """Leaf index (into the ensemble node arrays) of every row in every tree, shape (n_rows, n_trees).
+
+        visit(pairs, parents, children), if given, is called at every level
+        with the (row * n_trees + tree) indices of the pairs that moved and
+        the nodes they moved from and to.
+        """
+        X = self._as_array(X)
+        n_rows, n_features = X.shape
+        values = X.ravel()
+
+        # One entry per (row, tree) pair; pairs that reach a leaf drop out of `active`
+        nodes = np.tile(self.roots, n_rows)
+        row_offset = np.repeat(np.arange(n_rows, dtype=np.int64) * n_features, self.n_estimators)
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        for _ in range(self.max_depth):
+            if not len(active):
+                break
+            parent = nodes[active]
+            go_right = values[row_offset[active] + self.feature[parent]] > self.threshold[parent]
+            current = self.children[2 * parent + go_right]
+            if visit is not None:
+                visit(active, parent, current)
+            nodes[active] = current
+            active = active[~self.is_leaf[current]]
+        return nodes.reshape(n_rows, self.n_estimators)
+
+    def predict_proba(self, X, block_rows=DEFAULT_BLOCK_ROWS):
+        """Class probabilities averaged over trees, as RandomForestClassifier.predict_proba."""
+        X = self._as_array(X)
+        proba = np.empty((len(X), len(self.classes_)))
+        for start in range(0, len(X), block_rows):
+            leaves = self.apply(X[start:start + block_rows])
+            proba[start:start + block_rows] = self.value[leaves].mean(axis=1)
+        return proba
+
+    def contributions(self, X, class_index=-1, block_rows=DEFAULT_BLOCK_ROWS):
+        """Per-feature contributions to each row's probability of classes_[class_index].
+
+        Decision-path (Saabas) decomposition: every split on a row's path moves
+        the node probability from the parent's value to the child's, and the
+        change is credited to the split feature. Averaged over trees this gives
+        (bias, contributions) with bias + contributions.sum(axis=1) equal to
+        predict_proba(X)[:, class_index]; bias is the mean root probability,
+        the same for every row. All rows and trees are walked together, as in
+        apply().
+        """
+        X = self._as_array(X)
+        n_rows, n_features = X.shape
+        value = self.value[:, class_index]
+        contributions = np.zeros((n_rows, n_features))
+        for start in range(0, n_rows, block_rows):
+            block = X[start:start + block_rows]
+            totals = np.zeros(len(block) * n_features)
+
+            def credit(pairs, parents, children):
+                cells = pairs // self.n_estimators * n_features + self.feature[parents]
+                totals[:] += np.bincount(cells, weights=value[children] - value[parents], minlength=len(totals))
+
+            self.apply(block, visit=credit)
+            contributions[start:start + block_rows] = totals.reshape(len(block), n_features) / self.n_estimators
+        return value[self.roots].mean(), contributions
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def save(self, path, source_digest=None):
+        """Atomically write the forest to `path`; source_digest records the pickle it came from."""
+        header = {
+            'format_version': FORMAT_VERSION,
+            'feature_names': self.feature_names,
+            'classes': self.classes_.tolist(),
+            'max_depth': int(self.max_depth),
+            'source_digest': source_digest,
+            'arrays': {},
+        }
+        offset = 0
+        for name in _ARRAYS:
+            array = getattr(self, name)
+            offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+            header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += array.nbytes
+
+        encoded = json.dumps(header).encode()
+        data_start = -(-(len(_MAGIC) + 8 + len(encoded)) // _ALIGNMENT) * _ALIGNMENT
+        with atomic_write(path) as tmp, open(tmp, 'wb') as f:
+            f.write(_MAGIC + struct.pack('<Q', len(encoded)) + encoded)
+            for name in _ARRAYS:
+                f.seek(data_start + header['arrays'][name]['offset'])
+                f.write(np.ascontiguousarray(getattr(self, name)).tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a forest written by save(); the node arrays are read-only views of the file."""
+        header, data_start = read_header(path)
+        buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        arrays = {}
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            start = data_start + spec['offset']
+            count = int(np.prod(spec['shape']))
+            arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(spec['shape'])
+        return cls(**arrays, max_depth=header['max_depth'], classes=np.asarray(header['classes']),
+                   feature_names=header['feature_names'])
+
+
+def read_header(path):
+    """(header dict, offset of the first array) of a file written by CompiledForest.save()."""
+    with open(path, 'rb') as f:
+        magic, length = f.read(len(_MAGIC)), struct.unpack('<Q', f.read(8))[0]
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a compiled forest file")
+        header = json.loads(f.read(length))
+    if header['format_version'] != FORMAT_VERSION:
+        raise ValueError(f"{path} has format version {header['format_version']}, expected {FORMAT_VERSION}")
+    return header, -(-(len(_MAGIC) + 8 + length) // _ALIGNMENT) * _ALIGNMENT
+
+
+def export(model_path, output=None):
+    """Compile a pickled forest and save it next to the pickle (or to `output`); returns the output path."""
+    model_path = Path(model_path)
+    output = Path(output) if output else model_path.with_suffix(COMPILED_SUFFIX)
+    CompiledForest.from_sklearn(joblib.load(model_path)).save(output, source_digest=file_digest(model_path))
+    return output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a pickled forest to the memory-mappable compiled format.')
+    parser.add_argument('model', help='pickled RandomForestClassifier')
+    parser.add_argument('--output', help=f'default: the model path with a {COMPILED_SUFFIX} suffix')
+    args = parser.parse_args()
+
+    output = export(args.model, args.output)
+    print(f"✓ Saved compiled forest to {output} ({output.stat().st_size / 2**20:.1f} MB)")
@@ -1,361 +1,497 @@
+import argparse
 import numpy as np
+import os
 import pandas as pd
-from datetime import datetime, timedelta
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
 import warnings
+
+from src.instrumentation import timed
+from src.storage import FORMATS, RAW_DATA_DIR, TABLE_FILES, CohortWriter
+
 warnings.filterwarnings('ignore')
 
-#Set random seed for reproducing
-np.random.seed(42)
+#Default seed for reproducing
+DEFAULT_SEED = 42
 
-class AVFPatientGenerator:
+# Patients are simulated in fixed-size chunks, each with its own RNG stream spawned
+# from the cohort seed. Chunk boundaries depend only on chunk_size (never on the
+# number of workers), so a given seed always produces the same cohort.
+DEFAULT_CHUNK_SIZE = 10_000
 
-    def __init__(self, n_patients=1000):
-        self.n_patients = n_patients
-        self.patients_df = None
+# Dialysis facilities patients are spread over (clinic_id CL_000, CL_001, ...)
+DEFAULT_N_CLINICS = 24
 
-    def generate_baseline_characteristics(self):
+# One child stream per generation stage within each chunk
+_BASELINE_STREAM, _TREATMENT_STREAM, _OUTCOME_STREAM = range(3)
+
+
+def _chunk_bounds(n_patients, chunk_size):
+    return [(start, min(start + chunk_size, n_patients)) for start in range(0, n_patients, chunk_size)]
+
+
+def _patient_id_width(n_patients):
+    # Zero-pad ids so they sort in generation order (PT_00000 for the usual cohorts)
+    return max(5, len(str(max(n_patients - 1, 0))))
 
-        age = np.random.gamma(shape = 7, scale = 9, size = self.n_patients)
-        age = np.clip(age, 25,90).astype(int)
+
+def _clinic_weights(n_clinics):
+    # Facilities differ in size: clinic k gets a share proportional to 1 / sqrt(k + 1)
+    weights = 1 / np.sqrt(np.arange(1, n_clinics + 1))
+    return weights / weights.sum()
+
+
+@timed(rows=len)
+def _simulate_baselines(rng, first_patient, n_patients, id_width=5, n_clinics=DEFAULT_N_CLINICS):
+
+    age = rng.gamma(shape = 7, scale = 9, size = n_patients)
+    age = np.clip(age, 25,90).astype(int)
 
 # ~55% male, 45% female
-        sex = np.random.choice(['M', 'F'], size = self.n_patients, p = [0.55, 0.45])
+    sex = rng.choice(['M', 'F'], size = n_patients, p = [0.55, 0.45])
 #Diabetes: ~40% prevelance
-        diabetes = np.random.choice([0, 1], size = self.n_patients, p = [0.60, 0.40])
+    diabetes = rng.choice([0, 1], size = n_patients, p = [0.60, 0.40])
 # Hypertension: ~80% prevalence
-        hypertension = np.random.choice([0, 1], size = self.n_patients, p = [0.20, 0.80])
+    hypertension = rng.choice([0, 1], size = n_patients, p = [0.20, 0.80])
 # Coronary Artery Disease: ~30% prevalence
-        cad = np.random.choice([0, 1], size = self.n_patients, p = [0.70, 0.30])
+    cad = rng.choice([0, 1], size = n_patients, p = [0.70, 0.30])
 # Peripheral Vascular Disease: ~25% prevalance
-        pvd = np.random.choice([0,1], size = self.n_patients, p = [0.75, 0.25])
+    pvd = rng.choice([0,1], size = n_patients, p = [0.75, 0.25])
 
 #Prior Intervention: Most have 0-2, few have many
-        prior_interventions = np.random.negative_binomial(n=1, p=0.5, size = self.n_patients)
-        prior_interventions = np.clip(prior_interventions, 0, 8)
-
-        #History of CVC use: ~35% have had a catheter
-        history_cvc = np.random.choice([0,1], size = self.n_patients, p=[0.65, 0.35])
-
-        #Create baseline risk score (we'll use this to influence outcomes later)
-        # This is a "hidden" variable that represents underlying vascular health
-        baseline_risk = self._calculate_baseline_risk(
-            age, sex, diabetes, hypertension, cad, pvd,
-            prior_interventions, history_cvc
-        )
-
-        #Create Dataframe
-        self.patients_df = pd.DataFrame({
-            'patient_id': [f'PT_{i:05d}' for i in range (self.n_patients)],
-            'age': age,
-            'sex': sex,
-            'diabetes': diabetes,
-            'hypertension': hypertension,
-            'cad': cad,
-            'pvd': pvd,
-            'prior_interventions': prior_interventions,
-            'history_cvc': history_cvc,
-            'baseline_risk_score': baseline_risk
-        })
-
-        return self.patients_df
+    prior_interventions = rng.negative_binomial(n=1, p=0.5, size = n_patients)
+    prior_interventions = np.clip(prior_interventions, 0, 8)
 
-    def _calculate_baseline_risk(self, age, sex, diabetes, hypertension, cad, pvd, prior_interventions, history_cvc):
+    #History of CVC use: ~35% have had a catheter
+    history_cvc = rng.choice([0,1], size = n_patients, p=[0.65, 0.35])
 
-        risk = np.zeros(len(age))
+    #Create baseline risk score (we'll use this to influence outcomes later)
+    # This is a "hidden" variable that represents underlying vascular health
+    baseline_risk = _calculate_baseline_risk(
+        rng, age, sex, diabetes, hypertension, cad, pvd,
+        prior_interventions, history_cvc
+    )
 
-    #Age effect (normalized to 0-1 scale)
-        risk += (age - 25) / 65 * 0.2
+    # Drawn last, so every other column is the same as in cohorts generated without clinics
+    clinic = rng.choice(n_clinics, size=n_patients, p=_clinic_weights(n_clinics))
 
-    #Sex effect (female = higher risk)
-        risk += np.where(sex == 'F', 0.15, 0)
+    #Create Dataframe
+    return pd.DataFrame({
+        'patient_id': [f'PT_{i:0{id_width}d}' for i in range(first_patient, first_patient + n_patients)],
+        'age': age,
+        'sex': sex,
+        'diabetes': diabetes,
+        'hypertension': hypertension,
+        'cad': cad,
+        'pvd': pvd,
+        'prior_interventions': prior_interventions,
+        'history_cvc': history_cvc,
+        'baseline_risk_score': baseline_risk,
+        'clinic_id': [f'CL_{k:03d}' for k in clinic]
+    })
+
+
+def _calculate_baseline_risk(rng, age, sex, diabetes, hypertension, cad, pvd, prior_interventions, history_cvc):
+
+    risk = np.zeros(len(age))
+
+#Age effect (normalized to 0-1 scale)
+    risk += (age - 25) / 65 * 0.2
+
+#Sex effect (female = higher risk)
+    risk += np.where(sex == 'F', 0.15, 0)
+
+#Comorbidity effects
+    risk += diabetes * 0.15
+    risk += hypertension * 0.05
+    risk += cad * 0.10
+    risk += pvd * 0.15
+
+#Prior interventions (each one increases risk)
+    risk += prior_interventions * 0.05
+
+#History of CVC (major risk factor for central stenosis)
+    risk += history_cvc * 0.12
+
+#Add some random variation (biological variability)
+    risk += rng.normal(0, 0.1, size = len(age))
+
+#Clip to reasonable range
+    risk = np.clip(risk, 0, 1)
+
+    return risk
+
+
+@timed(rows=len)
+def _simulate_treatments(rng, patients_df, n_treatments=156, treatment_interval_days=2):
+
+    n_patients = len(patients_df)
+    shape = (n_patients, n_treatments)
+
+    # Every per-session variable is drawn as an (n_patients, n_treatments) array,
+    # so baseline_risk is a column vector broadcast across the treatment axis
+    baseline_risk = patients_df['baseline_risk_score'].to_numpy(dtype=float)[:, None]
+
+    #Calculate progression factor (how far along are we, 0 to 1)
+    progression = (np.arange(n_treatments) / n_treatments)[None, :]
+
+    #Generate Access Blood Flow (Qa)
+    #High_risk patients start lower and decline faster
+    qa_baseline = rng.normal(900, 150, size=shape) #healthy baseline
+    qa_baseline -= baseline_risk * 300 #High-risk patients start to lower
+
+    #Add progressive decline for high_risk patients
+    qa_decline = baseline_risk * progression * 400
+
+    #Add random session-to-session variation
+    qa = qa_baseline - qa_decline + rng.normal(0, 50, size=shape)
+    qa = np.clip(qa, 200, 1500) #Physiological limits
+
+    #Generate Arterial Pressure (More negative = harder to draw blood)
+    #Normal range: -150 to -200 mmHg
+    arterial_pressure = rng.normal(-175, 25, size=shape)
+    #High-risk and declining Qa makes it worse
+    arterial_pressure -= (baseline_risk * 50 + (800 - qa) / 20)
+    arterial_pressure = np.clip(arterial_pressure, -350, -100)
+
+    #Generate Venous Pressure (higher - outflow obstruction)
+    #normal range: 100-180 mmHg
+    venous_pressure = rng.normal(140, 20, size=shape)
+    #Increase with risk and progression
+    venous_pressure += baseline_risk * progression * 100
+    venous_pressure = np.clip(venous_pressure, 80, 400)
+
+    # Calculate Static Venous Pressure Ratio
+    # Assume MAP around 85-95 mmHg
+    map_value = rng.normal(90, 5, size=shape)
+    svpr = (venous_pressure * 0.75) / map_value  # 0.75 converts dynamic to static approximation
+    svpr = np.clip(svpr, 0.1, 1.2)
+
+    # Low-risk patients never exceed the 0.5 threshold
+    svpr = np.where(baseline_risk < 0.4, np.clip(svpr, 0.1, 0.5), svpr)
+
+    # Generate alarm counts
+    # High venous pressure alarms increase with risk and progression
+    high_vp_alarms = rng.poisson(baseline_risk * progression * 5, size=shape)
+    low_ap_alarms = rng.poisson(baseline_risk * progression * 3, size=shape)
+
+    # Access Recirculation (should be <10%, spikes when access failing)
+    ar_base = rng.uniform(0, 5, size=shape)  # Normal baseline
+    failing_access = (qa < 500) | (svpr > 0.5)
+    ar_base += np.where(failing_access, rng.uniform(5, 20, size=shape), 0)
+    access_recirculation = np.clip(ar_base, 0, 40)
+
+    # Kt/V (adequacy) - declines as access fails
+    ktv_baseline = rng.normal(1.4, 0.2, size=shape)
+    ktv_decline = (baseline_risk * progression * 0.4) + ((800 - qa) / 2000)
+    ktv = ktv_baseline - ktv_decline
+    ktv = np.clip(ktv, 0.6, 2.0)
+
+    #Treatment dates are the same for every patient (arbitrary start)
+    start_date = datetime(2024, 1, 1)
+    treatment_dates = pd.date_range(start_date, periods=n_treatments,
+                                    freq=pd.Timedelta(days=treatment_interval_days))
+
+    # Build the DataFrame once from flattened (row-major = patient-major) columns
+    return pd.DataFrame({
+        'patient_id': np.repeat(patients_df['patient_id'].to_numpy(), n_treatments),
+        'treatment_number': np.tile(np.arange(1, n_treatments + 1), n_patients),
+        'treatment_date': np.tile(treatment_dates.to_numpy(), n_patients),
+        'access_blood_flow_qa': np.round(qa, 1).ravel(),
+        'arterial_pressure_mean': np.round(arterial_pressure, 1).ravel(),
+        'venous_pressure_mean': np.round(venous_pressure, 1).ravel(),
+        'map': np.round(map_value, 1).ravel(),
+        'svpr': np.round(svpr, 3).ravel(),
+        'high_vp_alarms': high_vp_alarms.ravel(),
+        'low_ap_alarms': low_ap_alarms.ravel(),
+        'access_recirculation_pct': np.round(access_recirculation, 1).ravel(),
+        'ktv': np.round(ktv, 2).ravel()
+    })
+
+
+@timed(rows=len)
+def _simulate_outcomes(rng, patients_df, treatments_df):
+
+    # Sort once so every patient's treatments form one contiguous segment
+    # (patients keep their order of first appearance, as before)
+    patient_codes, patient_ids = pd.factorize(treatments_df['patient_id'])
+    order = np.lexsort((treatments_df['treatment_number'].to_numpy(), patient_codes))
+    treatments = treatments_df.iloc[order]
+    codes = patient_codes[order]
+    segment_starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+    treatment_number = treatments['treatment_number'].to_numpy()
+    qa = treatments['access_blood_flow_qa'].to_numpy(dtype=float)
+    svpr = treatments['svpr'].to_numpy(dtype=float)
+    recirculation = treatments['access_recirculation_pct'].to_numpy(dtype=float)
+    ktv = treatments['ktv'].to_numpy(dtype=float)
+    alarms = (treatments['high_vp_alarms'] + treatments['low_ap_alarms']).to_numpy()
+
+    # Patient baseline data, looked up by code instead of merged onto every row
+    patient_baseline_risk = (patients_df.set_index('patient_id')['baseline_risk_score']
+                             .reindex(patient_ids).to_numpy(dtype=float))
+    baseline_risk = patient_baseline_risk[codes]
+
+    # Risk factors that accumulate over time
+    qa_risk = np.where(qa < 600, (600 - qa) / 400, 0)  # Normalized 0-1
+    svpr_risk = np.where(svpr > 0.5, (svpr - 0.5) / 0.7, 0)  # Normalized 0-1
+    recirculation_risk = np.where(recirculation > 10, (recirculation - 10) / 30, 0)  # Normalized 0-1
+    ktv_risk = np.where(ktv < 1.2, (1.2 - ktv) / 0.6, 0)  # Normalized 0-1
+    alarm_risk = np.clip(alarms / 10, 0, 1)  # Normalize by expected max
+
+    # Calculate cumulative risk (weighted combination)
+    treatment_risk_score = (
+            baseline_risk * 0.25 +
+            qa_risk * 0.30 +
+            svpr_risk * 0.20 +
+            recirculation_risk * 0.10 +
+            ktv_risk * 0.10 +
+            alarm_risk * 0.05
+    )
+
+    # Add temporal acceleration (risk increases faster as time goes on)
+    last_treatment = np.maximum.reduceat(treatment_number, segment_starts)
+    progression_factor = treatment_number / last_treatment[codes]
+    treatment_risk_score *= (1 + progression_factor * 0.5)
+
+    # Clip to 0-1 range
+    treatment_risk_score = np.clip(treatment_risk_score, 0, 1)
+
+    # Calculate cumulative probability of failure by this treatment
+    # Uses logistic function to convert risk score to probability
+    failure_probability = 1 / (1 + np.exp(-3 * (treatment_risk_score - 0.85)))
+
+    # Determine if/when failure occurs
+    # Draw random numbers for every treatment; access fails at the first treatment
+    # after #20 where the adjusted probability wins the draw
+    adjusted_prob = failure_probability * rng.uniform(0.8, 1.2, size=len(treatments))
+    failure_draw = rng.random(size=len(treatments))
+    fails = ((treatment_number > 20) & (adjusted_prob > 0.5)
+             & (failure_draw < (adjusted_prob - 0.3)))
+
+    # First failing treatment per patient: failing rows are in segment order, so the
+    # first occurrence of each code among them is that patient's first failure
+    failing_rows = np.flatnonzero(fails)
+    failed_codes, first_failure = np.unique(codes[failing_rows], return_index=True)
+    failure_treatment = np.full(len(patient_ids), np.nan)
+    failure_treatment[failed_codes] = treatment_number[failing_rows[first_failure]]
+
+    # Per-patient aggregates in one grouped reduction
+    aggregates = pd.DataFrame({
+        'qa': qa,
+        'svpr': svpr,
+        'recirculation': recirculation,
+        'alarms': alarms
+    }).groupby(codes).agg(
+        mean_qa=('qa', 'mean'),
+        min_qa=('qa', 'min'),
+        final_qa=('qa', 'last'),
+        mean_svpr=('svpr', 'mean'),
+        max_svpr=('svpr', 'max'),
+        mean_recirculation=('recirculation', 'mean'),
+        total_alarms=('alarms', 'sum')
+    )
+
+    outcomes = pd.DataFrame({
+        'patient_id': np.asarray(patient_ids),
+        'failed': (~np.isnan(failure_treatment)).astype(int),
+        'failure_treatment_number': failure_treatment,
+        'baseline_risk_score': patient_baseline_risk
+    })
+    return pd.concat([outcomes, aggregates.reset_index(drop=True)], axis=1)
+
+
+def _simulate_chunk(task):
+    """Run all three stages for one patient chunk (process-pool entry point)."""
+    stage_seeds, first_patient, n_patients, id_width, n_clinics, n_treatments, treatment_interval_days = task
+    patients = _simulate_baselines(np.random.default_rng(stage_seeds[_BASELINE_STREAM]),
+                                   first_patient, n_patients, id_width, n_clinics)
+    treatments = _simulate_treatments(np.random.default_rng(stage_seeds[_TREATMENT_STREAM]),
+                                      patients, n_treatments, treatment_interval_days)
+    outcomes = _simulate_outcomes(np.random.default_rng(stage_seeds[_OUTCOME_STREAM]),
+                                  patients, treatments)
+    return patients, treatments, outcomes
 
-    #Comorbidity effects
-        risk += diabetes * 0.15
-        risk += hypertension * 0.05
-        risk += cad * 0.10
-        risk += pvd * 0.15
 
-    #Prior interventions (each one increases risk)
-        risk += prior_interventions * 0.05
+class AVFPatientGenerator:
 
-    #History of CVC (major risk factor for central stenosis)
-        risk += history_cvc * 0.12
+    def __init__(self, n_patients=1000, seed=DEFAULT_SEED, chunk_size=DEFAULT_CHUNK_SIZE,
+                 n_clinics=DEFAULT_N_CLINICS):
+        self.n_patients = n_patients
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.n_clinics = n_clinics
+        self.patients_df = None
+        self.treatments_df = None
+        self.outcomes_df = None
 
-    #Add some random variation (biological variability)
-        risk += np.random.normal(0, 0.1, size = len(age))
+        # Independent streams: one SeedSequence per patient chunk, split per stage
+        self._chunks = _chunk_bounds(n_patients, chunk_size)
+        self._stage_seeds = [chunk_seed.spawn(3) for chunk_seed
+                             in np.random.SeedSequence(seed).spawn(len(self._chunks))]
 
-    #Clip to reasonable range
-        risk = np.clip(risk, 0, 1)
+    def _rng(self, chunk_index, stage):
+        # A fresh Generator per call, so re-running a stage reproduces it exactly
+        return np.random.default_rng(self._stage_seeds[chunk_index][stage])
 
-        return risk
+    @timed(rows=len)
+    def generate_baseline_characteristics(self):
+        id_width = _patient_id_width(self.n_patients)
+        self.patients_df = pd.concat([
+            _simulate_baselines(self._rng(i, _BASELINE_STREAM), start, stop - start, id_width, self.n_clinics)
+            for i, (start, stop) in enumerate(self._chunks)
+        ], ignore_index=True)
+        return self.patients_df
 
+    @timed(rows=len)
     def generate_treatment_timeseries(self, n_treatments = 156, treatment_interval_days=2):
 
         if self.patients_df is None:
             raise ValueError("Must call generate_baseline_characteristics() first")
 
-        all_treatments = []
-
-        for idx, patient in self.patients_df.iterrows():
-            patient_id = patient['patient_id']
-            baseline_risk = patient['baseline_risk_score']
-
-            #Generate Treatment Data
-            start_date = datetime(2024, 1, 1) #Arbitrary Start
-            treatment_dates = [start_date + timedelta(days=i*treatment_interval_days)
-                               for i in range(n_treatments)]
-
-            #Generate time varying features
-            for treatment_num, treatment_date in enumerate(treatment_dates):
-
-                #Calculate progression factor (how far along are wem 0 to 1)
-                progression = treatment_num / n_treatments
-
-                #Generate Access Blood Flow (Qa)
-                #High_risk patients start lowe and decline faster
-                qa_baseline = np.random.normal(900, 150) #healthy baseline
-                qa_baseline -= baseline_risk * 300 #High-risk patients start to lower
-
-                #Add progressive decline for high_risk patients
-                qa_decline = baseline_risk * progression * 400
-
-                #Add random session-to-session variation
-                qa = qa_baseline - qa_decline + np.random.normal(0,50)
-                qa = np.clip(qa, 200, 1500) #Physiological limits
-
-                #Generate Arterial Pressure (More negative = harder to draw blood)
-                #Normal range: -150 to -200 mmHg
-                arterial_pressure = np.random.normal(-175, 25)
-                #High-risk and declining Qa makes it worse
-                arterial_pressure -= (baseline_risk * 50 + (800-qa) / 20)
-                arterial_pressure = np.clip(arterial_pressure, -350, -100)
-
-                #Generate Venous Pressure (higher - outflow obstruction)
-                #normal range: 100-180 mmHg
-                venous_pressure = np.random.normal(140, 20)
-                #Increase with risk and progression
-                venous_pressure += baseline_risk * progression * 100
-                venous_pressure = np.clip(venous_pressure, 80, 400)
-
-                # Calculate Static Venous Pressure Ratio
-                # Assume MAP around 85-95 mmHg
-                map_value = np.random.normal(90, 5)
-                svpr = (venous_pressure * 0.75) / map_value  # 0.75 converts dynamic to static approximation
-                svpr = np.clip(svpr, 0.1, 1.2)
-
-                if baseline_risk < 0.4:
-                    svpr = np.clip(svpr, 0.1, 0.5)
-
-                # Generate alarm counts
-                # High venous pressure alarms increase with risk and progression
-                high_vp_alarms = np.random.poisson(baseline_risk * progression * 5)
-                low_ap_alarms = np.random.poisson(baseline_risk * progression * 3)
-
-                # Access Recirculation (should be <10%, spikes when access failing)
-                ar_base = np.random.uniform(0, 5)  # Normal baseline
-
-                if qa < 500 or svpr > 0.5:  # Failing access
-                    ar_base += np.random.uniform(5, 20)
-                access_recirculation = np.clip(ar_base, 0, 40)
-
-                # Kt/V (adequacy) - declines as access fails
-                ktv_baseline = np.random.normal(1.4, 0.2)
-                ktv_decline = (baseline_risk * progression * 0.4) + ((800 - qa) / 2000)
-                ktv = ktv_baseline - ktv_decline
-                ktv = np.clip(ktv, 0.6, 2.0)
-
-                # Store treatment data
-                treatment_data = {
-                    'patient_id': patient_id,
-                    'treatment_number': treatment_num + 1,
-                    'treatment_date': treatment_date,
-                    'access_blood_flow_qa': round(qa, 1),
-                    'arterial_pressure_mean': round(arterial_pressure, 1),
-                    'venous_pressure_mean': round(venous_pressure, 1),
-                    'map': round(map_value, 1),
-                    'svpr': round(svpr, 3),
-                    'high_vp_alarms': high_vp_alarms,
-                    'low_ap_alarms': low_ap_alarms,
-                    'access_recirculation_pct': round(access_recirculation, 1),
-                    'ktv': round(ktv, 2)
-                }
-
-                all_treatments.append(treatment_data)
-
-        self.treatments_df = pd.DataFrame(all_treatments)
+        self.treatments_df = pd.concat([
+            _simulate_treatments(self._rng(i, _TREATMENT_STREAM), self.patients_df.iloc[start:stop],
+                                 n_treatments, treatment_interval_days)
+            for i, (start, stop) in enumerate(self._chunks)
+        ], ignore_index=True)
         return self.treatments_df
 
+    @timed(rows=len)
     def generate_failure_outcomes(self, failure_rate=0.30):
         if self.treatments_df is None:
             raise ValueError("Must call generate_treatment_timeseries() first")
 
-            # Merge patient baseline data with treatment data
-        full_data = self.treatments_df.merge(
-            self.patients_df,
-            on='patient_id',
-            how='left'
-        )
-
-        failure_outcomes = []
-
-        for patient_id in full_data['patient_id'].unique():
-            # Get all treatments for this patient
-            patient_treatments = full_data[full_data['patient_id'] == patient_id].sort_values('treatment_number')
-
-            # Calculate dynamic risk score for each treatment
-            patient_treatments = patient_treatments.copy()
-
-            # Risk factors that accumulate over time
-            patient_treatments['qa_risk'] = np.where(
-                patient_treatments['access_blood_flow_qa'] < 600,
-                (600 - patient_treatments['access_blood_flow_qa']) / 400,  # Normalized 0-1
-                0
-            )
-
-            patient_treatments['svpr_risk'] = np.where(
-                patient_treatments['svpr'] > 0.5,
-                (patient_treatments['svpr'] - 0.5) / 0.7,  # Normalized 0-1
-                0
-            )
-
-            patient_treatments['recirculation_risk'] = np.where(
-                patient_treatments['access_recirculation_pct'] > 10,
-                (patient_treatments['access_recirculation_pct'] - 10) / 30,  # Normalized 0-1
-                0
-            )
-
-            patient_treatments['ktv_risk'] = np.where(
-                patient_treatments['ktv'] < 1.2,
-                (1.2 - patient_treatments['ktv']) / 0.6,  # Normalized 0-1
-                0
-            )
-
-            patient_treatments['alarm_risk'] = (
-                                                       patient_treatments['high_vp_alarms'] + patient_treatments[
-                                                   'low_ap_alarms']
-                                               ) / 10  # Normalize by expected max
-            patient_treatments['alarm_risk'] = patient_treatments['alarm_risk'].clip(0, 1)
-
-            # Calculate cumulative risk (weighted combination)
-            patient_treatments['treatment_risk_score'] = (
-                    patient_treatments['baseline_risk_score'] * 0.25 +
-                    patient_treatments['qa_risk'] * 0.30 +
-                    patient_treatments['svpr_risk'] * 0.20 +
-                    patient_treatments['recirculation_risk'] * 0.10 +
-                    patient_treatments['ktv_risk'] * 0.10 +
-                    patient_treatments['alarm_risk'] * 0.05
-            )
-
-            # Add temporal acceleration (risk increases faster as time goes on)
-            progression_factor = patient_treatments['treatment_number'] / patient_treatments['treatment_number'].max()
-            patient_treatments['treatment_risk_score'] *= (1 + progression_factor * 0.5)
-
-            # Clip to 0-1 range
-            patient_treatments['treatment_risk_score'] = patient_treatments['treatment_risk_score'].clip(0, 1)
-
-            # Calculate cumulative probability of failure by this treatment
-            # Uses logistic function to convert risk score to probability
-            patient_treatments['failure_probability'] = 1 / (
-                        1 + np.exp(-3 * (patient_treatments['treatment_risk_score'] - 0.85)))
-
-            # Determine if/when failure occurs
-            # Draw random number for each treatment; if it exceeds failure probability, access fails
-            failure_occurred = False
-            failure_treatment = None
-
-            for idx, row in patient_treatments.iterrows():
-                if not failure_occurred and row['treatment_number'] > 20:
-                    adjusted_prob = row['failure_probability'] * np.random.uniform(0.8,1.2)
-                    # Random draw against failure probability
-                    if adjusted_prob > 0.5  and np.random.random() < (adjusted_prob - 0.3):
-                        failure_occurred = True
-                        failure_treatment = row['treatment_number']
-                        break
-
-            # Get patient baseline data
-            patient_baseline = self.patients_df[self.patients_df['patient_id'] == patient_id].iloc[0]
-
-            # Store outcome
-            outcome = {
-                'patient_id': patient_id,
-                'failed': 1 if failure_occurred else 0,
-                'failure_treatment_number': failure_treatment if failure_occurred else None,
-                'baseline_risk_score': patient_baseline['baseline_risk_score'],
-                'mean_qa': patient_treatments['access_blood_flow_qa'].mean(),
-                'min_qa': patient_treatments['access_blood_flow_qa'].min(),
-                'final_qa': patient_treatments['access_blood_flow_qa'].iloc[-1],
-                'mean_svpr': patient_treatments['svpr'].mean(),
-                'max_svpr': patient_treatments['svpr'].max(),
-                'mean_recirculation': patient_treatments['access_recirculation_pct'].mean(),
-                'total_alarms': (patient_treatments['high_vp_alarms'] + patient_treatments['low_ap_alarms']).sum()
-            }
-
-            failure_outcomes.append(outcome)
-
-        self.outcomes_df = pd.DataFrame(failure_outcomes)
+        # Assign every treatment to its patient's chunk, then simulate chunk by chunk
+        patient_position = pd.Index(self.patients_df['patient_id']).get_indexer(self.treatments_df['patient_id'])
+        treatment_chunk = patient_position // self.chunk_size
+        order = np.argsort(treatment_chunk, kind='stable')
+        chunk_ends = np.searchsorted(treatment_chunk[order], np.arange(1, len(self._chunks) + 1))
+        chunk_starts = np.r_[0, chunk_ends[:-1]]
+
+        self.outcomes_df = pd.concat([
+            _simulate_outcomes(self._rng(i, _OUTCOME_STREAM), self.patients_df.iloc[start:stop],
+                               self.treatments_df.iloc[order[chunk_starts[i]:chunk_ends[i]]])
+            for i, (start, stop) in enumerate(self._chunks)
+        ], ignore_index=True)
 
+        self._report_failure_rate(failure_rate)
+        return self.outcomes_df
+
+    def iter_cohort_chunks(self, n_treatments=156, treatment_interval_days=2, n_workers=None):
+        """Yield (patients, treatments, outcomes) DataFrames one patient chunk at a time.
+
+        Chunks come back in order. With several workers at most two chunks per
+        worker are in flight, so memory stays bounded by chunk_size rather than
+        by the cohort size.
+        """
+        id_width = _patient_id_width(self.n_patients)
+        tasks = [(self._stage_seeds[i], start, stop - start, id_width, self.n_clinics, n_treatments,
+                  treatment_interval_days) for i, (start, stop) in enumerate(self._chunks)]
+
+        if n_workers == 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield _simulate_chunk(task)
+            return
+
+        max_in_flight = 2 * (n_workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.submit(_simulate_chunk, task))
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    @timed(rows=lambda cohort: len(cohort[1]))
+    def generate_cohort(self, n_treatments=156, treatment_interval_days=2, failure_rate=0.30, n_workers=None):
+        """Generate baselines, treatments and outcomes for every chunk in a process pool.
+
+        Each chunk draws only from its own seeded streams, so the result is
+        bit-identical to the stage-by-stage methods and independent of n_workers.
+        """
+        patients, treatments, outcomes = zip(*self.iter_cohort_chunks(
+            n_treatments, treatment_interval_days, n_workers))
+        self.patients_df = pd.concat(patients, ignore_index=True)
+        self.treatments_df = pd.concat(treatments, ignore_index=True)
+        self.outcomes_df = pd.concat(outcomes, ignore_index=True)
+
+        self._report_failure_rate(failure_rate)
+        return self.patients_df, self.treatments_df, self.outcomes_df
+
+    @timed(rows=lambda totals: totals['treatments'])
+    def write_cohort(self, output_dir=RAW_DATA_DIR, n_treatments=156, treatment_interval_days=2,
+                     n_workers=None, fmt='csv', partitioned=False):
+        """Stream the cohort to disk chunk by chunk without holding it in memory.
+
+        By default rows are appended to the usual patients_baseline.csv,
+        treatments_baseline.csv and outcomes_baseline.csv; fmt='parquet' or
+        'feather' writes compressed columnar tables with compact dtypes instead.
+        With partitioned=True each chunk is written as <table>/part-NNNNN.<fmt>.
+        Returns running totals for the summary printout.
+        """
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        totals = {'patients': 0, 'treatments': 0, 'failed': 0, 'failure_treatment_sum': 0.0}
+        with CohortWriter(output_dir, fmt=fmt, partitioned=partitioned) as writer:
+            for patients, treatments, outcomes in self.iter_cohort_chunks(
+                    n_treatments, treatment_interval_days, n_workers):
+                writer.write(patients, treatments, outcomes)
+                totals['patients'] += len(patients)
+                totals['treatments'] += len(treatments)
+                totals['failed'] += int(outcomes['failed'].sum())
+                totals['failure_treatment_sum'] += float(outcomes['failure_treatment_number'].sum())
+                print(f"  wrote chunk {writer.chunks_written:>5}: {totals['patients']:,} / {self.n_patients:,} patients")
+        return totals
+
+    def _report_failure_rate(self, failure_rate):
         # Adjust failure rate if needed (probabilistic, so might not match exactly)
         actual_failure_rate = self.outcomes_df['failed'].mean()
         print(f"\nTarget failure rate: {failure_rate:.1%}")
         print(f"Actual failure rate: {actual_failure_rate:.1%}")
 
-        return self.outcomes_df
-
-#Test the generator
-# Test the generator
 if __name__ == '__main__':
-    # Generate Patients
-    generator = AVFPatientGenerator(n_patients=1000)  # Use 100 for faster testing
-    patients = generator.generate_baseline_characteristics()
+    parser = argparse.ArgumentParser(description='Generate a synthetic AVF cohort and stream it to data/raw.')
+    parser.add_argument('--n-patients', type=int, default=1000)
+    parser.add_argument('--n-treatments', type=int, default=156)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='patients per chunk (fixes the RNG streams, so keep it constant for reproducibility)')
+    parser.add_argument('--n-clinics', type=int, default=DEFAULT_N_CLINICS,
+                        help='facilities the patients are assigned to (clinic_id)')
+    parser.add_argument('--workers', type=int, default=None, help='process-pool size (default: all cores)')
+    parser.add_argument('--output-dir', default=str(RAW_DATA_DIR))
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='csv (original), or compressed columnar parquet/feather with compact dtypes')
+    parser.add_argument('--partitioned', action='store_true',
+                        help='write one part file per chunk instead of appending to a single file per table')
+    args = parser.parse_args()
+
+    generator = AVFPatientGenerator(n_patients=args.n_patients, seed=args.seed, chunk_size=args.chunk_size,
+                                    n_clinics=args.n_clinics)
 
-    # Inspect baseline
-    print("=" * 60)
-    print("BASELINE PATIENT CHARACTERISTICS")
-    print("=" * 60)
-    print(f"\nTotal patients generated: {len(patients)}")
-    print(f"\nBaseline risk score distribution:")
-    print(patients['baseline_risk_score'].describe())
-
-    # Generate treatment timeseries
-    print("\n" + "=" * 60)
-    print("GENERATING TREATMENT TIMESERIES...")
     print("=" * 60)
-
-    treatments = generator.generate_treatment_timeseries(n_treatments=156)
-    print(f"\nTotal treatment records: {len(treatments)}")
-
-    # Generate failure outcomes
-    print("\n" + "=" * 60)
-    print("GENERATING FAILURE OUTCOMES...")
+    print("GENERATING COHORT...")
     print("=" * 60)
+    print(f"\nPatients: {args.n_patients:,} x {args.n_treatments} treatments at {args.n_clinics} clinics "
+          f"in {len(generator._chunks)} chunk(s) of up to {args.chunk_size:,}")
 
-    outcomes = generator.generate_failure_outcomes(failure_rate=0.30)
-
-    print(f"\nTotal patients: {len(outcomes)}")
-    print(f"\nPatients who failed: {outcomes['failed'].sum()}")
-    print(f"Failure rate: {outcomes['failed'].mean():.1%}")
-
-    print(f"\nFailure timing distribution:")
-    print(outcomes[outcomes['failed'] == 1]['failure_treatment_number'].describe())
+    totals = generator.write_cohort(args.output_dir, n_treatments=args.n_treatments,
+                                    n_workers=args.workers, fmt=args.format,
+                                    partitioned=args.partitioned)
 
-    print(f"\nFirst 10 outcomes:")
-    print(outcomes.head(10))
-
-    print(f"\nComparison of failed vs non-failed patients:")
-    print(outcomes.groupby('failed')[['baseline_risk_score', 'mean_qa', 'mean_svpr', 'mean_recirculation']].mean())
-
-    #SAVE the Data
     print("\n" + "=" * 60)
-    print("Saving Data to files")
+    print("COHORT SUMMARY")
     print("=" * 60)
-
-    #Save to CSV file
-    patients.to_csv('../data/raw/patients_baseline.csv', index=False)
-    treatments.to_csv('../data/raw/treatments_baseline.csv', index=False)
-    outcomes.to_csv('../data/raw/outcomes_baseline.csv', index=False)
-
-
-    print("✓ Saved patients_baseline.csv")
-    print("✓ Saved treatments_timeseries.csv")
-    print("✓ Saved failure_outcomes.csv")
-    print(f"\nTotal file size: ~{(len(patients) + len(treatments) + len(outcomes)) / 1000:.1f}K rows")
\ No newline at end of file
+    print(f"\nTotal patients: {totals['patients']:,}")
+    print(f"Total treatment records: {totals['treatments']:,}")
+    print(f"\nPatients who failed: {totals['failed']:,}")
+    print(f"Failure rate: {totals['failed'] / totals['patients']:.1%}")
+    if totals['failed']:
+        print(f"Mean failure treatment: {totals['failure_treatment_sum'] / totals['failed']:.1f}")
+
+    print(f"\n✓ Saved {', '.join(TABLE_FILES.values())} ({args.format}) to {args.output_dir}")
+    print(f"\nTotal file size: ~{(2 * totals['patients'] + totals['treatments']) / 1000:.1f}K rows")
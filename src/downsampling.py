@@ -0,0 +1,97 @@
+"""Downsampling of long per-patient trend series for the Patient Detail charts.
+
+The Qa and SVPR charts used to ship every treatment to the browser as a
+lines+markers trace, so payload and render time grew with the length of the
+history: fine at 156 sessions, slow for patients with years of thrice-weekly
+treatments. trend_points() picks at most about max_points of them:
+
+* Largest-Triangle-Three-Buckets (LTTB) keeps the visual shape: one point per
+  bucket, the one forming the largest triangle with its neighbours, so peaks,
+  dips and turns survive;
+* the points on both sides of a crossing of a clinical threshold (Qa 600
+  mL/min, SVPR 0.5) are kept, so the line crosses the threshold line between
+  the same two treatments as the full series. A series that hovers around a
+  threshold can cross it hundreds of times; then the first and last crossing
+  in each of max_points / 8 equal stretches of the chart are kept, which is
+  every crossing in the usual case and still shows the line crossing in every
+  stretch where the real series does (no stretches below 8 points);
+* the first and last treatment are always kept.
+
+Histories no longer than max_points are returned whole, and a zoom window is
+downsampled on its own, so zooming in shows the real sessions.
+"""
+import numpy as np
+
+# Treatments drawn per chart before downsampling starts (a 156-session history is drawn whole)
+DEFAULT_MAX_POINTS = 300
+
+# Clinical threshold lines of the trend charts, whose crossings are always drawn
+TREND_THRESHOLDS = {'access_blood_flow_qa': 600, 'svpr': 0.5}
+
+
+def lttb(x, y, n_out):
+    """Indices of n_out points of (x, y) chosen by Largest-Triangle-Three-Buckets, in order.
+
+    Fewer than 3 points leave no bucket to choose from: the first and last point, or only the first.
+    """
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1][:max(n_out, 0)], dtype=np.intp)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # First and last points are fixed; the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    selected = np.empty(n_out, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        following = slice(end, edges[bucket + 2]) if bucket + 2 < len(edges) else slice(n - 1, n)
+        next_x, next_y = x[following].mean(), y[following].mean()
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def threshold_crossings(y, threshold):
+    """Indices i such that the series crosses `threshold` between points i and i + 1."""
+    above = np.asarray(y) > threshold
+    return np.flatnonzero(above[1:] != above[:-1])
+
+
+def _first_and_last(x, crossings, n_stretches):
+    """The first and last of `crossings` within each of n_stretches equal stretches of x."""
+    stretch = ((x[crossings] - x[0]) * n_stretches // max(x[-1] - x[0], 1)).astype(np.intp)
+    _, first = np.unique(stretch, return_index=True)
+    _, last = np.unique(stretch[::-1], return_index=True)
+    return crossings[np.union1d(first, len(crossings) - 1 - last)]
+
+
+def trend_points(x, y, max_points=DEFAULT_MAX_POINTS, thresholds=(), window=None):
+    """Indices into x/y of the points to draw, in order.
+
+    x must be increasing (treatment numbers). window=(first, last) restricts
+    the result to first <= x <= last. The result never has more than
+    max_points points; at least half of them are chosen by LTTB.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    start, stop = 0, len(x)
+    if window is not None:
+        start, stop = np.searchsorted(x, window[0], side='left'), np.searchsorted(x, window[1], side='right')
+    if stop - start <= max_points:
+        return np.arange(start, stop)
+
+    x, y = x[start:stop], y[start:stop]
+    crossings = np.unique(np.concatenate([threshold_crossings(y, threshold) for threshold in thresholds]
+                                         + [np.empty(0, dtype=np.intp)]))
+    # At most 4 points per stretch, so LTTB always keeps at least half of max_points
+    n_stretches = max_points // 8
+    crossings = _first_and_last(x, crossings, n_stretches) if n_stretches else crossings[:0]
+    crossing_points = np.union1d(crossings, crossings + 1)
+    return start + np.union1d(lttb(x, y, max_points - len(crossing_points)), crossing_points)
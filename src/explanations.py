@@ -0,0 +1,79 @@
+"""What drives each risk score, read off the forest's own decision paths.
+
+The High Risk table used to label patients with a fixed-threshold heuristic
+(Qa < 600, SVPR > 0.8, ...) evaluated row by row, which could disagree with
+what the model actually used. explain() instead decomposes every prediction
+into per-feature contributions (CompiledForest.contributions(), the Saabas
+decision-path decomposition): the risk score equals the cohort base rate plus
+the sum of the contributions, so the largest positive ones are the patient's
+real top drivers. All rows are explained in one vectorized walk of the trees.
+
+The dashboard computes contributions once for every patient's latest
+treatment and caches them with the risk scores (src/risk_table.py); only
+sessions that arrived live are explained on the fly.
+"""
+import numpy as np
+import pandas as pd
+
+from src.compiled_forest import CompiledForest
+from src.features import MODEL_FEATURES
+from src.instrumentation import timed
+
+# Names shown on the dashboard
+FEATURE_LABELS = {
+    'age': 'Age',
+    'diabetes': 'Diabetes',
+    'hypertension': 'Hypertension',
+    'cad': 'Coronary artery disease',
+    'pvd': 'Peripheral vascular disease',
+    'prior_interventions': 'Prior interventions',
+    'history_cvc': 'History of CVC',
+    'baseline_risk_score': 'Baseline vascular risk',
+    'access_blood_flow_qa': 'Qa',
+    'venous_pressure_mean': 'Venous pressure',
+    'svpr': 'SVPR',
+    'access_recirculation_pct': 'Recirculation',
+    'ktv': 'Kt/V',
+    'high_vp_alarms': 'High VP alarms',
+    'low_ap_alarms': 'Low AP alarms',
+    'qa_rolling_mean_4': 'Qa, 4-session mean',
+    'qa_rolling_mean_12': 'Qa, 12-session mean',
+    'svpr_rolling_mean_4': 'SVPR, 4-session mean',
+    'svpr_rolling_mean_12': 'SVPR, 12-session mean',
+    'recirculation_rolling_mean_4': 'Recirculation, 4-session mean',
+    'recirculation_rolling_mean_12': 'Recirculation, 12-session mean',
+    'qa_rolling_std_4': 'Qa variability, 4 sessions',
+    'qa_rolling_std_12': 'Qa variability, 12 sessions',
+    'qa_trend_12': 'Qa trend, 12 sessions',
+    'qa_pct_change_from_baseline': 'Qa change from baseline',
+    'sex_encoded': 'Sex',
+}
+
+
+def as_compiled(model):
+    """The model as a CompiledForest, compiling a fitted sklearn forest if needed."""
+    return model if isinstance(model, CompiledForest) else CompiledForest.from_sklearn(model)
+
+
+@timed(rows=len)
+def explain(model, X):
+    """Contribution of every feature to every row's risk score, in percentage points.
+
+    Returns a float32 frame with one column per MODEL_FEATURES, indexed like
+    X. The row sums plus the model's base rate give the risk scores.
+    """
+    _, contributions = as_compiled(model).contributions(X[MODEL_FEATURES])
+    return pd.DataFrame((contributions * 100).astype(np.float32), index=X.index, columns=MODEL_FEATURES)
+
+
+def top_drivers(contributions, n=1):
+    """'Label (+points)' of each row's n largest risk-increasing contributions, joined by ', '."""
+    values = contributions.to_numpy()
+    order = np.argsort(-values, axis=1, kind='stable')[:, :n]
+    top = np.take_along_axis(values, order, axis=1)
+    labels = np.asarray([FEATURE_LABELS[column] for column in contributions.columns], dtype=object)[order]
+    parts = labels + ' (+' + np.char.mod('%.1f', top).astype(object) + ')'
+    described = np.where(top[:, 0] > 0, parts[:, 0], 'No risk-increasing factor')
+    for k in range(1, order.shape[1]):
+        described = np.where(top[:, k] > 0, described + ', ' + parts[:, k], described)
+    return pd.Series(described, index=contributions.index)
@@ -0,0 +1,151 @@
+"""On-disk cache of the engineered feature table.
+
+Feature engineering is the slowest step of starting the dashboard. Its
+treatment-level result (build_treatment_features()) is cached under
+data/cache/ as an uncompressed Arrow IPC (Feather v2) file keyed by a
+fingerprint of the raw table files (size, mtime and content hash) plus the
+feature pipeline version and the source of src/features.py and src/storage.py
+(whose TABLE_DTYPES the raw tables are loaded with), so the cache only goes
+stale when the inputs, the feature code or the table dtypes change. The patient-level
+features are not cached: they are one row per patient and cheap to rebuild.
+
+Uncompressed IPC files can be memory-mapped: a cache hit maps the file instead
+of parsing it, and every dashboard process reading the same file shares its
+pages through the OS page cache. Cache files are written atomically, so
+concurrent processes never see a partial file.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+import pyarrow as pa
+
+from src import features, storage
+from src.features import (FEATURE_PIPELINE_VERSION, build_patient_features, build_treatment_features,
+                          known_patients)
+from src.instrumentation import timed
+from src.storage import (RAW_DATA_DIR, TABLE_FILES, find_table, load_raw_tables, read_table,
+                         unify_patient_ids)
+from src.utils import CACHE_DIR, atomic_write, file_digest
+
+_CACHE_PREFIX = 'full_data-'
+
+# Content hashes of files, reused while a file's size and mtime are unchanged
+_DIGESTS_FILE = 'file_digests.json'
+
+
+def _raw_files(data_dir):
+    files = []
+    for table in TABLE_FILES:
+        path, fmt = find_table(table, data_dir)
+        files.extend(sorted(path.glob(f'part-*.{fmt}')) if path.is_dir() else [path])
+    return files
+
+
+def file_fingerprints(paths, cache_dir=CACHE_DIR):
+    """Size, mtime and content hash of each file.
+
+    Content hashes are remembered in the cache directory and only recomputed
+    when a file's size or mtime changes, so this is cheap enough to call on
+    every dashboard rerun.
+    """
+    digests_path = Path(cache_dir) / _DIGESTS_FILE
+    try:
+        known = json.loads(digests_path.read_text())
+    except (FileNotFoundError, ValueError):
+        known = {}
+
+    fingerprint = []
+    for path in paths:
+        stat = Path(path).stat()
+        entry = {'path': str(Path(path).resolve()), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        cached = known.get(entry['path'])
+        if cached and cached['size'] == entry['size'] and cached['mtime_ns'] == entry['mtime_ns']:
+            entry['digest'] = cached['digest']
+        else:
+            entry['digest'] = file_digest(path)
+        fingerprint.append(entry)
+
+    updated = {entry['path']: entry for entry in fingerprint}
+    if any(known.get(path) != entry for path, entry in updated.items()):
+        with atomic_write(digests_path) as tmp:
+            tmp.write_text(json.dumps({**known, **updated}, indent=1))
+    return fingerprint
+
+
+def raw_fingerprint(data_dir=RAW_DATA_DIR, cache_dir=CACHE_DIR):
+    """Size, mtime and content hash of every raw table file the loaders would read."""
+    return file_fingerprints(_raw_files(data_dir), cache_dir)
+
+
+def cache_key(fingerprint, columns=None):
+    """Hash of the raw-file fingerprint, the feature pipeline, the table dtypes and the column projection."""
+    payload = {
+        # Paths and mtimes only decide whether to rehash; the key depends on content
+        'raw': [(Path(entry['path']).name, entry['size'], entry['digest']) for entry in fingerprint],
+        'version': FEATURE_PIPELINE_VERSION,
+        'pipeline': file_digest(features.__file__),
+        # storage.TABLE_DTYPES decides the dtypes the raw tables are loaded with
+        'storage': file_digest(storage.__file__),
+        'columns': {table: list(cols) for table, cols in sorted((columns or {}).items())},
+    }
+    return hashlib.blake2b(json.dumps(payload).encode(), digest_size=16).hexdigest()
+
+
+def feature_cache_key(columns=None, data_dir=RAW_DATA_DIR, cache_dir=CACHE_DIR):
+    """Cache key of the feature tables load_feature_tables() would return for these inputs."""
+    return cache_key(raw_fingerprint(data_dir, cache_dir), columns)
+
+
+@timed()
+def write_cached_frame(frame, path):
+    """Atomically write a frame as an uncompressed (memory-mappable) Arrow IPC file."""
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    with atomic_write(path) as tmp:
+        with pa.OSFile(str(tmp), 'wb') as sink, \
+                pa.ipc.new_file(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression=None)) as writer:
+            writer.write_table(table)
+
+
+@timed(rows=len)
+def read_cached_frame(path):
+    """Memory-map a cached frame: numeric columns stay backed by the (shared) page cache."""
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+
+
+def prune_cache(cache_dir, prefix, keep):
+    """Remove every cached `prefix`*.arrow file except `keep`."""
+    # Unlinking is safe while other processes still have an old file mapped
+    for path in Path(cache_dir).glob(f'{prefix}*.arrow'):
+        if path != keep:
+            path.unlink(missing_ok=True)
+
+
+@timed(rows=lambda loaded: len(loaded[2]))
+def load_feature_tables(columns=None, data_dir=RAW_DATA_DIR, cache_dir=CACHE_DIR):
+    """Return (patients, outcomes, treatment_features, patient_features).
+
+    treatment_features (build_treatment_features()) is only built on a cache
+    miss; patient_features (build_patient_features()) is rebuilt from the small
+    patients and outcomes tables. join_patient_features() of the two is
+    build_full_data(). `columns` is the same table -> columns projection
+    load_raw_tables() takes and is part of the cache key. The treatments table
+    is only read on a miss.
+    """
+    columns = columns or {}
+    cache_path = Path(cache_dir) / f'{_CACHE_PREFIX}{feature_cache_key(columns, data_dir, cache_dir)}.arrow'
+
+    if cache_path.exists():
+        patients = read_table('patients', columns.get('patients'), data_dir)
+        outcomes = read_table('outcomes', columns.get('outcomes'), data_dir)
+        treatment_features = read_cached_frame(cache_path)
+        unify_patient_ids(treatment_features, patients, outcomes)
+        return patients, outcomes, treatment_features, build_patient_features(patients, outcomes)
+
+    patients, treatments, outcomes = load_raw_tables(columns, data_dir)
+    patient_features = build_patient_features(patients, outcomes)
+    treatment_features = build_treatment_features(known_patients(treatments, patient_features))
+    write_cached_frame(treatment_features, cache_path)
+    prune_cache(cache_dir, _CACHE_PREFIX, keep=cache_path)
+    return patients, outcomes, treatment_features, patient_features
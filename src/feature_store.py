@@ -0,0 +1,294 @@
+"""Incremental per-patient feature state for scoring sessions as they arrive.
+
+build_full_data() recomputes every window over each patient's whole history.
+IncrementalFeatureStore keeps just enough state per patient to update all
+MODEL_FEATURES in O(1) when one new dialysis session is appended: ring
+buffers for the 4- and 12-treatment windows, running sums for the trend
+slopes and the frozen Qa baseline from the first four treatments.
+
+For any prefix of a patient's history the values match what
+build_full_data() would produce on that prefix, to float32 precision (the
+dtype build_full_data() stores features in). check_parity() verifies this on
+a cohort; benchmarks/suite.py runs it on every cohort size, so a mismatch fails
+the gated benchmark run.
+"""
+import math
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from src.features import (BASELINE_TREATMENTS, FEATURE_DTYPE, MODEL_FEATURES, ROLLING_MEAN_COLUMNS, ROLLING_WINDOWS,
+                          TREND_COLUMNS, TREND_WINDOW, build_full_data, segment_positions)
+
+# Patient-level columns copied onto every feature row
+PATIENT_COLUMNS = [
+    'age', 'diabetes', 'hypertension', 'cad', 'pvd',
+    'prior_interventions', 'history_cvc', 'baseline_risk_score',
+]
+
+# Raw session columns the store needs
+SESSION_COLUMNS = [
+    'patient_id', 'treatment_number', 'access_blood_flow_qa', 'venous_pressure_mean', 'svpr',
+    'access_recirculation_pct', 'ktv', 'high_vp_alarms', 'low_ap_alarms',
+]
+
+# Columns compared by check_parity(): every model feature plus the other engineered columns of a feature row
+PARITY_COLUMNS = list(dict.fromkeys(MODEL_FEATURES + ['total_alarms', 'qa_baseline', 'qa_change_from_baseline']
+                                    + [f'{prefix}_trend_{TREND_WINDOW}' for prefix in TREND_COLUMNS]))
+
+# build_full_data() rounds features to FEATURE_DTYPE: a few of its ulps, plus an absolute floor for values near 0
+PARITY_RTOL = 4 * np.finfo(FEATURE_DTYPE).eps
+PARITY_ATOL = 1e-6
+
+_BUFFER_SIZE = max(max(ROLLING_WINDOWS), TREND_WINDOW)
+
+
+class _RunningSlope:
+    """Least-squares slope over the last `window` values via running sums of y and x*y."""
+
+    __slots__ = ('window', 'values', 'sum_y', 'sum_xy', 'nan_count')
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.sum_y = 0.0
+        self.sum_xy = 0.0
+        self.nan_count = 0
+
+    def append(self, y):
+        if len(self.values) == self.window:
+            # Drop the oldest value (x = 0); every remaining x shifts down by one
+            oldest = self.values.popleft()
+            if math.isnan(oldest):
+                self.nan_count -= 1
+            else:
+                self.sum_y -= oldest
+            self.sum_xy -= self.sum_y
+
+        if math.isnan(y):
+            self.nan_count += 1
+        else:
+            self.sum_xy += len(self.values) * y
+            self.sum_y += y
+        self.values.append(y)
+
+    def copy(self):
+        copied = _RunningSlope(self.window)
+        copied.values = deque(self.values)
+        copied.sum_y, copied.sum_xy, copied.nan_count = self.sum_y, self.sum_xy, self.nan_count
+        return copied
+
+    def slope(self):
+        m = len(self.values)
+        if m < 2 or self.nan_count:
+            return 0.0
+        sum_x = m * (m - 1) / 2
+        sum_xx = (m - 1) * m * (2 * m - 1) / 6
+        return (m * self.sum_xy - sum_x * self.sum_y) / (m * sum_xx - sum_x * sum_x)
+
+
+def _window_mean_std(buffer, window):
+    """Mean and sample std (0 below two values) of the last `window` non-NaN values."""
+    values = [v for v in list(buffer)[-window:] if not math.isnan(v)]
+    if not values:
+        return math.nan, 0.0
+    mean = sum(values) / len(values)
+    if len(values) < 2:
+        return mean, 0.0
+    return mean, math.sqrt(sum((v - mean) ** 2 for v in values) / (len(values) - 1))
+
+
+class PatientFeatureState:
+    """Compact rolling state for one patient."""
+
+    __slots__ = ('attributes', 'buffers', 'slopes', 'n_sessions', 'last_treatment',
+                 'baseline_sum', 'baseline_count', 'latest')
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+        self.buffers = {column: deque(maxlen=_BUFFER_SIZE) for column in ROLLING_MEAN_COLUMNS.values()}
+        self.slopes = {column: _RunningSlope(TREND_WINDOW) for column in TREND_COLUMNS.values()}
+        self.n_sessions = 0
+        self.last_treatment = None
+        self.baseline_sum = 0.0
+        self.baseline_count = 0
+        self.latest = None
+
+    def append(self, session):
+        treatment_number = session['treatment_number']
+        if self.last_treatment is not None and treatment_number <= self.last_treatment:
+            raise ValueError(f"Session {treatment_number} for {session['patient_id']} is not after "
+                             f"treatment {self.last_treatment}")
+
+        for column, buffer in self.buffers.items():
+            buffer.append(float(session[column]))
+        for column, slope in self.slopes.items():
+            slope.append(float(session[column]))
+
+        # Qa baseline is frozen once the first BASELINE_TREATMENTS sessions are in
+        qa = float(session['access_blood_flow_qa'])
+        if self.n_sessions < BASELINE_TREATMENTS and not math.isnan(qa):
+            self.baseline_sum += qa
+            self.baseline_count += 1
+        self.n_sessions += 1
+        self.last_treatment = treatment_number
+
+        self.latest = self._feature_row(session)
+        return self.latest
+
+    def copy(self):
+        """Independent copy of the state (attributes and the latest row are shared: neither is mutated)."""
+        copied = PatientFeatureState.__new__(PatientFeatureState)
+        copied.attributes = self.attributes
+        copied.buffers = {column: deque(buffer, maxlen=buffer.maxlen) for column, buffer in self.buffers.items()}
+        copied.slopes = {column: slope.copy() for column, slope in self.slopes.items()}
+        copied.n_sessions, copied.last_treatment, copied.latest = self.n_sessions, self.last_treatment, self.latest
+        copied.baseline_sum, copied.baseline_count = self.baseline_sum, self.baseline_count
+        return copied
+
+    def _feature_row(self, session):
+        row = {'patient_id': session['patient_id'], 'treatment_number': session['treatment_number']}
+        row.update(self.attributes)
+        for column in SESSION_COLUMNS[2:]:
+            row[column] = session[column]
+        row['total_alarms'] = session['high_vp_alarms'] + session['low_ap_alarms']
+
+        for window in ROLLING_WINDOWS:
+            for prefix, column in ROLLING_MEAN_COLUMNS.items():
+                mean, std = _window_mean_std(self.buffers[column], window)
+                row[f'{prefix}_rolling_mean_{window}'] = mean
+                if prefix == 'qa':
+                    row[f'qa_rolling_std_{window}'] = std
+
+        qa_baseline = self.baseline_sum / self.baseline_count if self.baseline_count else math.nan
+        row['qa_baseline'] = qa_baseline
+        row['qa_change_from_baseline'] = row['access_blood_flow_qa'] - qa_baseline
+        row['qa_pct_change_from_baseline'] = (row['qa_change_from_baseline'] / qa_baseline * 100
+                                              if qa_baseline else math.nan)
+
+        for prefix, column in TREND_COLUMNS.items():
+            row[f'{prefix}_trend_{TREND_WINDOW}'] = self.slopes[column].slope()
+
+        # Same as the batch pipeline's final fillna(0)
+        return {key: 0.0 if isinstance(value, float) and math.isnan(value) else value
+                for key, value in row.items()}
+
+
+class IncrementalFeatureStore:
+    """Per-patient feature state, updated one session at a time.
+
+    `patients` is the patients table (or any frame with patient_id, the
+    PATIENT_COLUMNS and sex); unknown patients can be added with
+    register_patient().
+    """
+
+    def __init__(self, patients=None):
+        self._patients = {}
+        self._states = {}
+        if patients is not None:
+            for record in patients.to_dict('records'):
+                self.register_patient(record)
+
+    @classmethod
+    def from_history(cls, patients, treatments):
+        """Store in the state it would reach after appending every session in `treatments`.
+
+        Only the sessions the state depends on are replayed: each patient's
+        first BASELINE_TREATMENTS (the Qa baseline) and last _BUFFER_SIZE (the
+        rolling windows and trends), so warming up costs O(patients), not
+        O(sessions).
+        """
+        store = cls(patients)
+        history = treatments[SESSION_COLUMNS].sort_values(['patient_id', 'treatment_number'], kind='stable')
+        codes, position = segment_positions(history['patient_id'])
+        n_sessions = np.bincount(codes)
+        replay = (position < BASELINE_TREATMENTS) | (position >= n_sessions[codes] - _BUFFER_SIZE)
+        store.extend(history[replay])
+        for patient_id, count in zip(history['patient_id'].to_numpy()[position == 0], n_sessions.tolist()):
+            store._states[patient_id].n_sessions = count
+        return store
+
+    def register_patient(self, patient):
+        attributes = {column: patient[column] for column in PATIENT_COLUMNS}
+        attributes['sex_encoded'] = int(patient['sex'] == 'F')
+        self._patients[patient['patient_id']] = attributes
+
+    def append(self, session):
+        """Add one session (a mapping with SESSION_COLUMNS) and return its feature row."""
+        patient_id = session['patient_id']
+        state = self._states.get(patient_id)
+        if state is None:
+            if patient_id not in self._patients:
+                raise KeyError(f"Unknown patient {patient_id!r}; call register_patient() first")
+            state = self._states[patient_id] = PatientFeatureState(self._patients[patient_id])
+        return state.append(session)
+
+    def snapshot(self, patient_ids):
+        """Copies of these patients' current states, to undo appends with restore()."""
+        snapshot = {}
+        for patient_id in patient_ids:
+            if patient_id not in snapshot:
+                state = self._states.get(patient_id)
+                snapshot[patient_id] = None if state is None else state.copy()
+        return snapshot
+
+    def restore(self, snapshot):
+        """Put the patients in a snapshot() back in the state it recorded."""
+        for patient_id, state in snapshot.items():
+            if state is None:
+                self._states.pop(patient_id, None)
+            else:
+                self._states[patient_id] = state
+
+    def extend(self, sessions):
+        """Append sessions from a DataFrame (in treatment order) and return their feature rows."""
+        return [self.append(session) for session in sessions[SESSION_COLUMNS].to_dict('records')]
+
+    def latest(self, patient_id):
+        """Most recent feature row for a patient, or None if no session has been seen."""
+        state = self._states.get(patient_id)
+        return None if state is None else state.latest
+
+    def feature_vector(self, patient_id):
+        """Latest MODEL_FEATURES for a patient as a (1, n_features) array, ready to score."""
+        row = self.latest(patient_id)
+        return np.array([[row[feature] for feature in MODEL_FEATURES]], dtype=float)
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, patient_id):
+        return patient_id in self._states
+
+
+def _compare(incremental, batch, label):
+    incremental = incremental.set_index(['patient_id', 'treatment_number'])[PARITY_COLUMNS]
+    batch = batch.astype({'patient_id': str}).set_index(['patient_id', 'treatment_number'])
+    batch = batch.loc[incremental.index, PARITY_COLUMNS]
+    np.testing.assert_allclose(incremental.to_numpy(dtype=float), batch.to_numpy(dtype=float),
+                               rtol=PARITY_RTOL, atol=PARITY_ATOL, err_msg=label)
+
+
+def check_parity(patients, treatments, outcomes):
+    """Raise AssertionError unless appending sessions one at a time reproduces build_full_data().
+
+    Every session in treatments is appended in arrival order (every patient's
+    session k before anyone's session k + 1) and its row compared on
+    PARITY_COLUMNS. Windows and trends only look backwards, so rows from the
+    BASELINE_TREATMENTS-th treatment on are compared with one batch run over
+    the full history; earlier rows, whose batch Qa baseline would see later
+    treatments, with batch runs over the truncated prefixes. Returns the
+    number of sessions compared.
+    """
+    store = IncrementalFeatureStore(patients)
+    incremental = pd.DataFrame(store.extend(treatments.sort_values(['treatment_number', 'patient_id'])))
+    incremental['patient_id'] = incremental['patient_id'].astype(str)
+
+    _compare(incremental[incremental['treatment_number'] >= BASELINE_TREATMENTS],
+             build_full_data(patients, treatments, outcomes), 'full history')
+    for prefix_length in range(1, BASELINE_TREATMENTS):
+        prefix = treatments[treatments['treatment_number'] <= prefix_length]
+        _compare(incremental[incremental['treatment_number'] == prefix_length],
+                 build_full_data(patients, prefix, outcomes), f'prefix {prefix_length}')
+    return len(incremental)
@@ -0,0 +1,276 @@
+"""Feature engineering shared by the dashboard and model training.
+
+build_full_data() joins the raw tables and adds every engineered column the
+model uses. The treatments are sorted once by patient and treatment number,
+after which each patient's history is a contiguous segment; rolling statistics
+are computed for all patients at once by summing lagged copies of the value
+columns, masked wherever the lag would cross into the previous patient.
+Trends use the same lagged sums in a closed-form least-squares slope.
+
+Patient attributes (age, comorbidities, ...) do not change between treatments,
+so build_treatment_features() and build_patient_features() keep them apart and
+join_patient_features() repeats them onto treatment rows only where needed.
+The dashboard holds the two tables separately and joins per scoring batch.
+"""
+import numpy as np
+import pandas as pd
+
+from src.instrumentation import timed
+
+# Last 4 treatments (~1 week) and last 12 treatments (~1 month)
+ROLLING_WINDOWS = (4, 12)
+
+# Number of initial treatments averaged into the Qa baseline
+BASELINE_TREATMENTS = 4
+
+# Raw columns with rolling means, keyed by the prefix of the engineered column
+ROLLING_MEAN_COLUMNS = {
+    'qa': 'access_blood_flow_qa',
+    'svpr': 'svpr',
+    'recirculation': 'access_recirculation_pct',
+}
+
+# Raw columns with a rolling least-squares trend, keyed by the prefix of the engineered column
+TREND_COLUMNS = {
+    'qa': 'access_blood_flow_qa',
+    'svpr': 'svpr',
+    'venous_pressure': 'venous_pressure_mean',
+}
+TREND_WINDOW = 12
+
+# Bump whenever build_full_data() output changes; part of the feature cache key
+FEATURE_PIPELINE_VERSION = 2
+
+# Engineered columns are computed in float64 and stored as float32: the forest
+# compares features in float32 anyway, so scores are unchanged at half the memory
+FEATURE_DTYPE = np.float32
+
+# This list MUST match the features the model was trained on, in the exact same order.
+MODEL_FEATURES = [
+    'age', 'diabetes', 'hypertension', 'cad', 'pvd',
+    'prior_interventions', 'history_cvc', 'baseline_risk_score',
+    'access_blood_flow_qa', 'venous_pressure_mean', 'svpr',
+    'access_recirculation_pct', 'ktv',
+    'high_vp_alarms', 'low_ap_alarms',
+    'qa_rolling_mean_4', 'qa_rolling_mean_12',
+    'svpr_rolling_mean_4', 'svpr_rolling_mean_12',
+    'recirculation_rolling_mean_4', 'recirculation_rolling_mean_12',
+    'qa_rolling_std_4', 'qa_rolling_std_12',
+    'qa_trend_12', 'qa_pct_change_from_baseline',
+    'sex_encoded'
+]
+
+# Patient-level MODEL_FEATURES: stored once per patient (build_patient_features())
+# and joined onto treatment rows only where the model needs whole rows
+PATIENT_FEATURES = [
+    'age', 'diabetes', 'hypertension', 'cad', 'pvd',
+    'prior_interventions', 'history_cvc', 'baseline_risk_score', 'sex_encoded'
+]
+
+
+def calculate_slope(series):
+    """Calculate linear regression slope (reference for rolling_slope)"""
+    if len(series) < 2:
+        return 0
+    x = np.arange(len(series))
+    slope = np.polyfit(x, series, 1)[0]
+    return slope
+
+
+def segment_positions(patient_ids):
+    """Return (codes, position) for a frame already sorted by patient.
+
+    codes numbers the contiguous patient segments 0..n-1 and position is the
+    0-based index of each row within its patient's history.
+    """
+    if isinstance(patient_ids.dtype, pd.CategoricalDtype):
+        # The category codes already number the patients; factorizing would materialize the ids
+        ids = patient_ids.cat.codes.to_numpy()
+    else:
+        ids, _ = pd.factorize(patient_ids)
+    new_segment = np.r_[True, ids[1:] != ids[:-1]]
+    codes = np.cumsum(new_segment) - 1
+    starts = np.flatnonzero(new_segment)
+    position = np.arange(len(ids)) - starts[codes]
+    return codes, position
+
+
+def rolling_mean_std(values, position, window, std=True):
+    """Trailing-window mean (and sample std) per patient segment.
+
+    values is an (n_rows, n_columns) float array and position comes from
+    segment_positions(). Semantics match pandas
+    groupby().rolling(window, min_periods=1): NaNs are skipped, the mean needs
+    one value and the std (ddof=1) two, otherwise the result is NaN.
+    """
+    n_rows = len(values)
+    total = np.zeros_like(values)
+    count = np.zeros_like(values)
+    for lag in range(min(window, n_rows)):
+        lagged = values[:n_rows - lag]
+        valid = (position[lag:] >= lag)[:, None] & ~np.isnan(lagged)
+        total[lag:] += np.where(valid, lagged, 0)
+        count[lag:] += valid
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    if not std:
+        return mean, None
+
+    # Second pass over the same windows: squared deviations from each window's mean
+    squares = np.zeros_like(values)
+    for lag in range(min(window, n_rows)):
+        lagged = values[:n_rows - lag]
+        valid = (position[lag:] >= lag)[:, None] & ~np.isnan(lagged)
+        deviation = lagged - mean[lag:]
+        squares[lag:] += np.where(valid, deviation * deviation, 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = np.where(count >= 2, squares / (count - 1), np.nan)
+    return mean, np.sqrt(variance)
+
+
+def segment_head_mean(values, codes, position, n):
+    """Mean of each segment's first n rows (NaNs skipped), broadcast back to every row."""
+    head = (position < n) & ~np.isnan(values)
+    sums = np.bincount(codes, weights=np.where(head, values, 0))
+    counts = np.bincount(codes, weights=head)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums / counts)[codes]
+
+
+def rolling_slope(values, position, window, min_periods=2):
+    """Trailing-window least-squares slope per patient segment, in closed form.
+
+    Equivalent to rolling(window, min_periods).apply(calculate_slope) with the
+    result's NaNs filled with 0: x is 0..m-1 over the m rows in the window,
+    windows with fewer than min_periods rows give 0, and a NaN anywhere in the
+    window gives 0. Uses running sums of y and lag*y over the window:
+    with sum(x) and sum(x^2) known for each m, sum(x*y) = (m-1)*sum(y) - sum(lag*y).
+    """
+    n_rows = len(values)
+    m = np.minimum(position + 1, window).astype(float)[:, None]
+    sum_y = np.zeros_like(values)
+    sum_lag_y = np.zeros_like(values)
+    has_nan = np.zeros(values.shape, dtype=bool)
+    for lag in range(min(window, n_rows)):
+        lagged = values[:n_rows - lag]
+        in_window = (position[lag:] >= lag)[:, None]
+        has_nan[lag:] |= in_window & np.isnan(lagged)
+        lagged = np.where(in_window, lagged, 0)
+        sum_y[lag:] += lagged
+        sum_lag_y[lag:] += lag * lagged
+
+    sum_x = m * (m - 1) / 2
+    sum_xx = (m - 1) * m * (2 * m - 1) / 6
+    sum_xy = (m - 1) * sum_y - sum_lag_y
+    denominator = m * sum_xx - sum_x * sum_x
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (m * sum_xy - sum_x * sum_y) / denominator
+    return np.where((m >= max(min_periods, 2)) & ~has_nan, slope, 0.0)
+
+
+@timed(rows=len)
+def add_rolling_features(full_data):
+    """Add rolling means/stds and the change from baseline to a frame sorted by patient."""
+    codes, position = segment_positions(full_data['patient_id'])
+
+    # Calculate rolling averages for key variables (std of Qa as an instability marker)
+    mean_values = full_data[list(ROLLING_MEAN_COLUMNS.values())].to_numpy(dtype=float)
+    for window in ROLLING_WINDOWS:
+        means, _ = rolling_mean_std(mean_values, position, window, std=False)
+        for i, prefix in enumerate(ROLLING_MEAN_COLUMNS):
+            full_data[f'{prefix}_rolling_mean_{window}'] = means[:, i].astype(FEATURE_DTYPE)
+
+        _, qa_std = rolling_mean_std(mean_values[:, :1], position, window)
+        full_data[f'qa_rolling_std_{window}'] = np.nan_to_num(qa_std[:, 0], nan=0.0).astype(FEATURE_DTYPE)
+
+    # Calculate change from baseline (first 4 treatments)
+    qa = mean_values[:, 0]
+    qa_baseline = segment_head_mean(qa, codes, position, BASELINE_TREATMENTS)
+    qa_change = qa - qa_baseline
+    full_data['qa_baseline'] = qa_baseline.astype(FEATURE_DTYPE)
+    full_data['qa_change_from_baseline'] = qa_change.astype(FEATURE_DTYPE)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        full_data['qa_pct_change_from_baseline'] = ((qa_change / qa_baseline) * 100).astype(FEATURE_DTYPE)
+    return full_data
+
+
+@timed(rows=len)
+def add_trend_features(full_data):
+    """Add 12-treatment slopes of Qa, SVPR and venous pressure to a frame sorted by patient."""
+    _, position = segment_positions(full_data['patient_id'])
+    values = full_data[list(TREND_COLUMNS.values())].to_numpy(dtype=float)
+    slopes = rolling_slope(values, position, TREND_WINDOW)
+    for i, prefix in enumerate(TREND_COLUMNS):
+        full_data[f'{prefix}_trend_{TREND_WINDOW}'] = slopes[:, i].astype(FEATURE_DTYPE)
+    return full_data
+
+
+def _fill_missing(frame):
+    """frame.fillna(0) in place, one float column at a time and only where there are NaNs."""
+    for column in frame.columns:
+        values = frame[column]
+        if values.dtype.kind == 'f' and values.isna().any():
+            frame[column] = values.fillna(0)
+    return frame
+
+
+@timed(rows=len)
+def build_treatment_features(treatments):
+    """The treatment-level columns of full_data.
+
+    Sorts the treatments by patient and treatment number once and adds
+    total_alarms plus the rolling, baseline and trend features.
+    """
+    full_data = treatments.sort_values(['patient_id', 'treatment_number'], ignore_index=True)
+
+    # Combine alarm features - common for models
+    full_data['total_alarms'] = full_data['high_vp_alarms'] + full_data['low_ap_alarms']
+
+    full_data = add_rolling_features(full_data)
+    full_data = add_trend_features(full_data)
+
+    # Fill any NaNs created by baseline % change (for first few rows)
+    return _fill_missing(full_data)
+
+
+@timed(rows=len)
+def build_patient_features(patients, outcomes):
+    """The patient-level columns of full_data, one row per patient: patients plus failed and sex_encoded."""
+    patient_features = patients.merge(outcomes[['patient_id', 'failed']], on='patient_id')
+
+    # Encode categorical variables
+    patient_features['sex_encoded'] = (patient_features['sex'] == 'F').astype(np.int8)
+    return _fill_missing(patient_features)
+
+
+def known_patients(treatments, patient_features):
+    """treatments without the rows of patients missing from patient_features."""
+    known = treatments['patient_id'].isin(patient_features['patient_id'])
+    return treatments if known.all() else treatments[known]
+
+
+def join_patient_features(frame, patient_features, columns=None):
+    """frame with the patient-level columns (all, or `columns`) of each row's patient added.
+
+    Rows keep their order and index; a patient missing from patient_features
+    raises KeyError.
+    """
+    rows = pd.Index(patient_features['patient_id']).get_indexer(frame['patient_id'])
+    if (rows < 0).any():
+        raise KeyError(f"No patient features for {frame['patient_id'].iloc[np.flatnonzero(rows < 0)[0]]!r}")
+    columns = [column for column in (columns or patient_features.columns) if column != 'patient_id']
+    return frame.assign(**{column: patient_features[column].array.take(rows) for column in columns})
+
+
+@timed(rows=len)
+def build_full_data(patients, treatments, outcomes):
+    """Every treatment with every feature used by the model.
+
+    build_treatment_features() joined with build_patient_features(); the
+    dashboard keeps the two apart and joins them only to score.
+    """
+    patient_features = build_patient_features(patients, outcomes)
+    treatment_features = build_treatment_features(known_patients(treatments, patient_features))
+    return join_patient_features(treatment_features, patient_features)
@@ -0,0 +1,521 @@
+"""Live ingestion of dialysis sessions with micro-batch rescoring.
+
+Run from the repository root next to the dashboard:
+
+    python -m src.ingestion                                   # HTTP on 127.0.0.1:8502
+    python -m src.ingestion --inbox data/inbox/sessions.jsonl --max-batch 500 --max-delay 0.25
+
+New treatment records arrive as JSON, either POSTed to /sessions (one object
+or a list) or appended as lines to an inbox JSONL file. Each record is
+checked against the treatment schema (storage.TABLE_DTYPES) and queued. A
+single worker thread takes the queue in micro-batches (up to --max-batch
+sessions, or whatever arrived within --max-delay seconds of the first), updates
+the affected patients' features in O(1) per session with the
+IncrementalFeatureStore, scores the whole batch with one predict_proba call
+and appends two files to data/live/:
+
+* treatments_baseline/part-NNNNNN.parquet: the accepted sessions, in the raw
+  treatments schema (read_table('treatments', data_dir=LIVE_DIR) reads them);
+* scores/part-NNNNNN.parquet: their feature rows with risk_score, plus when
+  each session was received and scored.
+
+state.json is replaced atomically after both parts are written, so readers
+only ever see complete batches. Before writing the parts the worker records
+the batch in state.json as pending; if it stops between the two, the next
+start (recover_live_dir()) commits the batch when both parts made it to disk
+and otherwise removes the partial part, so no session is stored twice or
+replayed on top of itself. The dashboard keeps a LiveScores object that
+reads just the parts added since its last rerun and overlays them on the
+cached risk table, so new sessions show up without reloading anything.
+
+On startup the worker rebuilds each patient's feature state from the raw
+tables plus everything already in data/live/ (IncrementalFeatureStore.
+from_history()), and resumes the inbox after the last line it committed.
+Sessions for unknown patients or out of treatment order are rejected and
+logged to data/live/rejected.jsonl. A batch that fails to score or write is
+logged there too and skipped, with its patients' feature state rolled back,
+and the worker carries on. GET /health returns the counters, and status 503
+once the scoring thread is no longer running.
+"""
+import argparse
+import hashlib
+import json
+import math
+import queue
+import threading
+import time
+import traceback
+from collections import defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.feature_cache import raw_fingerprint
+from src.feature_store import SESSION_COLUMNS, IncrementalFeatureStore
+from src.features import MODEL_FEATURES
+from src.instrumentation import span, timed
+from src.risk_table import serving_model_path
+from src.scoring import load_model
+from src.storage import RAW_DATA_DIR, TABLE_DTYPES, TABLE_FILES, read_table, write_table
+from src.utils import CACHE_DIR, DATA_DIR, atomic_write
+
+LIVE_DIR = DATA_DIR / 'live'
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8502
+
+# A micro-batch is scored when this many sessions are queued or the first has waited this long
+DEFAULT_MAX_BATCH = 1_000
+DEFAULT_MAX_DELAY = 0.5
+
+# Accepted fields: every raw treatment column; SESSION_COLUMNS are required
+SESSION_SCHEMA = TABLE_DTYPES['treatments']
+
+# Lower bounds of the integer fields
+_MINIMUM = {'treatment_number': 1, 'high_vp_alarms': 0, 'low_ap_alarms': 0}
+
+_STATE_FILE = 'state.json'
+_REJECTED_FILE = 'rejected.jsonl'
+_SCORES_DIR = 'scores'
+
+
+def raw_data_key(data_dir=RAW_DATA_DIR, cache_dir=CACHE_DIR):
+    """Content hash of the raw tables; live data is only valid on top of the tables it started from."""
+    payload = [(Path(entry['path']).name, entry['size'], entry['digest'])
+               for entry in raw_fingerprint(data_dir, cache_dir)]
+    return hashlib.blake2b(json.dumps(payload).encode(), digest_size=16).hexdigest()
+
+
+def read_state(live_dir=LIVE_DIR):
+    try:
+        return json.loads((Path(live_dir) / _STATE_FILE).read_text())
+    except FileNotFoundError:
+        return None
+
+
+def _part_path(live_dir, kind, batch):
+    directory = TABLE_FILES['treatments'] if kind == 'sessions' else _SCORES_DIR
+    return Path(live_dir) / directory / f'part-{batch:06d}.parquet'
+
+
+def _write_state(live_dir, state):
+    with atomic_write(Path(live_dir) / _STATE_FILE) as tmp:
+        tmp.write_text(json.dumps(state))
+
+
+def recover_live_dir(live_dir=LIVE_DIR):
+    """Settle the batch a stopped worker was writing; returns the resulting state (None if there is none).
+
+    A pending batch whose sessions and scores parts are both on disk is
+    committed, with the inbox offset it was written up to. Otherwise its
+    partial parts are removed and the inbox resumes before it, so its
+    sessions are scored again.
+    """
+    state = read_state(live_dir)
+    if state is None or 'pending' not in state:
+        return state
+    pending = state.pop('pending')
+    parts = [_part_path(live_dir, kind, pending['batch']) for kind in ('sessions', 'scores')]
+    if pending['batch'] == state['batches'] and all(part.exists() for part in parts):
+        state['batches'] += 1
+        state['sessions'] += pending['sessions']
+        state['inbox_offset'] = pending['inbox_offset']
+    else:
+        for part in parts:
+            part.unlink(missing_ok=True)
+    _write_state(live_dir, state)
+    return state
+
+
+def validate_session(record):
+    """Return (session, None) for a valid treatment record, or (None, reason).
+
+    The session has every SESSION_SCHEMA field: missing optional fields and
+    null measurements become None/NaN, treatment_date is parsed.
+    """
+    if not isinstance(record, dict):
+        return None, 'record is not a JSON object'
+    unknown = sorted(set(record) - set(SESSION_SCHEMA))
+    if unknown:
+        return None, f'unknown fields {unknown}'
+    missing = [field for field in SESSION_COLUMNS if field not in record]
+    if missing:
+        return None, f'missing fields {missing}'
+
+    session = {}
+    for field, dtype in SESSION_SCHEMA.items():
+        value = record.get(field)
+        if dtype == 'category':
+            if not isinstance(value, str) or not value:
+                return None, f'{field} must be a non-empty string'
+        elif dtype.startswith('int'):
+            limits = np.iinfo(dtype)
+            if isinstance(value, bool) or not isinstance(value, int):
+                return None, f'{field} must be an integer'
+            if not max(limits.min, _MINIMUM.get(field, limits.min)) <= value <= limits.max:
+                return None, f'{field}={value} is out of range'
+        elif dtype.startswith('float'):
+            if value is None:
+                value = math.nan
+            elif isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                return None, f'{field} must be a finite number or null'
+        elif value is not None:
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                return None, f'{field} must be an ISO 8601 date'
+        session[field] = value
+    return session, None
+
+
+class IngestionWorker:
+    """Validates incoming sessions, then scores and appends them to the live store in micro-batches."""
+
+    def __init__(self, feature_store, model, live_dir=LIVE_DIR, raw_key=None, max_batch=DEFAULT_MAX_BATCH,
+                 max_delay=DEFAULT_MAX_DELAY):
+        self.feature_store = feature_store
+        self.model = model
+        self.live_dir = Path(live_dir)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.state = read_state(live_dir) or {'raw_data': raw_key, 'batches': 0, 'sessions': 0,
+                                              'inbox_offset': 0}
+        if raw_key is not None and self.state['raw_data'] != raw_key:
+            raise ValueError(f"{live_dir} holds sessions for different raw tables; move it aside or use --reset")
+        self.live_dir.mkdir(parents=True, exist_ok=True)
+        self.counts = {'received': 0, 'invalid': 0, 'rejected': 0, 'scored': 0, 'failed': 0}
+        self.last_error = None
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._running = threading.Event()
+        self._lock = threading.Lock()
+
+    def submit(self, records, inbox_offsets=None):
+        """Validate and queue records; returns (accepted count, [{'index': i, 'error': reason}, ...]).
+
+        inbox_offsets[i] is the inbox file offset just past record i, committed
+        to state.json once the record's batch is written.
+        """
+        received_at = time.time()
+        accepted, errors = 0, []
+        for i, record in enumerate(records):
+            session, error = validate_session(record)
+            if error:
+                errors.append({'index': i, 'error': error})
+                continue
+            self._queue.put((session, received_at, inbox_offsets[i] if inbox_offsets else None))
+            accepted += 1
+        with self._lock:
+            self.counts['received'] += len(records)
+            self.counts['invalid'] += len(errors)
+        return accepted, errors
+
+    def status(self):
+        with self._lock:
+            return {**self.counts, 'queued': self._queue.qsize(), 'batches': self.state['batches'],
+                    'sessions': self.state['sessions'], 'worker_alive': self._running.is_set(),
+                    'last_error': self.last_error}
+
+    def run(self):
+        """Process micro-batches until stop() is called; the queue is drained first.
+
+        A batch that fails to score or write is logged (traceback to stderr,
+        sessions to rejected.jsonl) and skipped; process() has already rolled
+        its patients' features back, so their later sessions still score.
+        """
+        self._running.set()
+        try:
+            while not (self._stop.is_set() and self._queue.empty()):
+                try:
+                    batch = [self._queue.get(timeout=0.1)]
+                except queue.Empty:
+                    continue
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+                try:
+                    self.process(batch)
+                except Exception as e:
+                    self._log_failed(batch, e)
+        finally:
+            self._running.clear()
+
+    def stop(self):
+        self._stop.set()
+
+    @timed()
+    def process(self, batch):
+        """Update features, score and append one micro-batch of (session, received_at, inbox_offset).
+
+        If scoring, writing or committing the batch fails, its patients'
+        features are restored to their state before the batch and the
+        exception is raised.
+        """
+        snapshot = self.feature_store.snapshot(session['patient_id'] for session, _, _ in batch)
+        try:
+            self._process(batch)
+        except Exception:
+            self.feature_store.restore(snapshot)
+            raise
+
+    def _process(self, batch):
+        sessions, rows, received, rejected = [], [], [], []
+        for session, received_at, _ in batch:
+            try:
+                rows.append(self.feature_store.append(session))
+            except (KeyError, ValueError) as e:
+                rejected.append({'session': session, 'error': e.args[0]})
+                continue
+            sessions.append(session)
+            received.append(received_at)
+
+        inbox_offsets = [offset for _, _, offset in batch if offset is not None]
+        if rows:
+            scores = pd.DataFrame(rows)
+            with span('ingestion.predict', rows=len(scores)):
+                probabilities = self.model.predict_proba(scores[MODEL_FEATURES])[:, 1]
+            scores['risk_score'] = (probabilities * 100).astype('float32')
+            scores['received_at'] = received
+            scores['scored_at'] = time.time()
+            self._append(pd.DataFrame(sessions), scores,
+                         max(inbox_offsets) if inbox_offsets else self.state['inbox_offset'])
+        if rejected:
+            with open(self.live_dir / _REJECTED_FILE, 'a') as f:
+                for entry in rejected:
+                    f.write(json.dumps(entry, default=str) + '\n')
+
+        with self._lock:
+            # Only adopted once on disk, so a failed write leaves self.state at the last commit
+            state = dict(self.state)
+            if inbox_offsets:
+                state['inbox_offset'] = max(inbox_offsets)
+            if rows:
+                state['batches'] += 1
+                state['sessions'] += len(rows)
+            if rows or inbox_offsets:
+                _write_state(self.live_dir, state)
+            self.state = state
+            self.counts['scored'] += len(rows)
+            self.counts['rejected'] += len(rejected)
+
+    def _append(self, sessions, scores, inbox_offset):
+        """Write the next batch's two parts; process() commits them to state.json afterwards."""
+        batch = self.state['batches']
+        # Intent first, so recover_live_dir() can settle a batch interrupted between the writes below
+        _write_state(self.live_dir, {**self.state, 'pending': {'batch': batch, 'sessions': len(scores),
+                                                               'inbox_offset': inbox_offset}})
+        with atomic_write(_part_path(self.live_dir, 'sessions', batch)) as tmp:
+            write_table('treatments', sessions, tmp, 'parquet')
+        with atomic_write(_part_path(self.live_dir, 'scores', batch)) as tmp:
+            pq.write_table(pa.Table.from_pandas(scores, preserve_index=False), tmp)
+
+    def _log_failed(self, batch, error):
+        traceback.print_exc()
+        with self._lock:
+            self.counts['failed'] += len(batch)
+            self.last_error = repr(error)
+        try:
+            with open(self.live_dir / _REJECTED_FILE, 'a') as f:
+                for session, _, _ in batch:
+                    f.write(json.dumps({'session': session, 'error': f'batch failed: {error!r}'}, default=str) + '\n')
+        except OSError:
+            pass  # already on stderr; the disk may be what failed
+
+
+def load_worker(data_dir=RAW_DATA_DIR, live_dir=LIVE_DIR, model_path=None, max_batch=DEFAULT_MAX_BATCH,
+                max_delay=DEFAULT_MAX_DELAY, cache_dir=CACHE_DIR):
+    """Worker whose feature state covers the raw tables plus every session already in live_dir."""
+    recover_live_dir(live_dir)
+    patients = read_table('patients', data_dir=data_dir)
+    history = [read_table('treatments', SESSION_COLUMNS, data_dir)]
+    if (Path(live_dir) / TABLE_FILES['treatments']).exists():
+        history.append(read_table('treatments', SESSION_COLUMNS, live_dir))
+    for frame in history:
+        frame['patient_id'] = frame['patient_id'].astype(str)
+    feature_store = IncrementalFeatureStore.from_history(patients, pd.concat(history, ignore_index=True))
+    model = load_model(model_path or serving_model_path(cache_dir=cache_dir))
+    return IngestionWorker(feature_store, model, live_dir, raw_data_key(data_dir, cache_dir), max_batch, max_delay)
+
+
+def make_server(worker, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """HTTP front end: POST /sessions (a record or a list of records), GET /health."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/sessions':
+                return self._reply(404, {'error': f'no endpoint {self.path}'})
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError:
+                return self._reply(400, {'error': 'body is not valid JSON'})
+            records = payload if isinstance(payload, list) else [payload]
+            accepted, errors = worker.submit(records)
+            self._reply(202 if accepted or not records else 400, {'accepted': accepted, 'errors': errors})
+
+        def do_GET(self):
+            if self.path != '/health':
+                return self._reply(404, {'error': f'no endpoint {self.path}'})
+            status = worker.status()
+            self._reply(200 if status['worker_alive'] else 503, status)
+
+        def _reply(self, status, body):
+            encoded = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(encoded)))
+            self.end_headers()
+            self.wfile.write(encoded)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def watch_inbox(path, worker, stop, poll_interval=0.2):
+    """Tail an append-only JSONL file from the last committed offset and submit complete lines."""
+    path = Path(path)
+    offset = worker.state.get('inbox_offset', 0)
+    while not stop.is_set():
+        records, offsets = [], []
+        if path.exists():
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # partially written; read it whole next time
+                    offset += len(line)
+                    if line.strip():
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            records.append(None)
+                        offsets.append(offset)
+        if records:
+            worker.submit(records, offsets)
+        stop.wait(poll_interval)
+
+
+class LiveScores:
+    """Dashboard view of the sessions scored by the ingestion worker, read incrementally.
+
+    refresh() reads only the score parts written since the previous call.
+    Live data is ignored unless it was ingested on top of the raw tables
+    identified by raw_key. generation counts the times the live store was
+    found reset, after which rows starts over.
+    """
+
+    def __init__(self, live_dir=LIVE_DIR, raw_key=None):
+        self.live_dir = Path(live_dir)
+        self.raw_key = raw_key
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.batches = 0
+        self.rows = pd.DataFrame()
+        self.latest = pd.DataFrame()
+        self.updated_at = None
+        self._positions = defaultdict(list)
+
+    @timed(rows=int)
+    def refresh(self):
+        """Read any new batches; returns the number of new sessions."""
+        state = read_state(self.live_dir)
+        if state is None or state['raw_data'] != self.raw_key:
+            return 0
+        with self._lock:
+            if state['batches'] < self.batches:
+                self._reset()  # the live store was reset
+                self.generation += 1
+            if state['batches'] == self.batches:
+                return 0
+            new = pd.concat([pd.read_parquet(_part_path(self.live_dir, 'scores', batch))
+                             for batch in range(self.batches, state['batches'])], ignore_index=True)
+            for position, patient_id in enumerate(new['patient_id'], start=len(self.rows)):
+                self._positions[patient_id].append(position)
+            self.rows = new if self.rows.empty else pd.concat([self.rows, new], ignore_index=True)
+            # Sessions arrive in treatment order per patient, so the last row is the latest
+            self.latest = self.rows.drop_duplicates('patient_id', keep='last').set_index('patient_id')
+            self.batches = state['batches']
+            self.updated_at = datetime.fromtimestamp(new['scored_at'].iloc[-1])
+            return len(new)
+
+    def latest_risk(self, patient_id, default=None):
+        if patient_id not in self.latest.index:
+            return default
+        return self.latest.at[patient_id, 'risk_score']
+
+    def extend_history(self, patient_id, history):
+        """The patient's history with their live sessions appended."""
+        positions = self._positions.get(patient_id)
+        if not positions:
+            return history
+        return pd.concat([history, self.rows.iloc[positions]], ignore_index=True)
+
+    def apply_latest(self, latest):
+        """One-row-per-patient frame with each patient's row replaced by their newest live session."""
+        if self.latest.empty:
+            return latest
+        patient_ids = latest['patient_id'].astype(str)
+        is_live = patient_ids.isin(self.latest.index).to_numpy()
+        live_rows = self.latest.loc[patient_ids[is_live]]
+        patched = latest.copy()
+        for column in latest.columns.intersection(live_rows.columns):
+            patched.loc[is_live, column] = live_rows[column].to_numpy().astype(latest[column].dtype)
+        return patched
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest live dialysis sessions and rescore them in micro-batches.')
+    parser.add_argument('--data-dir', default=str(RAW_DATA_DIR))
+    parser.add_argument('--live-dir', default=str(LIVE_DIR))
+    parser.add_argument('--model', help='pickled forest or compiled .forest file (default: what the dashboard serves)')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='HTTP port (0: pick a free one)')
+    parser.add_argument('--inbox', help='also ingest lines appended to this JSONL file')
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH, help='sessions per micro-batch')
+    parser.add_argument('--max-delay', type=float, default=DEFAULT_MAX_DELAY,
+                        help='seconds the first session of a batch may wait for more')
+    parser.add_argument('--reset', action='store_true', help='discard previously ingested sessions first')
+    args = parser.parse_args()
+
+    if args.reset:
+        for part in [*Path(args.live_dir).glob('*/part-*.parquet'), Path(args.live_dir) / _STATE_FILE]:
+            part.unlink(missing_ok=True)
+
+    start = time.perf_counter()
+    worker = load_worker(args.data_dir, args.live_dir, args.model, args.max_batch, args.max_delay)
+    print(f"✓ Feature state for {len(worker.feature_store):,} patients loaded in {time.perf_counter() - start:.1f}s "
+          f"({worker.state['sessions']:,} live sessions so far)")
+
+    stop = threading.Event()
+    threads = [threading.Thread(target=worker.run, name='scoring')]
+    if args.inbox:
+        threads.append(threading.Thread(target=watch_inbox, args=(args.inbox, worker, stop), name='inbox'))
+    for thread in threads:
+        thread.start()
+
+    server = make_server(worker, args.host, args.port)
+    print(f"✓ Listening on http://{args.host}:{server.server_port} (POST /sessions, GET /health)"
+          + (f", watching {args.inbox}" if args.inbox else ''), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stop.set()
+        worker.stop()
+        for thread in threads:
+            thread.join()
+        print(f"\n✓ Stopped: {worker.status()}")
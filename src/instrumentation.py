@@ -0,0 +1,261 @@
+"""Named timing spans for the generate -> features -> score -> render path.
+
+Disabled by default. Set AVF_PROFILE before starting a CLI or the dashboard:
+
+    AVF_PROFILE=1 python -m src.data_generation --n-patients 10000     # -> results/profile.jsonl
+    AVF_PROFILE=/tmp/app.jsonl streamlit run app.py
+    python -m src.instrumentation results/profile.jsonl                 # per-span summary
+
+Code is instrumented with the @timed decorator or the span() context manager
+(or span().start() ... .stop() around code that does not fit a with block).
+Every finished span appends one JSON line: name, enclosing span, wall-clock
+start, seconds, rows (where the caller knows them), resident memory after the
+span and its change (null on Windows), pid and thread, plus any fields the
+caller attached.
+Worker processes inherit the variable and append to the same file.
+
+When disabled, span() returns a shared no-op object and a @timed function
+checks one global before calling straight through, so instrumented hot paths
+cost well under a microsecond per call (python -m benchmarks.bench_instrumentation).
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows: spans are recorded without memory figures
+    resource = None
+
+from src.utils import RESULTS_DIR
+
+# Environment variable that enables profiling: 1/true for DEFAULT_PROFILE_PATH, any other value is the output path
+PROFILE_ENV = 'AVF_PROFILE'
+DEFAULT_PROFILE_PATH = RESULTS_DIR / 'profile.jsonl'
+
+# Finished spans kept in memory for the dashboard's debug panel
+RECENT_SPANS = 1000
+
+_PAGE_SIZE_MB = os.sysconf('SC_PAGE_SIZE') / 2 ** 20 if hasattr(os, 'sysconf') else 0.0
+_STATM = Path('/proc/self/statm')
+
+_sink = None
+_lock = threading.Lock()
+_local = threading.local()
+_recent = deque(maxlen=RECENT_SPANS)
+
+
+def rss_mb():
+    """Current resident memory in MB (peak resident memory where /proc is unavailable, None on Windows)."""
+    try:
+        return int(_STATM.read_text().split()[1]) * _PAGE_SIZE_MB
+    except OSError:
+        if resource is None:
+            return None
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if platform.system() == 'Darwin' else peak / 2 ** 10
+
+
+def enable(path=DEFAULT_PROFILE_PATH):
+    """Start recording spans, appending them to `path`."""
+    global _sink
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _lock:
+        if _sink is not None:
+            _sink.close()
+        _sink = open(path, 'a', buffering=1)
+
+
+def disable():
+    """Stop recording spans."""
+    global _sink
+    with _lock:
+        if _sink is not None:
+            _sink.close()
+        _sink = None
+
+
+def is_enabled():
+    return _sink is not None
+
+
+def _emit(record):
+    line = json.dumps(record, default=str) + '\n'
+    with _lock:
+        _recent.append(record)
+        if _sink is not None:
+            _sink.write(line)
+
+
+class Span:
+    """One timed region; use through span() or @timed."""
+
+    __slots__ = ('name', 'fields', '_parent', '_start', '_wall', '_rss')
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def set(self, **fields):
+        """Attach fields (rows=..., cache='hit', ...) to the record written when the span ends."""
+        self.fields.update(fields)
+        return self
+
+    def start(self):
+        return self.__enter__()
+
+    def stop(self):
+        self.__exit__(None, None, None)
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault('stack', [])
+        self._parent = stack[-1] if stack else None
+        stack.append(self.name)
+        self._rss = rss_mb()
+        self._wall = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self._start
+        _local.stack.pop()
+        rss = rss_mb()
+        measured = rss is not None and self._rss is not None
+        record = {'ts': self._wall, 'span': self.name, 'parent': self._parent, 'seconds': seconds,
+                  'rows': self.fields.pop('rows', None), 'rss_mb': round(rss, 1) if measured else None,
+                  'rss_delta_mb': round(rss - self._rss, 1) if measured else None, 'pid': os.getpid(),
+                  'thread': threading.get_ident()}
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        record.update(self.fields)
+        _emit(record)
+        return False
+
+
+class _NullSpan:
+    """What span() returns while profiling is disabled: every operation is a no-op."""
+
+    __slots__ = ()
+
+    def set(self, **fields):
+        return self
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **fields):
+    """Context manager timing the block under `name`; `fields` (rows=...) go into its record."""
+    if _sink is None:
+        return _NULL_SPAN
+    return Span(name, fields)
+
+
+def _module_name(function):
+    """Import name of a function's module, also when it runs as a script (python -m src.x)."""
+    spec = getattr(sys.modules.get(function.__module__), '__spec__', None)
+    return spec.name if spec is not None else function.__module__
+
+
+def timed(name=None, rows=None):
+    """Decorator recording every call as a span.
+
+    The span is named `name`, or module.qualname without the src. prefix.
+    rows, if given, is a function of the return value (len, for a frame)
+    giving the rows processed.
+    """
+    def decorator(function):
+        span_name = name or f"{_module_name(function).removeprefix('src.')}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return function(*args, **kwargs)
+            with Span(span_name, {}) as timing:
+                result = function(*args, **kwargs)
+                if rows is not None:
+                    timing.set(rows=rows(result))
+                return result
+        return wrapper
+    return decorator
+
+
+def recent_spans(since=None, thread=None):
+    """Spans finished in this process (the last RECENT_SPANS of them).
+
+    since (a time.time() value) keeps the spans started at or after it, thread
+    those run on that thread.
+    """
+    with _lock:
+        records = list(_recent)
+    return [record for record in records
+            if (since is None or record['ts'] >= since) and (thread is None or record['thread'] == thread)]
+
+
+def read_spans(path=DEFAULT_PROFILE_PATH):
+    """The span records of a profile file as a DataFrame."""
+    with open(path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def summarize(spans):
+    """Per-span calls, total/mean/p95 time, rows per second and mean memory change, slowest total first."""
+    spans = pd.DataFrame(spans)
+    if spans.empty:
+        return pd.DataFrame(columns=['span', 'calls', 'total_s', 'mean_ms', 'p95_ms', 'rows', 'rows_per_s',
+                                     'rss_delta_mb'])
+    spans = spans.assign(rows=pd.to_numeric(spans['rows'], errors='coerce'))
+    grouped = spans.groupby('span', sort=False)
+    summary = pd.DataFrame({
+        'calls': grouped.size(),
+        'total_s': grouped['seconds'].sum(),
+        'mean_ms': grouped['seconds'].mean() * 1e3,
+        'p95_ms': grouped['seconds'].quantile(0.95) * 1e3,
+        'rows': grouped['rows'].sum(min_count=1),
+        'rss_delta_mb': grouped['rss_delta_mb'].mean(),
+    })
+    summary['rows_per_s'] = summary['rows'] / summary['total_s']
+    summary = summary.reset_index().sort_values('total_s', ascending=False, ignore_index=True)
+    return summary[['span', 'calls', 'total_s', 'mean_ms', 'p95_ms', 'rows', 'rows_per_s', 'rss_delta_mb']]
+
+
+_setting = os.environ.get(PROFILE_ENV, '').strip()
+if _setting and _setting.lower() not in ('0', 'false', 'no', 'off'):
+    enable(DEFAULT_PROFILE_PATH if _setting.lower() in ('1', 'true', 'yes', 'on') else _setting)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize a span profile written with AVF_PROFILE set.')
+    parser.add_argument('path', nargs='?', default=str(DEFAULT_PROFILE_PATH))
+    parser.add_argument('--top', type=int, default=30, help='spans shown, by total time')
+    args = parser.parse_args()
+
+    summary = summarize(read_spans(args.path)).head(args.top)
+    print(f"{'span':<52} {'calls':>7} {'total s':>9} {'mean ms':>9} {'p95 ms':>9} {'rows/s':>12} {'RSS +MB':>8}")
+    for row in summary.itertuples():
+        rows_per_s = f"{row.rows_per_s:,.0f}" if pd.notna(row.rows_per_s) else '-'
+        print(f"{row.span:<52} {row.calls:>7,} {row.total_s:>9.3f} {row.mean_ms:>9.2f} {row.p95_ms:>9.2f} "
+              f"{rows_per_s:>12} {row.rss_delta_mb:>8.1f}")
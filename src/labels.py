@@ -0,0 +1,72 @@
+"""Prediction targets for every treatment row, for any set of horizons.
+
+The notebook built will_fail_within_30 by merging outcomes onto the treatment
+rows and doing the arithmetic for one hard-coded horizon. build_labels()
+instead looks each patient's outcome up once per patient segment of the
+sorted feature table (full_data is sorted by patient and treatment) and
+broadcasts it to the rows, then derives every horizon from the same
+time-to-event array:
+
+* time_to_event: treatments from this row until the access failed, or until
+  the patient's last observed treatment when no failure was seen (censored);
+* event: 1 if the failure was observed, 0 if the patient is censored;
+* at_risk: the access had not yet failed at this treatment;
+* will_fail_within_{h}: event & at_risk & time_to_event <= h, the same
+  definition the notebook used for h = 30.
+
+Rows before WARMUP_TREATMENTS are excluded from training (label_rows()): the
+access needs that long to establish a pattern.
+"""
+import numpy as np
+import pandas as pd
+
+from src.features import segment_positions
+
+# Horizon of the dashboard's model, in treatments
+HORIZON = 30
+
+# Horizons labelled together for multi-horizon training and evaluation
+HORIZONS = (7, 14, 30, 60)
+
+# Only use treatments after #20 (give access time to establish pattern)
+WARMUP_TREATMENTS = 20
+
+
+def label_column(horizon):
+    return f'will_fail_within_{horizon}'
+
+
+def build_labels(full_data, outcomes, horizons=HORIZONS):
+    """Time-to-event columns and one will_fail_within_{h} label per horizon, row-aligned with full_data.
+
+    full_data must be sorted by patient_id and treatment_number; outcomes needs
+    patient_id, failed and failure_treatment_number for every patient in it.
+    """
+    codes, position = segment_positions(full_data['patient_id'])
+    starts = np.flatnonzero(position == 0)
+    ends = np.r_[starts[1:], len(full_data)] - 1
+
+    # One outcome lookup per patient, not per row
+    segment_ids = np.asarray(full_data['patient_id'].to_numpy()[starts], dtype=str)
+    outcome_rows = pd.Index(np.asarray(outcomes['patient_id'], dtype=str)).get_indexer(segment_ids)
+    if (outcome_rows < 0).any():
+        missing = segment_ids[outcome_rows < 0]
+        raise ValueError(f"No outcome for {len(missing)} patients, e.g. {missing[0]}")
+    failed = outcomes['failed'].to_numpy()[outcome_rows] == 1
+    treatment_number = full_data['treatment_number'].to_numpy()
+    end_of_follow_up = np.where(failed, outcomes['failure_treatment_number'].to_numpy()[outcome_rows],
+                                treatment_number[ends])
+
+    time_to_event = (end_of_follow_up[codes] - treatment_number).astype(np.int32)
+    event = failed[codes]
+    at_risk = ~event | (time_to_event > 0)
+    labels = {'time_to_event': time_to_event, 'event': event.astype(np.int8), 'at_risk': at_risk}
+    for horizon in horizons:
+        labels[label_column(horizon)] = (event & at_risk & (time_to_event <= horizon)).astype(np.int8)
+    return pd.DataFrame(labels, index=full_data.index)
+
+
+def label_rows(full_data, outcomes, horizon=HORIZON, warmup=WARMUP_TREATMENTS):
+    """Return (keep, label) arrays for full_data: rows past the warm-up, failure within `horizon`."""
+    label = build_labels(full_data, outcomes, [horizon])[label_column(horizon)].to_numpy()
+    return full_data['treatment_number'].to_numpy() >= warmup, label
@@ -0,0 +1,92 @@
+"""Patient-grouped validation and hyperparameter search for the RandomForest.
+
+Consecutive treatments of one patient are nearly identical, so a row-level
+split puts copies of test rows in the training set and inflates every metric.
+All splits here come from StratifiedGroupKFold on patient_id: each patient's
+treatments stay on one side of every split while the label balance is kept.
+
+search() runs successive halving (HalvingRandomSearchCV): every candidate is
+first fitted on a small share of the training rows (or trees) and only the
+best 1/factor move on to the next, larger round, so weak configurations stop
+early. Folds x candidates are fitted in parallel by joblib, which hands large
+arrays to its workers memory-mapped: with X as one float32 matrix (see
+train.load_training_matrices()) every fit shares one copy and only the fold
+index arrays differ.
+"""
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingRandomSearchCV, StratifiedGroupKFold
+
+N_SPLITS = 5
+
+# RandomForest settings sampled by search()
+SEARCH_SPACE = {
+    'n_estimators': [100, 200, 300],
+    'max_depth': [8, 12, 15, 20, None],
+    'min_samples_split': [2, 10, 20, 50],
+    'min_samples_leaf': [1, 5, 10, 20, 50],
+    'max_features': ['sqrt', 0.3, 0.5],
+    'class_weight': ['balanced', 'balanced_subsample', None],
+}
+
+
+def patient_folds(y, groups, n_splits=N_SPLITS, random_state=42):
+    """(train_idx, test_idx) pairs with every patient (group) in exactly one test fold."""
+    splitter = StratifiedGroupKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    return list(splitter.split(np.zeros(len(y)), y, groups))
+
+
+def patient_train_test_split(y, groups, test_size=0.2, random_state=42):
+    """Hold out about `test_size` of the patients, stratified by label; returns (train_idx, test_idx)."""
+    splitter = StratifiedGroupKFold(n_splits=max(2, round(1 / test_size)), shuffle=True,
+                                    random_state=random_state)
+    return next(splitter.split(np.zeros(len(y)), y, groups))
+
+
+def search(X, y, groups, base_params, n_candidates=30, factor=3, resource='n_samples', n_splits=N_SPLITS,
+           n_jobs=-1, random_state=42, verbose=0):
+    """Successive-halving random search over SEARCH_SPACE, scored by ROC AUC on patient-grouped folds.
+
+    resource='n_samples' grows the number of training rows per round (up to
+    every row of each training fold); resource='n_estimators' grows the forest
+    instead. Each forest is single-threaded; the parallelism is across
+    folds x candidates. Returns the fitted HalvingRandomSearchCV (refit=False).
+    """
+    param_space = dict(SEARCH_SPACE)
+    halving = {'min_resources': 'exhaust'}
+    if resource == 'n_estimators':
+        max_trees = max(param_space.pop('n_estimators'))
+        halving = {'max_resources': max_trees, 'min_resources': max(10, max_trees // factor ** 3)}
+
+    estimator = RandomForestClassifier(**{**base_params, 'n_jobs': 1, 'random_state': random_state})
+    halving_search = HalvingRandomSearchCV(
+        estimator, param_space, n_candidates=n_candidates, factor=factor, resource=resource,
+        cv=patient_folds(y, groups, n_splits, random_state), scoring='roc_auc', refit=False,
+        n_jobs=n_jobs, random_state=random_state, verbose=verbose, **halving,
+    )
+    return halving_search.fit(X, y)
+
+
+def summarize(halving_search, top=10):
+    """JSON-ready summary: best parameters, per-round sizes and the top candidates of the last round."""
+    results = halving_search.cv_results_
+    last_round = results['iter'] == results['iter'].max()
+    order = np.argsort(-np.where(last_round, results['mean_test_score'], -np.inf))[:min(top, last_round.sum())]
+
+    def plain(value):
+        return value.item() if isinstance(value, np.generic) else value
+
+    return {
+        'best_params': {key: plain(value) for key, value in halving_search.best_params_.items()},
+        'best_score': float(halving_search.best_score_),
+        'scoring': 'roc_auc',
+        'resource': halving_search.resource,
+        'n_candidates': [int(n) for n in halving_search.n_candidates_],
+        'n_resources': [int(n) for n in halving_search.n_resources_],
+        'top_candidates': [{
+            'params': {key: plain(value) for key, value in results['params'][i].items()},
+            'mean_test_score': float(results['mean_test_score'][i]),
+            'std_test_score': float(results['std_test_score'][i]),
+        } for i in order],
+    }
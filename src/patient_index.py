@@ -0,0 +1,51 @@
+"""Per-patient row lookups for the Patient Detail page.
+
+Filtering full_data, patients and outcomes with `df['patient_id'] == pid`
+scans every row of every table on each Streamlit rerun. full_data is sorted
+by patient and treatment, so each patient's history is one contiguous block
+of rows; PatientIndex records the block offsets once (plus each patient's row
+in patients and outcomes) and every lookup after that is a dict hit and an
+iloc slice, proportional to the patient's history rather than the cohort.
+"""
+import numpy as np
+
+from src.features import segment_positions
+
+
+class PatientIndex:
+    """Row offsets of every patient in patients, outcomes and the sorted full_data.
+
+    The frames are kept by reference; history(), patient() and outcome()
+    return slices or rows of them and must not be modified.
+    """
+
+    def __init__(self, patients, outcomes, full_data):
+        self.patients = patients
+        self.outcomes = outcomes
+        self.full_data = full_data
+
+        codes, position = segment_positions(full_data['patient_id'])
+        treatment_number = full_data['treatment_number'].to_numpy()
+        if not (np.diff(treatment_number)[np.diff(codes) == 0] > 0).all():
+            raise ValueError("full_data must be sorted by patient_id and treatment_number")
+        starts = np.flatnonzero(position == 0)
+        ends = np.r_[starts[1:], len(full_data)]
+        self._history = {patient_id: slice(start, end) for patient_id, start, end
+                         in zip(full_data['patient_id'].iloc[starts].tolist(), starts.tolist(), ends.tolist())}
+        self._patient_rows = {patient_id: row for row, patient_id in enumerate(patients['patient_id'])}
+        self._outcome_rows = {patient_id: row for row, patient_id in enumerate(outcomes['patient_id'])}
+        self.patient_ids = sorted(self._patient_rows)
+
+    def history_rows(self, patient_id):
+        """Slice of full_data (and of any row-aligned frame) holding the patient's treatments."""
+        return self._history[patient_id]
+
+    def history(self, patient_id):
+        """The patient's full_data rows in treatment order."""
+        return self.full_data.iloc[self._history[patient_id]]
+
+    def patient(self, patient_id):
+        return self.patients.iloc[self._patient_rows[patient_id]]
+
+    def outcome(self, patient_id):
+        return self.outcomes.iloc[self._outcome_rows[patient_id]]
@@ -0,0 +1,122 @@
+"""Precomputed risk scores so dashboard reruns do no inference.
+
+Streamlit reruns app.py from the top on every interaction. Instead of scoring
+the latest treatments there, the dashboard reads a RiskTable: the risk score of
+every treatment in full_data plus each patient's latest treatment and score.
+The scores are computed once and cached in data/cache/ under a key built from
+the feature cache key and the model file's fingerprint, so replacing the model
+or regenerating the raw data yields a new key and the table is rebuilt on
+first use; otherwise pages only look scores up.
+
+Next to the scores the table caches what drives them: the per-feature
+contributions (src/explanations.py) to each patient's latest risk score,
+computed in one batch with the scores.
+
+The table is built with the pickled sklearn model on every core: scoring the
+whole history is the large-batch case where the single-threaded compiled
+.forest export is several times slower. The .forest is served
+(serving_model_path()) where rows are scored or explained a few at a time,
+live sessions and on-demand explanations: it is memory-mapped, so loading it
+is instant and every dashboard process shares one copy.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+from src.compiled_forest import COMPILED_SUFFIX, read_header
+from src.explanations import explain
+from src.feature_cache import file_fingerprints, prune_cache, read_cached_frame, write_cached_frame
+from src.features import join_patient_features, segment_positions
+from src.instrumentation import timed
+from src.scoring import DEFAULT_BATCH_SIZE, MODEL_PATH, load_model, score_frame
+from src.utils import CACHE_DIR
+
+# Bump whenever the content of the cached table changes
+RISK_TABLE_VERSION = 2
+
+_CACHE_PREFIX = 'risk_scores-'
+_CONTRIBUTIONS_PREFIX = 'risk_contributions-'
+
+
+def serving_model_path(model_path=MODEL_PATH, cache_dir=CACHE_DIR):
+    """The model's .forest export if it exists and was made from this pickle, else the pickle itself."""
+    compiled_path = Path(model_path).with_suffix(COMPILED_SUFFIX)
+    try:
+        source_digest = read_header(compiled_path)[0]['source_digest']
+    except (OSError, ValueError):
+        return Path(model_path)
+    if source_digest != file_fingerprints([model_path], cache_dir)[0]['digest']:
+        return Path(model_path)
+    return compiled_path
+
+
+def risk_table_key(data_key, model_path=MODEL_PATH, cache_dir=CACHE_DIR):
+    """Key of the risk table for a feature cache key and the model file currently on disk."""
+    model = file_fingerprints([model_path], cache_dir)[0]
+    payload = {'data': data_key, 'model': [model['size'], model['digest']], 'version': RISK_TABLE_VERSION}
+    return hashlib.blake2b(json.dumps(payload).encode(), digest_size=16).hexdigest()
+
+
+class RiskTable:
+    """Risk scores for every treatment in full_data, with per-patient lookups.
+
+    history has patient_id, treatment_number and risk_score (failure
+    probability in %) row-aligned with full_data. latest is each patient's
+    last full_data row with its risk_score added, joined with the patient's
+    row of patient_features if full_data only has the treatment-level
+    columns; contributions (set by load_risk_table()) holds the per-feature
+    contributions to those scores, row-aligned with latest.
+    """
+
+    def __init__(self, full_data, history, key, contributions=None, patient_features=None):
+        self.key = key
+        self.history = history
+        self.contributions = contributions
+
+        # full_data is sorted by patient and treatment, so a patient's last row is their latest
+        codes, _ = segment_positions(full_data['patient_id'])
+        is_last = np.r_[codes[1:] != codes[:-1], True]
+        latest = full_data[is_last]
+        if patient_features is not None:
+            latest = join_patient_features(latest, patient_features)
+        self.latest = latest.assign(risk_score=history['risk_score'].to_numpy()[is_last])
+        self._latest_row = {patient_id: row for row, patient_id in enumerate(self.latest['patient_id'])}
+
+    def latest_row(self, patient_id):
+        """Position of the patient's row in latest (and contributions)."""
+        return self._latest_row[patient_id]
+
+    def latest_risk(self, patient_id):
+        """Risk score (%) at the patient's most recent treatment."""
+        return self.latest['risk_score'].iat[self._latest_row[patient_id]]
+
+
+@timed(rows=lambda risk_table: len(risk_table.history))
+def load_risk_table(full_data, key, model_path=MODEL_PATH, cache_dir=CACHE_DIR, batch_size=DEFAULT_BATCH_SIZE,
+                    patient_features=None, n_jobs=-1):
+    """Return the RiskTable for `key` (from risk_table_key()), scoring and explaining only on a cache miss.
+
+    model_path is the pickled model, scored with n_jobs; patient_features goes
+    with a treatment-level full_data, as in score_frame().
+    """
+    cache_path = Path(cache_dir) / f'{_CACHE_PREFIX}{key}.arrow'
+    contributions_path = Path(cache_dir) / f'{_CONTRIBUTIONS_PREFIX}{key}.arrow'
+    model = None
+
+    history = read_cached_frame(cache_path) if cache_path.exists() else None
+    if history is None or len(history) != len(full_data):
+        model = load_model(model_path, n_jobs)
+        history = score_frame(model, full_data, batch_size, patient_features)
+        write_cached_frame(history, cache_path)
+        prune_cache(cache_dir, _CACHE_PREFIX, keep=cache_path)
+    risk_table = RiskTable(full_data, history, key, patient_features=patient_features)
+
+    contributions = read_cached_frame(contributions_path) if contributions_path.exists() else None
+    if contributions is None or len(contributions) != len(risk_table.latest):
+        contributions = explain(model or load_model(model_path, n_jobs), risk_table.latest).reset_index(drop=True)
+        write_cached_frame(contributions, contributions_path)
+        prune_cache(cache_dir, _CONTRIBUTIONS_PREFIX, keep=contributions_path)
+    risk_table.contributions = contributions
+    return risk_table
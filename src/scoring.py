@@ -0,0 +1,186 @@
+"""Batch scoring of dialysis sessions with the trained RandomForest model.
+
+Scores a whole cohort (or a backlog of sessions) outside the dashboard:
+
+    python -m src.scoring                                   # raw tables in data/raw
+    python -m src.scoring --features data/cache/full_data-<key>.arrow
+    python -m src.scoring --batch-size 100000 --n-jobs 8 --output results/risk_scores.parquet
+
+The model is loaded once. Raw treatments are streamed in chunks of whole
+patient histories (the generator writes each patient's sessions contiguously),
+so the rolling features see every earlier session; an engineered feature
+file (Parquet or Arrow/Feather with MODEL_FEATURES) is streamed as is, with
+the patient-level features joined from the raw tables in --data-dir if it
+only holds treatment-level ones (like the dashboard's feature cache).
+--model also accepts a compiled .forest file (src/compiled_forest.py): it
+loads instantly and is shared between processes, but scores single-threaded
+and is slower than sklearn on large batches.
+Scores are written as patient_id, treatment_number, risk_score (failure
+probability in %, as on the dashboard) to a Parquet or Feather file.
+"""
+import argparse
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.compiled_forest import COMPILED_SUFFIX, CompiledForest
+from src.features import (MODEL_FEATURES, PATIENT_FEATURES, build_full_data, build_patient_features,
+                          join_patient_features)
+from src.instrumentation import timed
+from src.storage import RAW_DATA_DIR, iter_patient_batches, read_table
+from src.utils import MODELS_DIR, RESULTS_DIR, atomic_write
+
+MODEL_PATH = MODELS_DIR / 'rf_avf_failure_model.pkl'
+
+DEFAULT_BATCH_SIZE = 50_000
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+# Raw treatment columns needed to rebuild MODEL_FEATURES
+SCORING_COLUMNS = [
+    'patient_id', 'treatment_number', 'access_blood_flow_qa', 'venous_pressure_mean',
+    'svpr', 'access_recirculation_pct', 'ktv', 'high_vp_alarms', 'low_ap_alarms',
+]
+
+SCORE_SCHEMA = pa.schema([
+    ('patient_id', pa.string()),
+    ('treatment_number', pa.int32()),
+    ('risk_score', pa.float32()),
+])
+
+
+@timed()
+def load_model(path=MODEL_PATH, n_jobs=None):
+    """Load the pickled model, optionally overriding its n_jobs for prediction.
+
+    A .forest file is memory-mapped as a CompiledForest instead (n_jobs does not apply).
+    """
+    if Path(path).suffix == COMPILED_SUFFIX:
+        return CompiledForest.load(path)
+    model = joblib.load(path)
+    if n_jobs is not None:
+        model.n_jobs = n_jobs
+    return model
+
+
+@timed(rows=len)
+def score_frame(model, features, batch_size=DEFAULT_BATCH_SIZE, patient_features=None):
+    """Risk scores (failure probability in %) for every row of a frame with MODEL_FEATURES.
+
+    With patient_features (build_patient_features()), `features` only needs
+    the treatment-level MODEL_FEATURES and each batch is joined with its
+    patients' PATIENT_FEATURES. predict_proba runs on at most batch_size rows
+    at a time to bound its working memory. Returns patient_id (dtype
+    unchanged), treatment_number and risk_score, in the row order of `features`.
+    """
+    if patient_features is None:
+        X = features[MODEL_FEATURES]
+    else:
+        X = features[['patient_id'] + [column for column in MODEL_FEATURES if column not in PATIENT_FEATURES]]
+    probabilities = np.empty(len(X), dtype='float32')
+    for start in range(0, len(X), batch_size):
+        batch = X.iloc[start:start + batch_size]
+        if patient_features is not None:
+            batch = join_patient_features(batch, patient_features, PATIENT_FEATURES)[MODEL_FEATURES]
+        probabilities[start:start + batch_size] = model.predict_proba(batch)[:, 1]
+    return pd.DataFrame({
+        'patient_id': features['patient_id'].array,
+        'treatment_number': features['treatment_number'].to_numpy(dtype='int32'),
+        'risk_score': probabilities * 100,
+    })
+
+
+def iter_raw_feature_chunks(data_dir=RAW_DATA_DIR, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield engineered feature frames for whole patients, about chunk_rows sessions at a time."""
+    patients = read_table('patients', data_dir=data_dir)
+    outcomes = read_table('outcomes', ['patient_id', 'failed'], data_dir)
+    for treatments in iter_patient_batches(SCORING_COLUMNS, chunk_rows, data_dir,
+                                           patients['patient_id'].cat.categories):
+        yield build_full_data(patients, treatments, outcomes)
+
+
+def iter_feature_file_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS, data_dir=RAW_DATA_DIR):
+    """Yield chunks of an engineered feature file (Parquet, or Arrow IPC/Feather).
+
+    A file without the PATIENT_FEATURES gets them joined from the patients and
+    outcomes tables in data_dir.
+    """
+    path = Path(path)
+    fmt = 'parquet' if path.suffix == '.parquet' else 'ipc'
+    dataset = ds.dataset(path, format=fmt)
+    columns = [column for column in MODEL_FEATURES if column in dataset.schema.names]
+    patient_features = None
+    if not set(PATIENT_FEATURES) <= set(columns):
+        columns = [column for column in columns if column not in PATIENT_FEATURES]
+        patient_features = build_patient_features(read_table('patients', data_dir=data_dir),
+                                                  read_table('outcomes', ['patient_id', 'failed'], data_dir))
+    for batch in dataset.to_batches(columns=['patient_id', 'treatment_number'] + columns, batch_size=chunk_rows):
+        if batch.num_rows:
+            chunk = batch.to_pandas()
+            yield chunk if patient_features is None else join_patient_features(chunk, patient_features,
+                                                                              PATIENT_FEATURES)
+
+
+def _open_writer(path, fmt):
+    if fmt == 'parquet':
+        return pq.ParquetWriter(str(path), SCORE_SCHEMA, compression='zstd')
+    return pa.ipc.new_file(str(path), SCORE_SCHEMA)
+
+
+def score_to_file(model, chunks, output, batch_size=DEFAULT_BATCH_SIZE):
+    """Score an iterable of feature chunks and stream the results to `output`.
+
+    The file is written atomically (.parquet, or Arrow IPC/Feather for any other
+    suffix). Returns a stats dict with row counts and timings.
+    """
+    output = Path(output)
+    stats = {'rows': 0, 'chunks': 0, 'predict_seconds': 0.0}
+    start = time.perf_counter()
+    with atomic_write(output) as tmp:
+        writer = _open_writer(tmp, 'parquet' if output.suffix == '.parquet' else 'ipc')
+        try:
+            for features in chunks:
+                predict_start = time.perf_counter()
+                scores = score_frame(model, features, batch_size)
+                stats['predict_seconds'] += time.perf_counter() - predict_start
+                scores['patient_id'] = scores['patient_id'].astype(str)
+                writer.write_table(pa.Table.from_pandas(scores, schema=SCORE_SCHEMA, preserve_index=False))
+                stats['rows'] += len(scores)
+                stats['chunks'] += 1
+                print(f"  scored chunk {stats['chunks']:>5}: {stats['rows']:,} sessions")
+        finally:
+            writer.close()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score dialysis sessions with the AVF failure model.')
+    parser.add_argument('--data-dir', default=str(RAW_DATA_DIR),
+                        help='raw tables to engineer features from (with --features: to join patient features from)')
+    parser.add_argument('--features', help='engineered feature file (.parquet, .arrow or .feather)')
+    parser.add_argument('--model', default=str(MODEL_PATH), help=f'pickled forest or compiled {COMPILED_SUFFIX} file')
+    parser.add_argument('--output', default=str(RESULTS_DIR / 'risk_scores.parquet'),
+                        help='.parquet, or Arrow IPC/Feather for any other suffix')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='rows per predict_proba call')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS, help='sessions read per chunk')
+    parser.add_argument('--n-jobs', type=int, default=None, help="prediction threads (default: the model's)")
+    args = parser.parse_args()
+
+    model = load_model(args.model, args.n_jobs)
+    if args.features:
+        chunks = iter_feature_file_chunks(args.features, args.chunk_rows, args.data_dir)
+    else:
+        chunks = iter_raw_feature_chunks(args.data_dir, args.chunk_rows)
+
+    stats = score_to_file(model, chunks, args.output, args.batch_size)
+
+    print(f"\n✓ Scored {stats['rows']:,} sessions in {stats['seconds']:.1f}s "
+          f"({stats['rows'] / max(stats['seconds'], 1e-9):,.0f} rows/sec overall, "
+          f"{stats['rows'] / max(stats['predict_seconds'], 1e-9):,.0f} rows/sec in predict_proba)")
+    print(f"✓ Saved risk scores to {args.output}")
@@ -0,0 +1,206 @@
+"""Out-of-core training: float32 feature shards on disk, one forest per shard.
+
+The in-memory path (train.load_training_matrices()) needs the whole merged
+feature frame at once, which stops working once a registry has tens of
+millions of sessions. Here the raw treatments are streamed in chunks of whole
+patients (storage.iter_patient_batches()), each chunk gets its features and
+labels, and its rows are appended as float32 Parquet row groups to one of
+n_shards training shards or to the test shard. Patients, not rows, are dealt
+to shards, stratified by outcome, so every shard and the test set see the same
+failure mix and no patient is split. shard_count() picks n_shards so that no
+shard holds much more than max_shard_rows rows: bigger cohorts get more
+shards, not bigger ones, up to one shard per tree. Past n_estimators x
+max_shard_rows training rows the shards do grow, with a warning, since every
+shard needs at least one tree.
+
+fit_sharded_forest() then fits n_estimators / n_shards trees on each shard in
+a worker process, n_workers of them at a time, and concatenates their
+estimators_ into one RandomForestClassifier. Averaging trees fitted on
+disjoint patient subsets is the same bagging the forest already does, on a
+subsample instead of a bootstrap of the full data.
+
+Peak memory is the larger of the two phases (constants measured on 1.1M
+training rows with benchmarks/bench_sharded_training.py; README has the table):
+
+* sharding, in the parent: ~400 MB of libraries, patient/outcome tables and
+  the merged model, plus about 0.3-0.5 KB per row of chunk_rows for one chunk
+  through build_full_data();
+* fitting: n_workers x (~220 MB + ~0.4 KB x max_shard_rows) on top of the
+  parent. Per shard row a worker holds the float32 shard (108 bytes) plus
+  sklearn's per-tree sample weights and the fitted trees.
+
+Both bounds depend on chunk_rows, max_shard_rows and n_workers only; the
+cohort size sets how many shards are fitted, and so the fit time, not the memory.
+"""
+import math
+import multiprocessing
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sklearn.ensemble import RandomForestClassifier
+
+from src.features import MODEL_FEATURES, build_full_data
+from src.storage import RAW_DATA_DIR, iter_patient_batches, read_table
+
+TARGET = 'target'
+TEST_SHARD = -1
+
+# Default row limit per training shard: ~420 MB per fitting worker
+MAX_SHARD_ROWS = 500_000
+
+# Fitting worker memory: a fixed cost plus a cost per shard row (see the module docstring)
+WORKER_BASE_MB = 220
+WORKER_MB_PER_ROW = 0.4 / 1024
+
+SHARD_SCHEMA = pa.schema([(feature, pa.float32()) for feature in MODEL_FEATURES] + [(TARGET, pa.int8())])
+
+
+def shard_path(shard_dir, shard):
+    return Path(shard_dir) / ('test.parquet' if shard == TEST_SHARD else f'shard-{shard:03d}.parquet')
+
+
+def shard_count(n_rows, max_shard_rows=MAX_SHARD_ROWS, test_size=0.2, n_estimators=None):
+    """Training shards needed to keep each under max_shard_rows, for a cohort of n_rows treatments.
+
+    n_rows includes the held-out test patients and the warm-up sessions the
+    labels drop, so the estimate errs towards smaller shards. With
+    n_estimators the count is capped at one shard per tree, and a warning
+    gives the larger shard size and worker memory that implies.
+    """
+    train_rows = n_rows * (1 - test_size)
+    n_shards = max(1, math.ceil(train_rows / max_shard_rows))
+    if n_estimators is not None and n_shards > n_estimators:
+        shard_rows = math.ceil(train_rows / n_estimators)
+        warnings.warn(f"{n_rows:,} treatments need {n_shards} shards of {max_shard_rows:,} rows but there are only "
+                      f"{n_estimators} trees; fitting {n_estimators} shards of ~{shard_rows:,} rows, "
+                      f"~{WORKER_BASE_MB + WORKER_MB_PER_ROW * shard_rows:,.0f} MB per worker",
+                      stacklevel=2)
+        n_shards = n_estimators
+    return n_shards
+
+
+def assign_shards(outcomes, n_shards, test_size=0.2, random_state=42):
+    """Map patient_id -> shard number (TEST_SHARD for held-out patients).
+
+    Within each outcome stratum patients are shuffled; every round(1/test_size)-th
+    goes to the test set and the rest are dealt round-robin to the training shards.
+    """
+    rng = np.random.default_rng(random_state)
+    order = outcomes.iloc[rng.permutation(len(outcomes))]
+    position = order.groupby('failed', observed=True).cumcount().to_numpy()
+
+    every = max(2, round(1 / test_size))
+    is_test = position % every == 0
+    train_position = position - position // every - 1
+    shards = np.where(is_test, TEST_SHARD, train_position % n_shards)
+    return pd.Series(shards, index=order['patient_id'].astype(str).to_numpy())
+
+
+def write_shards(shard_dir, label_fn, n_shards, data_dir=RAW_DATA_DIR, chunk_rows=1_000_000, test_size=0.2,
+                 random_state=42, columns=None):
+    """Stream the cohort into float32 shard files; returns row counts per shard.
+
+    label_fn(full_data, outcomes) returns (rows_mask, target) for a chunk of
+    engineered rows, e.g. the warm-up filter and will_fail_within_30 label.
+    """
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    patients = read_table('patients', data_dir=data_dir)
+    outcomes = read_table('outcomes', ['patient_id', 'failed', 'failure_treatment_number'], data_dir)
+    patient_shards = assign_shards(outcomes, n_shards, test_size, random_state)
+
+    shards = list(range(n_shards)) + [TEST_SHARD]
+    writers = {shard: pq.ParquetWriter(shard_path(shard_dir, shard), SHARD_SCHEMA, compression='zstd')
+               for shard in shards}
+    counts = dict.fromkeys(shards, 0)
+    try:
+        for treatments in iter_patient_batches(columns, chunk_rows, data_dir, patients['patient_id'].cat.categories):
+            full_data = build_full_data(patients, treatments, outcomes[['patient_id', 'failed']])
+            keep, target = label_fn(full_data, outcomes)
+            chunk = full_data.loc[keep, MODEL_FEATURES].astype(np.float32)
+            chunk[TARGET] = np.asarray(target)[keep].astype(np.int8)
+            row_shards = patient_shards.loc[full_data.loc[keep, 'patient_id'].astype(str)].to_numpy()
+            for shard in shards:
+                rows = chunk[row_shards == shard]
+                if len(rows):
+                    writers[shard].write_table(pa.Table.from_pandas(rows, schema=SHARD_SCHEMA, preserve_index=False))
+                    counts[shard] += len(rows)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return counts
+
+
+def read_shard(path):
+    """(X, y) of one shard: X as a float32 (n_rows, n_features) array."""
+    table = pq.read_table(path)
+    X = np.empty((table.num_rows, len(MODEL_FEATURES)), dtype=np.float32)
+    for i, feature in enumerate(MODEL_FEATURES):
+        X[:, i] = table.column(feature).to_numpy()
+    return X, table.column(TARGET).to_numpy()
+
+
+def iter_shard_batches(path, batch_rows=1_000_000):
+    """Yield (X, y) batches of a shard without loading all of it."""
+    for batch in pq.ParquetFile(path).iter_batches(batch_rows):
+        X = np.column_stack([batch.column(feature).to_numpy() for feature in MODEL_FEATURES])
+        yield X, batch.column(TARGET).to_numpy()
+
+
+def _peak_rss_mb():
+    # VmHWM belongs to this process's own address space; ru_maxrss of a spawned
+    # worker still carries the parent's peak from the fork that preceded exec
+    try:
+        with open('/proc/self/status') as status:
+            return next(int(line.split()[1]) for line in status if line.startswith('VmHWM')) / 2**10
+    except OSError:
+        return float('nan')
+
+
+def _fit_shard(task):
+    path, params, n_estimators, seed = task
+    X, y = read_shard(path)
+    forest = RandomForestClassifier(**{**params, 'n_estimators': n_estimators, 'random_state': seed, 'n_jobs': 1})
+    return forest.fit(X, y), _peak_rss_mb()
+
+
+def merge_forests(forests, n_jobs=None):
+    """Concatenate the trees of forests fitted on the same features and classes."""
+    merged = forests[0]
+    for forest in forests[1:]:
+        if not np.array_equal(forest.classes_, merged.classes_):
+            raise ValueError(f"Cannot merge forests with classes {forest.classes_} and {merged.classes_}")
+        merged.estimators_ += forest.estimators_
+    merged.n_estimators = len(merged.estimators_)
+    merged.feature_names_in_ = np.asarray(MODEL_FEATURES, dtype=object)
+    if n_jobs is not None:
+        merged.n_jobs = n_jobs
+    return merged
+
+
+def fit_sharded_forest(shard_dir, n_shards, params, n_workers=1, random_state=42):
+    """Fit params['n_estimators'] trees split evenly over the shards, one worker process per shard.
+
+    At most n_workers shards are fitted at once, and each concurrent worker
+    adds its shard's memory to the peak (see the module docstring). Returns
+    (forest, worker_peak_rss_mb): the merged forest and each worker's peak
+    resident memory (NaN where /proc is unavailable).
+    """
+    n_trees = params['n_estimators']
+    if n_trees < n_shards:
+        raise ValueError(f"n_estimators={n_trees} is smaller than n_shards={n_shards}; "
+                         "raise max_shard_rows or n_estimators")
+    seeds = np.random.SeedSequence(random_state).generate_state(n_shards)
+    tasks = [(shard_path(shard_dir, shard), params, n_trees // n_shards + (shard < n_trees % n_shards),
+              int(seeds[shard])) for shard in range(n_shards)]
+    # Spawned, not forked: workers start small instead of inheriting the parent's sharding-phase memory.
+    # One shard per process, so no worker carries an earlier shard's freed memory into the next.
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'),
+                             max_tasks_per_child=1) as pool:
+        forests, peaks = zip(*pool.map(_fit_shard, tasks))
+    return merge_forests(list(forests), params.get('n_jobs')), list(peaks)
@@ -0,0 +1,327 @@
+"""Reading and writing the raw patient, treatment and outcome tables.
+
+The generator can write each table as CSV (the original format), Parquet or
+Feather (Arrow IPC). The columnar formats are written with the compact dtypes
+in TABLE_DTYPES, and read_table() prefers them over CSV when both exist, so the
+dashboard and notebook only pay for CSV parsing when nothing better is on disk.
+
+CSV files are read with TABLE_DTYPES too, so every format yields the same
+float32 vitals and the features engineered from them do not depend on the
+format. They do differ, by about one float32 ulp on many rows, from features
+built on the float64 vitals the tables were read with before; models trained
+that way should be retrained (src/train.py reads through read_table(), so
+anything it trains matches what the dashboard scores).
+"""
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from src.instrumentation import timed
+from src.utils import DATA_DIR
+
+RAW_DATA_DIR = DATA_DIR / 'raw'
+
+# Raw tables written by the generator and read by the app and notebook
+TABLE_FILES = {
+    'patients': 'patients_baseline',
+    'treatments': 'treatments_baseline',
+    'outcomes': 'outcomes_baseline',
+}
+
+FORMATS = ('csv', 'parquet', 'feather')
+
+# Columnar formats first: read_table() uses the first one found on disk
+_READ_PREFERENCE = ('parquet', 'feather', 'csv')
+
+_COMPRESSION = 'zstd'
+
+# Compact dtypes for every raw column. 'category' columns are stored as plain
+# strings (dictionary-encoded by Parquet) and become categoricals on read.
+TABLE_DTYPES = {
+    'patients': {
+        'patient_id': 'category',
+        'age': 'int16',
+        'sex': 'category',
+        'diabetes': 'int8',
+        'hypertension': 'int8',
+        'cad': 'int8',
+        'pvd': 'int8',
+        'prior_interventions': 'int8',
+        'history_cvc': 'int8',
+        'baseline_risk_score': 'float32',
+        'clinic_id': 'category',
+    },
+    'treatments': {
+        'patient_id': 'category',
+        'treatment_number': 'int32',
+        'treatment_date': 'datetime64[ns]',
+        'access_blood_flow_qa': 'float32',
+        'arterial_pressure_mean': 'float32',
+        'venous_pressure_mean': 'float32',
+        'map': 'float32',
+        'svpr': 'float32',
+        'high_vp_alarms': 'int16',
+        'low_ap_alarms': 'int16',
+        'access_recirculation_pct': 'float32',
+        'ktv': 'float32',
+    },
+    'outcomes': {
+        'patient_id': 'category',
+        'failed': 'int8',
+        'failure_treatment_number': 'float32',
+        'baseline_risk_score': 'float32',
+        'mean_qa': 'float32',
+        'min_qa': 'float32',
+        'final_qa': 'float32',
+        'mean_svpr': 'float32',
+        'max_svpr': 'float32',
+        'mean_recirculation': 'float32',
+        'total_alarms': 'int32',
+    },
+}
+
+
+def _storage_dtypes(table):
+    """Dtypes used on disk: categoricals are written as strings."""
+    return {column: ('str' if dtype == 'category' else dtype)
+            for column, dtype in TABLE_DTYPES[table].items()}
+
+
+def _to_arrow(table, frame):
+    dtypes = {column: dtype for column, dtype in _storage_dtypes(table).items() if column in frame}
+    return pa.Table.from_pandas(frame.astype(dtypes), preserve_index=False)
+
+
+def _apply_read_dtypes(table, frame):
+    dtypes = {column: dtype for column, dtype in TABLE_DTYPES[table].items()
+              if column in frame and frame[column].dtype != dtype}
+    return frame.astype(dtypes) if dtypes else frame
+
+
+def write_table(table, frame, path, fmt):
+    """Write one complete table (or partition) in `fmt` with the compact dtypes."""
+    if fmt == 'csv':
+        frame.to_csv(path, index=False)
+    elif fmt == 'parquet':
+        pq.write_table(_to_arrow(table, frame), path, compression=_COMPRESSION)
+    else:
+        feather.write_feather(_to_arrow(table, frame), path, compression=_COMPRESSION)
+
+
+def table_path(table, fmt, data_dir=RAW_DATA_DIR):
+    """Path of a single-file table, e.g. data/raw/treatments_baseline.parquet."""
+    return Path(data_dir) / f'{TABLE_FILES[table]}.{fmt}'
+
+
+def find_table(table, data_dir=RAW_DATA_DIR):
+    """Return (path, fmt) of the preferred copy of a table on disk.
+
+    Single files win over a partition directory (<table>/part-*.<fmt>) of the
+    same format, and columnar formats win over CSV.
+    """
+    data_dir = Path(data_dir)
+    for fmt in _READ_PREFERENCE:
+        path = table_path(table, fmt, data_dir)
+        if path.exists():
+            return path, fmt
+        partition_dir = data_dir / TABLE_FILES[table]
+        if any(partition_dir.glob(f'part-*.{fmt}')):
+            return partition_dir, fmt
+    raise FileNotFoundError(f"No {TABLE_FILES[table]} table (csv, parquet or feather) in {data_dir}")
+
+
+@timed(rows=len)
+def read_table(table, columns=None, data_dir=RAW_DATA_DIR):
+    """Read one raw table with compact dtypes, loading only `columns` if given."""
+    path, fmt = find_table(table, data_dir)
+    parts = sorted(path.glob(f'part-*.{fmt}')) if path.is_dir() else [path]
+
+    if fmt == 'parquet':
+        # Decode patient_id/sex straight into categoricals
+        categories = [column for column, dtype in TABLE_DTYPES[table].items()
+                      if dtype == 'category' and (columns is None or column in columns)]
+        frame = pq.read_table(parts if path.is_dir() else path, columns=columns,
+                              read_dictionary=categories).to_pandas(split_blocks=True, self_destruct=True)
+    elif fmt == 'feather':
+        frame = pd.concat([feather.read_feather(part, columns=columns) for part in parts],
+                          ignore_index=True)
+    else:
+        dtypes = {column: dtype for column, dtype in TABLE_DTYPES[table].items()
+                  if dtype not in ('category', 'datetime64[ns]')}
+        parse_dates = [column for column, dtype in TABLE_DTYPES[table].items()
+                       if dtype == 'datetime64[ns]' and (columns is None or column in columns)]
+        frame = pd.concat([pd.read_csv(part, usecols=columns, dtype=dtypes, parse_dates=parse_dates)
+                           for part in parts], ignore_index=True)
+
+    return _apply_read_dtypes(table, frame)
+
+
+def count_rows(table, data_dir=RAW_DATA_DIR):
+    """Number of rows in a raw table: from the Parquet footers, or by streaming one column."""
+    path, fmt = find_table(table, data_dir)
+    if fmt == 'parquet':
+        parts = sorted(path.glob('part-*.parquet')) if path.is_dir() else [path]
+        return sum(pq.ParquetFile(part).metadata.num_rows for part in parts)
+    return sum(len(batch) for batch in iter_table_batches(table, ['patient_id'], data_dir=data_dir))
+
+
+def iter_table_batches(table, columns=None, batch_rows=1_000_000, data_dir=RAW_DATA_DIR):
+    """Yield a raw table in file order as DataFrames of at most `batch_rows` rows.
+
+    Only one batch is held in memory at a time. Categorical columns are
+    categorical within each batch, but batches do not share a category set.
+    """
+    path, fmt = find_table(table, data_dir)
+    parts = sorted(path.glob(f'part-*.{fmt}')) if path.is_dir() else [path]
+    categories = [column for column, dtype in TABLE_DTYPES[table].items()
+                  if dtype == 'category' and (columns is None or column in columns)]
+
+    for part in parts:
+        if fmt == 'parquet':
+            batches = pq.ParquetFile(part, read_dictionary=categories).iter_batches(batch_rows, columns=columns)
+        elif fmt == 'feather':
+            # One record batch per generator chunk; decompress them one at a time
+            reader = pa.ipc.open_file(pa.memory_map(str(part)))
+            batches = (sliced for i in range(reader.num_record_batches)
+                       for sliced in pa.Table.from_batches([reader.get_batch(i)])
+                       .select(columns or reader.schema.names).to_batches(max_chunksize=batch_rows))
+        else:
+            dtypes = {column: dtype for column, dtype in TABLE_DTYPES[table].items()
+                      if dtype not in ('category', 'datetime64[ns]')}
+            parse_dates = [column for column, dtype in TABLE_DTYPES[table].items()
+                           if dtype == 'datetime64[ns]' and (columns is None or column in columns)]
+            for frame in pd.read_csv(part, usecols=columns, dtype=dtypes, parse_dates=parse_dates,
+                                     chunksize=batch_rows):
+                yield _apply_read_dtypes(table, frame)
+            continue
+
+        for batch in batches:
+            yield _apply_read_dtypes(table, batch.to_pandas(split_blocks=True))
+
+
+def iter_patient_batches(columns=None, batch_rows=1_000_000, data_dir=RAW_DATA_DIR, patient_ids=None):
+    """Yield the treatments table in batches of whole patient histories.
+
+    Relies on each patient's sessions being contiguous on disk, as the
+    generator writes them. A patient whose sessions straddle two file batches
+    is held back and emitted with the next batch, so a batch can exceed
+    batch_rows by one patient. patient_id is categorical over `patient_ids`
+    (by default whatever each batch contains).
+    """
+    carry = None
+    for batch in iter_table_batches('treatments', columns, batch_rows, data_dir):
+        if patient_ids is not None:
+            batch['patient_id'] = pd.Categorical(batch['patient_id'], categories=patient_ids)
+        if carry is not None:
+            batch = pd.concat([carry, batch], ignore_index=True)
+
+        # The last patient may continue in the next batch: hold their sessions back
+        is_last = (batch['patient_id'] == batch['patient_id'].iloc[-1]).to_numpy()
+        carry = batch[is_last]
+        if not is_last.all():
+            yield batch[~is_last]
+
+    if carry is not None:
+        yield carry
+
+
+@timed(rows=lambda tables: len(tables[1]))
+def load_raw_tables(columns=None, data_dir=RAW_DATA_DIR):
+    """Read patients, treatments and outcomes with a shared patient_id category set.
+
+    `columns` optionally maps table name -> list of columns to load. Sharing the
+    categories keeps patient_id categorical through merges between the tables.
+    """
+    columns = columns or {}
+    tables = {table: read_table(table, columns.get(table), data_dir) for table in TABLE_FILES}
+    unify_patient_ids(*tables.values())
+    return tables['patients'], tables['treatments'], tables['outcomes']
+
+
+def unify_patient_ids(*frames):
+    """Give the categorical patient_id of every frame the same category set, in place."""
+    frames = [frame for frame in frames if 'patient_id' in frame]
+    patient_ids = frames[0]['patient_id'].cat.categories
+    for frame in frames[1:]:
+        if not patient_ids.equals(frame['patient_id'].cat.categories):
+            patient_ids = patient_ids.union(frame['patient_id'].cat.categories)
+    for frame in frames:
+        if not patient_ids.equals(frame['patient_id'].cat.categories):
+            frame['patient_id'] = frame['patient_id'].cat.set_categories(patient_ids)
+
+
+class CohortWriter:
+    """Appends per-chunk patient, treatment and outcome frames to the raw tables.
+
+    Single-file output appends to <table>.csv, or streams row groups /
+    record batches into <table>.parquet / <table>.feather. With partitioned=True
+    each chunk is written as <table>/part-NNNNN.<fmt> instead.
+    """
+
+    def __init__(self, output_dir, fmt='csv', partitioned=False):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt!r}; expected one of {FORMATS}")
+        self.output_dir = Path(output_dir)
+        self.fmt = fmt
+        self.partitioned = partitioned
+        self.chunks_written = 0
+        self._writers = {}
+
+        # Replace every existing copy of the tables, in any format, so a stale
+        # file can never shadow the new one in find_table()
+        for table_file in TABLE_FILES.values():
+            table_dir = self.output_dir / table_file
+            for old_fmt in FORMATS:
+                (self.output_dir / f'{table_file}.{old_fmt}').unlink(missing_ok=True)
+                for part in table_dir.glob(f'part-*.{old_fmt}'):
+                    part.unlink()
+            if partitioned:
+                table_dir.mkdir(parents=True, exist_ok=True)
+
+    def write(self, patients, treatments, outcomes):
+        for table, frame in (('patients', patients), ('treatments', treatments), ('outcomes', outcomes)):
+            if self.partitioned:
+                write_table(table, frame, self.output_dir / TABLE_FILES[table]
+                            / f'part-{self.chunks_written:05d}.{self.fmt}', self.fmt)
+            else:
+                self._append(table, frame)
+        self.chunks_written += 1
+
+    def _append(self, table, frame):
+        path = table_path(table, self.fmt, self.output_dir)
+        if self.fmt == 'csv':
+            frame.to_csv(path, mode='a', header=self.chunks_written == 0, index=False)
+            return
+
+        arrow_table = _to_arrow(table, frame)
+        writer = self._writers.get(table)
+        if writer is None:
+            if self.fmt == 'parquet':
+                writer = pq.ParquetWriter(path, arrow_table.schema, compression=_COMPRESSION)
+            else:
+                writer = pa.ipc.new_file(path, arrow_table.schema,
+                                         options=pa.ipc.IpcWriteOptions(compression=_COMPRESSION))
+            self._writers[table] = writer
+        writer.write_table(arrow_table)
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def convert_tables(fmt, data_dir=RAW_DATA_DIR):
+    """Rewrite existing raw tables (e.g. the CSVs) as single-file `fmt` tables."""
+    for table in TABLE_FILES:
+        path = table_path(table, fmt, data_dir)
+        write_table(table, read_table(table, data_dir=data_dir), path, fmt)
+        print(f"✓ Wrote {path}")
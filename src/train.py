@@ -0,0 +1,376 @@
+"""Train the AVF failure model from the raw tables.
+
+Run from the repository root:
+
+    python -m src.train
+    python -m src.train --data-dir data/raw --n-jobs -1 --seed 42
+
+    python -m src.train --search --n-candidates 30   # successive-halving search first
+    python -m src.train --params results/model_selection.json
+    python -m src.train --out-of-core --max-shard-rows 250000   # cohorts larger than RAM
+    python -m src.train --horizon 7 14 30 60                    # one model per horizon
+
+Builds the will_fail_within_30 dataset (labels from src/labels.py) with the
+same feature code the dashboard uses, holds out a patient-grouped test set (no patient has rows on
+both sides), fits the RandomForest on all cores and writes the model (pickle
+plus its memory-mappable .forest export, see src/compiled_forest.py),
+results/metrics.json, feature_importance.csv, test_predictions.csv and a
+training manifest (data fingerprint, features, hyperparameters, timings, peak
+memory). Every artifact is written atomically, so the dashboard never picks up
+a half-written model. Other horizons go to rf_avf_failure_model_h{h}.pkl and
+results/horizon_{h}/, so the dashboard's 30-treatment model is untouched.
+
+The feature matrix is cached in data/cache/ as float32 .npy files and memory-
+mapped, so repeated runs and the parallel search workers share one copy. The
+labels for every horizon in HORIZONS are built and cached with it in one
+pass, so training several horizons builds the features once.
+"""
+import argparse
+import functools
+import hashlib
+import json
+import platform
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import precision_score, recall_score, roc_auc_score
+
+try:
+    import resource
+except ImportError:  # Windows: the manifest records peak_rss_mb as null
+    resource = None
+
+import src.labels
+from src.compiled_forest import COMPILED_SUFFIX, CompiledForest
+from src.feature_cache import feature_cache_key, raw_fingerprint
+from src.features import FEATURE_PIPELINE_VERSION, MODEL_FEATURES, build_full_data
+from src.labels import HORIZON, HORIZONS, WARMUP_TREATMENTS, build_labels, label_column, label_rows
+from src.model_selection import N_SPLITS, patient_train_test_split, search, summarize
+from src.scoring import MODEL_PATH, SCORING_COLUMNS
+from src.sharded_training import (MAX_SHARD_ROWS, TEST_SHARD, fit_sharded_forest, iter_shard_batches, shard_count,
+                                  shard_path, write_shards)
+from src.storage import RAW_DATA_DIR, count_rows, load_raw_tables
+from src.utils import CACHE_DIR, RESULTS_DIR, atomic_write, file_digest
+
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
+
+# Hyperparameters from the original notebook, now on all cores
+RF_PARAMS = {
+    'n_estimators': 100,
+    'max_depth': 15,
+    'min_samples_split': 20,
+    'min_samples_leaf': 10,
+    'class_weight': 'balanced',  # To handle class imbalance
+}
+
+MANIFEST_FILE = 'training_manifest.json'
+SEARCH_FILE = 'model_selection.json'
+
+# Raw columns the training dataset is built from
+TRAINING_COLUMNS = {
+    'treatments': SCORING_COLUMNS,
+    'outcomes': ['patient_id', 'failed', 'failure_treatment_number'],
+}
+
+
+def build_training_data(patients, treatments, outcomes, horizons=(HORIZON,), warmup=WARMUP_TREATMENTS):
+    """Return (modeling_data, X, labels): rows past the warm-up with time-to-event and one label per horizon."""
+    modeling_data = build_full_data(patients, treatments, outcomes)
+    labels = build_labels(modeling_data, outcomes, horizons)
+    keep = modeling_data['treatment_number'].to_numpy() >= warmup
+    modeling_data = pd.concat([modeling_data, labels], axis=1)[keep]
+    return modeling_data, modeling_data[MODEL_FEATURES], modeling_data[labels.columns]
+
+
+def load_training_matrices(data_dir=RAW_DATA_DIR, horizon=HORIZON, warmup=WARMUP_TREATMENTS, cache_dir=CACHE_DIR):
+    """Return (X, y, groups): float32 MODEL_FEATURES, labels for `horizon` and integer patient codes.
+
+    The arrays are cached as .npy files keyed by the raw data fingerprint, the
+    feature pipeline, the source of src/labels.py and the label settings, and
+    returned memory-mapped. The labels of every horizon in HORIZONS are cached
+    together (one row each), so switching between them reuses the cache.
+    """
+    horizons = sorted(set(HORIZONS) | {horizon})
+    key = hashlib.blake2b(json.dumps([feature_cache_key(TRAINING_COLUMNS, data_dir, cache_dir),
+                                      file_digest(src.labels.__file__), horizons, warmup])
+                          .encode(), digest_size=16).hexdigest()
+    paths = {name: Path(cache_dir) / f'training-{key}-{name}.npy' for name in ('X', 'y', 'groups')}
+
+    if not all(path.exists() for path in paths.values()):
+        patients, treatments, outcomes = load_raw_tables(TRAINING_COLUMNS, data_dir)
+        modeling_data, X, labels = build_training_data(patients, treatments, outcomes, horizons, warmup)
+        arrays = {
+            'X': X.to_numpy(dtype=np.float32),
+            'y': np.stack([labels[label_column(h)].to_numpy(dtype=np.int8) for h in horizons]),
+            'groups': pd.factorize(modeling_data['patient_id'])[0].astype(np.int32),
+        }
+        for name, array in arrays.items():
+            with atomic_write(paths[name]) as tmp, open(tmp, 'wb') as f:
+                np.save(f, array)
+        for stale in Path(cache_dir).glob('training-*.npy'):
+            if stale not in paths.values():
+                stale.unlink(missing_ok=True)
+
+    X, y, groups = (np.load(paths[name], mmap_mode='r') for name in ('X', 'y', 'groups'))
+    return X, y[horizons.index(horizon)], groups
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if platform.system() == 'Darwin' else peak / 2**10
+
+
+def _write_json(payload, path):
+    with atomic_write(path) as tmp:
+        tmp.write_text(json.dumps(payload, indent=2))
+
+
+def _write_csv(frame, path):
+    with atomic_write(path) as tmp:
+        frame.to_csv(tmp, index=False)
+
+
+def select_hyperparameters(data_dir=RAW_DATA_DIR, results_dir=RESULTS_DIR, n_candidates=30, factor=3,
+                           resource='n_samples', n_splits=N_SPLITS, n_jobs=-1, test_size=TEST_SIZE,
+                           random_state=RANDOM_STATE, horizon=HORIZON):
+    """Run the patient-grouped halving search on the training patients only and save the summary.
+
+    The holdout patients train() evaluates on are excluded, so the final
+    metrics stay unbiased. Returns the summary written to results/model_selection.json.
+    """
+    X, y, groups = load_training_matrices(data_dir, horizon)
+    train_idx, _ = patient_train_test_split(y, groups, test_size, random_state)
+
+    start = time.perf_counter()
+    halving_search = search(X[train_idx], y[train_idx], groups[train_idx], RF_PARAMS, n_candidates=n_candidates,
+                            factor=factor, resource=resource, n_splits=n_splits, n_jobs=n_jobs,
+                            random_state=random_state)
+    summary = summarize(halving_search)
+    summary['search_seconds'] = time.perf_counter() - start
+    _write_json(summary, Path(results_dir) / SEARCH_FILE)
+    print(f"Best CV AUC {summary['best_score']:.4f} in {summary['search_seconds']:.0f}s "
+          f"({' -> '.join(map(str, summary['n_candidates']))} candidates): {summary['best_params']}")
+    return summary
+
+
+def train(data_dir=RAW_DATA_DIR, model_path=MODEL_PATH, results_dir=RESULTS_DIR, n_jobs=-1,
+          test_size=TEST_SIZE, random_state=RANDOM_STATE, params=None, horizon=HORIZON):
+    """Build the dataset, fit the model for `horizon` and write every artifact. Returns the manifest.
+
+    `params` overrides RF_PARAMS, e.g. with the best_params of a search.
+    """
+    model_path, results_dir = Path(model_path), Path(results_dir)
+    timings = {}
+
+    start = time.perf_counter()
+    X, y, groups = load_training_matrices(data_dir, horizon)
+    timings['features_seconds'] = time.perf_counter() - start
+    print(f"Modeling dataset: {len(X):,} observations, {y.sum():,} positive ({y.mean():.1%}) "
+          f"in {timings['features_seconds']:.1f}s")
+
+    # Whole patients go to either the training or the test set
+    train_idx, test_idx = patient_train_test_split(y, groups, test_size, random_state)
+    X_train = pd.DataFrame(X[train_idx], columns=MODEL_FEATURES)
+    X_test = pd.DataFrame(X[test_idx], columns=MODEL_FEATURES)
+    y_train, y_test = y[train_idx], y[test_idx]
+
+    params = {**RF_PARAMS, **(params or {}), 'random_state': random_state, 'n_jobs': n_jobs}
+    model = RandomForestClassifier(**params)
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    timings['training_seconds'] = time.perf_counter() - start
+    print(f"Model trained in {timings['training_seconds']:.1f} seconds")
+
+    start = time.perf_counter()
+    y_pred_prob = model.predict_proba(X_test)[:, 1]
+    timings['evaluation_seconds'] = time.perf_counter() - start
+
+    split = {'grouped_by': 'patient_id', 'test_size': test_size, 'random_state': random_state,
+             'train_rows': len(X_train), 'test_rows': len(X_test),
+             'train_patients': len(np.unique(groups[train_idx])),
+             'test_patients': len(np.unique(groups[test_idx]))}
+    return _save_artifacts(model, y_test, y_pred_prob, data_dir, model_path, results_dir,
+                           {'label': _label_settings(horizon), 'hyperparameters': params, 'split': split,
+                            **timings})
+
+
+def train_out_of_core(data_dir=RAW_DATA_DIR, model_path=MODEL_PATH, results_dir=RESULTS_DIR,
+                      max_shard_rows=MAX_SHARD_ROWS, n_workers=1, chunk_rows=1_000_000, test_size=TEST_SIZE,
+                      random_state=RANDOM_STATE, params=None, shard_dir=None, horizon=HORIZON):
+    """Train from float32 feature shards on disk, one forest per shard, for cohorts larger than RAM.
+
+    The cohort is split into as many shards as needed to keep each near
+    max_shard_rows rows (at most one per tree), and n_workers shards are
+    fitted at a time. Writes the
+    same artifacts as train(). Shards go to data/cache/shards/ unless
+    shard_dir is given; see src/sharded_training.py for the memory bounds.
+    """
+    model_path, results_dir = Path(model_path), Path(results_dir)
+    shard_dir = Path(shard_dir) if shard_dir else CACHE_DIR / 'shards'
+    params = {**RF_PARAMS, **(params or {}), 'n_jobs': -1}
+    n_shards = shard_count(count_rows('treatments', data_dir), max_shard_rows, test_size, params['n_estimators'])
+    timings = {}
+
+    start = time.perf_counter()
+    label_fn = functools.partial(label_rows, horizon=horizon, warmup=WARMUP_TREATMENTS)
+    counts = write_shards(shard_dir, label_fn, n_shards, data_dir, chunk_rows, test_size, random_state,
+                          TRAINING_COLUMNS['treatments'])
+    timings['features_seconds'] = time.perf_counter() - start
+    print(f"Wrote {sum(counts.values()):,} rows to {n_shards} training shards + test shard "
+          f"in {timings['features_seconds']:.1f}s")
+
+    start = time.perf_counter()
+    model, worker_peaks = fit_sharded_forest(shard_dir, n_shards, params, n_workers, random_state)
+    timings['training_seconds'] = time.perf_counter() - start
+    print(f"Model trained in {timings['training_seconds']:.1f} seconds ({model.n_estimators} trees)")
+
+    start = time.perf_counter()
+    y_test, y_pred_prob = [], []
+    for X_batch, y_batch in iter_shard_batches(shard_path(shard_dir, TEST_SHARD), chunk_rows):
+        y_test.append(y_batch)
+        y_pred_prob.append(model.predict_proba(pd.DataFrame(X_batch, columns=MODEL_FEATURES))[:, 1])
+    y_test, y_pred_prob = np.concatenate(y_test), np.concatenate(y_pred_prob)
+    timings['evaluation_seconds'] = time.perf_counter() - start
+
+    split = {'grouped_by': 'patient_id', 'test_size': test_size, 'random_state': random_state,
+             'shards': n_shards, 'max_shard_rows': max_shard_rows, 'fit_workers': n_workers, 'chunk_rows': chunk_rows,
+             'train_rows': sum(count for shard, count in counts.items() if shard != TEST_SHARD),
+             'test_rows': counts[TEST_SHARD]}
+    return _save_artifacts(model, y_test, y_pred_prob, data_dir, model_path, results_dir,
+                           {'label': _label_settings(horizon),
+                            'hyperparameters': {**params, 'random_state': random_state}, 'split': split,
+                            **timings, 'peak_rss_mb_workers': max(worker_peaks)})
+
+
+def _label_settings(horizon):
+    return {'column': label_column(horizon), 'horizon': horizon, 'warmup_treatments': WARMUP_TREATMENTS}
+
+
+def horizon_paths(model_path, results_dir, horizon):
+    """(model_path, results_dir) for a horizon: unchanged for HORIZON, suffixed _h{horizon} otherwise."""
+    model_path, results_dir = Path(model_path), Path(results_dir)
+    if horizon == HORIZON:
+        return model_path, results_dir
+    return (model_path.with_name(f'{model_path.stem}_h{horizon}{model_path.suffix}'),
+            results_dir / f'horizon_{horizon}')
+
+
+def _save_artifacts(model, y_test, y_pred_prob, data_dir, model_path, results_dir, details):
+    """Evaluate on the held-out patients and atomically write the model, results and manifest."""
+    y_pred = (y_pred_prob >= 0.5).astype(int)
+    metrics = {
+        'auc_roc': roc_auc_score(y_test, y_pred_prob),
+        'recall': recall_score(y_test, y_pred),
+        'precision': precision_score(y_test, y_pred),
+    }
+    print(f"AUC-ROC: {metrics['auc_roc']:.4f}  Recall: {metrics['recall']:.1%}  Precision: {metrics['precision']:.1%}")
+
+    feature_importance = pd.DataFrame({
+        'feature': MODEL_FEATURES,
+        'importance': model.feature_importances_,
+    }).sort_values('importance', ascending=False)
+    test_predictions = pd.DataFrame({
+        'actual': y_test,
+        'predicted': y_pred,
+        'predicted_probability': y_pred_prob,
+    })
+
+    with atomic_write(model_path) as tmp:
+        joblib.dump(model, tmp)
+    model_digest = file_digest(model_path)
+    compiled_path = model_path.with_suffix(COMPILED_SUFFIX)
+    CompiledForest.from_sklearn(model).save(compiled_path, source_digest=model_digest)
+    _write_json(metrics, results_dir / 'metrics.json')
+    _write_csv(feature_importance, results_dir / 'feature_importance.csv')
+    _write_csv(test_predictions, results_dir / 'test_predictions.csv')
+
+    manifest = {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'model_path': str(model_path),
+        'model_digest': model_digest,
+        'compiled_model_path': str(compiled_path),
+        'data': raw_fingerprint(data_dir, CACHE_DIR),
+        'feature_pipeline_version': FEATURE_PIPELINE_VERSION,
+        'features': MODEL_FEATURES,
+        **details,
+        'metrics': metrics,
+        'peak_rss_mb': _peak_rss_mb(),
+        'versions': {'python': platform.python_version(), 'sklearn': sklearn.__version__,
+                     'pandas': pd.__version__},
+    }
+    _write_json(manifest, results_dir / MANIFEST_FILE)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the AVF failure model from the raw tables.')
+    parser.add_argument('--data-dir', default=str(RAW_DATA_DIR))
+    parser.add_argument('--model-path', default=str(MODEL_PATH))
+    parser.add_argument('--results-dir', default=str(RESULTS_DIR))
+    parser.add_argument('--n-jobs', type=int, default=-1, help='cores used to fit the forest (default: all)')
+    parser.add_argument('--test-size', type=float, default=TEST_SIZE)
+    parser.add_argument('--seed', type=int, default=RANDOM_STATE)
+    parser.add_argument('--search', action='store_true',
+                        help='run the patient-grouped successive-halving search first and train with its best params')
+    parser.add_argument('--params', help=f'train with best_params from a saved {SEARCH_FILE}')
+    parser.add_argument('--n-candidates', type=int, default=30, help='configurations in the first search round')
+    parser.add_argument('--factor', type=int, default=3, help='keep the best 1/factor candidates each round')
+    parser.add_argument('--resource', choices=['n_samples', 'n_estimators'], default='n_samples')
+    parser.add_argument('--n-splits', type=int, default=N_SPLITS, help='patient-grouped CV folds')
+    parser.add_argument('--out-of-core', action='store_true',
+                        help='stream float32 feature shards to disk and fit one forest per shard (bounded memory)')
+    parser.add_argument('--max-shard-rows', type=int, default=MAX_SHARD_ROWS,
+                        help="rows per training shard; bounds each fitting worker's memory (--out-of-core)")
+    parser.add_argument('--n-workers', type=int, default=1,
+                        help="shards fitted at once; each adds a shard's memory to the peak (--out-of-core)")
+    parser.add_argument('--chunk-rows', type=int, default=1_000_000, help='sessions per feature chunk (--out-of-core)')
+    parser.add_argument('--shard-dir', help='where to write the shards (default: data/cache/shards)')
+    parser.add_argument('--horizon', type=int, nargs='+', default=[HORIZON],
+                        help=f'label horizons in treatments, one model each (default: {HORIZON})')
+    args = parser.parse_args()
+
+    metrics = {}
+    for horizon in args.horizon:
+        model_path, results_dir = horizon_paths(args.model_path, args.results_dir, horizon)
+        params = None
+        if args.search:
+            print("=" * 60)
+            print(f"HYPERPARAMETER SEARCH (patient-grouped CV, successive halving, {label_column(horizon)})")
+            print("=" * 60)
+            params = select_hyperparameters(args.data_dir, results_dir, args.n_candidates, args.factor,
+                                            args.resource, args.n_splits, args.n_jobs, args.test_size,
+                                            args.seed, horizon)['best_params']
+        elif args.params:
+            params = json.loads(Path(args.params).read_text())['best_params']
+
+        print("=" * 60)
+        print(f"TRAINING RANDOM FOREST MODEL ({label_column(horizon)})")
+        print("=" * 60)
+        if args.out_of_core:
+            manifest = train_out_of_core(args.data_dir, model_path, results_dir, args.max_shard_rows,
+                                         args.n_workers, args.chunk_rows, args.test_size, args.seed, params,
+                                         args.shard_dir, horizon)
+        else:
+            manifest = train(args.data_dir, model_path, results_dir, args.n_jobs,
+                             args.test_size, args.seed, params, horizon)
+        metrics[horizon] = manifest['metrics']
+        print(f"\n✓ Model saved to {model_path} and {manifest['compiled_model_path']}")
+        print(f"✓ Metrics, feature importance, test predictions and {MANIFEST_FILE} saved to {results_dir}")
+        if manifest['peak_rss_mb'] is not None:
+            print(f"Peak memory: {manifest['peak_rss_mb']:,.0f} MB\n")
+
+    if len(metrics) > 1:
+        print(f"{'horizon':>8} {'AUC-ROC':>8} {'recall':>7} {'precision':>10}")
+        for horizon, horizon_metrics in metrics.items():
+            print(f"{horizon:>8} {horizon_metrics['auc_roc']:>8.4f} {horizon_metrics['recall']:>7.1%} "
+                  f"{horizon_metrics['precision']:>10.1%}")
@@ -0,0 +1,42 @@
+"""Project paths and small file helpers shared by the data, feature and model code."""
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DATA_DIR = PROJECT_ROOT / 'data'
+CACHE_DIR = DATA_DIR / 'cache'
+MODELS_DIR = PROJECT_ROOT / 'models'
+RESULTS_DIR = PROJECT_ROOT / 'results'
+
+_HASH_BLOCK = 1 << 20
+
+
+@contextmanager
+def atomic_write(path):
+    """Yield a temporary path next to `path` and move it into place on success.
+
+    Readers (including other processes) see either the old file or the complete
+    new one, never a partial write; the temporary file is removed on error.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+    os.close(fd)
+    try:
+        yield Path(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def file_digest(path):
+    """BLAKE2b hex digest of a file's contents, read in 1 MiB blocks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()